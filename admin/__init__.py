@@ -1 +1 @@
-from . import views
\ No newline at end of file
+from . import importer, jobs, views
\ No newline at end of file
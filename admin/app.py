@@ -1,6 +1,7 @@
 from flask import Flask
 from flask_appbuilder import AppBuilder, SQLA
 from config_reader import db_link, secret_key
+from data.model import engine_options
 from admin.views import (
     CategoriesView,
     AccessoryBrandsView,
@@ -24,6 +25,7 @@ app = Flask(__name__)
 app.config["SQLALCHEMY_DATABASE_URI"] = db_link
 app.config['SECRET_KEY'] = secret_key
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(db_link)
 
 db = SQLA(app)
 appbuilder = AppBuilder(app, db.session)
@@ -0,0 +1,657 @@
+import csv
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    Table as SqlTable,
+    and_,
+    bindparam,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    text,
+    update
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from data.model import (
+    Categories,
+    AccessoryBrands,
+    DeviceBrands,
+    DeviceModels,
+    Series,
+    Variations,
+    Colors,
+    Products
+)
+
+# =============================
+# ПАКЕТНЫЙ ИМПОРТ КАТАЛОГА
+# =============================
+
+# Колонки файла -> колонки нормализованной таблицы
+TEXT_COLUMNS = {
+    "Категория": "category",
+    "Бренд": "accessory_brand",
+    "Бренд устройства": "device_brand",
+    "Модель устройства": "device_model",
+    "Серия": "series",
+    "Вариация": "variation",
+    "Цвет": "color",
+}
+PRICE_COLUMN = "Цена"
+
+# Без этих колонок файл не принимается
+REQUIRED_COLUMNS = ("Категория", "Бренд")
+
+# Форматы, которые читаются потоково
+ALLOWED_EXTENSIONS = {"xlsx", "csv"}
+
+# Справочники, где запись определяется только названием
+NAME_DICTIONARIES = {
+    "category": Categories,
+    "accessory_brand": AccessoryBrands,
+    "device_brand": DeviceBrands,
+    "series": Series,
+    "variation": Variations,
+    "color": Colors,
+}
+
+# Колонки uq_product_combination
+PRODUCT_KEY = (
+    "category_id",
+    "accessory_brand_id",
+    "device_model_id",
+    "series_id",
+    "variation_id",
+    "color_id",
+)
+
+# Сколько продуктов записывать одним запросом
+CHUNK_SIZE = 1000
+
+# Сколько ошибок по строкам сохранять для отчета
+MAX_REPORTED_ERRORS = 1000
+
+# Номер строки в файле = индекс строки таблицы + 2 (первая строка - заголовок)
+FIRST_DATA_ROW = 2
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Привести таблицу из файла к колонкам category ... color, price векторными операциями.
+    Строки без категории или бренда отбрасываются, модель устройства без бренда устройства не учитывается.
+    """
+    df = df.rename(columns=lambda title: str(title).strip())
+    frame = pd.DataFrame(index=df.index)
+    for title, column in TEXT_COLUMNS.items():
+        if title in df.columns:
+            values = df[title].astype("string").str.strip()
+            frame[column] = values.mask(values == "")
+        else:
+            frame[column] = pd.Series(pd.NA, index=df.index, dtype="string")
+
+    if PRICE_COLUMN in df.columns:
+        price = pd.to_numeric(df[PRICE_COLUMN], errors="coerce")
+        frame["price"] = np.trunc(price).astype("Int64")
+    else:
+        frame["price"] = pd.Series(pd.NA, index=df.index, dtype="Int64")
+
+    frame = frame[frame["category"].notna() & frame["accessory_brand"].notna()].copy()
+    frame.loc[frame["device_brand"].isna(), "device_model"] = pd.NA
+    return frame
+
+
+# ---------- потоковое чтение файла ----------
+
+# total_rows - оценка числа строк данных (None, если заранее неизвестно), chunks - генератор таблиц
+Table = namedtuple("Table", ["total_rows", "chunks"])
+
+
+def _header(values) -> list:
+    header = ["" if value is None else str(value).strip() for value in values]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"В файле нет обязательных колонок: {', '.join(missing)}")
+    return header
+
+
+def _excel_chunks(workbook, rows, header: list, chunk_size: int):
+    """Строки листа пачками; индекс строки = номер строки в файле - FIRST_DATA_ROW"""
+    try:
+        width = len(header)
+        values = []
+        index = []
+        for row_number, row in enumerate(rows, start=FIRST_DATA_ROW):
+            row = row[:width]
+            # Пустые строки (часто в конце листа) не считаем ни данными, ни ошибками
+            if all(value is None or value == "" for value in row):
+                continue
+            values.append(row + (None,) * (width - len(row)))
+            index.append(row_number - FIRST_DATA_ROW)
+            if len(values) >= chunk_size:
+                yield pd.DataFrame(values, columns=header, index=index)
+                values = []
+                index = []
+        if values:
+            yield pd.DataFrame(values, columns=header, index=index)
+    finally:
+        workbook.close()
+
+
+def _read_excel(file_path: str, chunk_size: int) -> Table:
+    # read_only: строки читаются из XML листа по мере обхода, книга целиком в память не грузится
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = _header(next(rows, ()))
+    except Exception:
+        workbook.close()
+        raise
+    # Размер листа из его метаданных, может отсутствовать
+    total_rows = sheet.max_row - 1 if sheet.max_row else None
+    return Table(total_rows, _excel_chunks(workbook, rows, header, chunk_size))
+
+
+def _csv_encoding(file_path: str) -> str:
+    """utf-8 или cp1251 (так сохраняет CSV русский Excel)"""
+    with open(file_path, "rb") as file:
+        sample = file.read(64 * 1024)
+    try:
+        sample.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        # Обрезанный на границе выборки символ - не повод менять кодировку
+        if e.start < len(sample) - 3:
+            return "cp1251"
+    return "utf-8-sig"
+
+
+def _csv_chunks(reader):
+    with reader:
+        for chunk in reader:
+            chunk.columns = [str(column).strip() for column in chunk.columns]
+            yield chunk
+
+
+def _read_csv(file_path: str, chunk_size: int) -> Table:
+    encoding = _csv_encoding(file_path)
+    with open(file_path, encoding=encoding, newline="") as file:
+        first_line = file.readline()
+    try:
+        delimiter = csv.Sniffer().sniff(first_line, delimiters=";,\t").delimiter
+    except csv.Error:
+        delimiter = ","
+    _header(next(csv.reader([first_line], delimiter=delimiter), []))
+
+    reader = pd.read_csv(
+        file_path,
+        sep=delimiter,
+        encoding=encoding,
+        dtype=str,
+        keep_default_na=False,
+        chunksize=chunk_size
+    )
+    return Table(None, _csv_chunks(reader))
+
+
+def read_table(file_path: str, chunk_size: int = CHUNK_SIZE) -> Table:
+    """
+    Открыть файл каталога (xlsx или csv) для потокового чтения.
+    Заголовок проверяется сразу, строки читаются пачками по chunk_size
+    при обходе Table.chunks - файл разбирается один раз.
+    """
+    extension = file_path.rsplit(".", 1)[-1].lower()
+    if extension == "xlsx":
+        return _read_excel(file_path, chunk_size)
+    if extension == "csv":
+        return _read_csv(file_path, chunk_size)
+    raise ValueError(f"Недопустимый формат файла: {extension}")
+
+
+def _records(frame: pd.DataFrame, columns) -> list:
+    """Строки таблицы в виде словарей, пропуски - None"""
+    subset = frame[list(columns)].astype(object)
+    return subset.where(subset.notna(), None).to_dict("records")
+
+
+class CatalogImporter:
+    """
+    Импорт каталога в открытой синхронной сессии.
+    Справочники разрешаются одним запросом на выборку и одним на вставку для каждой
+    таблицы (уже известные названия запоминаются), продукты пишутся пачками.
+    Транзакцией управляет вызывающий код.
+    """
+
+    def __init__(self, session, chunk_size: int = CHUNK_SIZE, on_progress=None):
+        """
+        :param on_progress: функция, которая вызывается с импортером после каждой пачки
+        """
+        self.session = session
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.ids = {facet: {} for facet in NAME_DICTIONARIES}
+        self.device_model_ids = {}
+        self._products = None
+        self.processed_rows = 0
+        self.added_count = 0
+        self.updated_count = 0
+        self.error_count = 0
+        self.skipped_count = 0
+        # Ошибки по строкам: (номер строки в файле, текст)
+        self.errors = []
+
+    def _add_errors(self, indexes, message: str):
+        for index in indexes:
+            if len(self.errors) >= MAX_REPORTED_ERRORS:
+                break
+            self.errors.append((int(index) + FIRST_DATA_ROW, message))
+
+    def _report(self):
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def skip(self, indexes):
+        """Отметить строки файла без обязательных полей"""
+        self.skipped_count += len(indexes)
+        self.processed_rows += len(indexes)
+        self._add_errors(indexes, "Не указана категория или бренд - строка пропущена")
+
+    # ---------- справочники ----------
+
+    def _resolve_names(self, facet: str, names):
+        model = NAME_DICTIONARIES[facet]
+        known = self.ids[facet]
+        missing = {name for name in names if name not in known}
+        if not missing:
+            return
+
+        for part in _chunks(sorted(missing), self.chunk_size):
+            known.update(self.session.execute(
+                select(model.name, model.id).where(model.name.in_(part))
+            ).all())
+        missing = [name for name in missing if name not in known]
+        for part in _chunks(sorted(missing), self.chunk_size):
+            known.update(self.session.execute(
+                pg_insert(model)
+                .values([{"name": name} for name in part])
+                .on_conflict_do_nothing(index_elements=["name"])
+                .returning(model.name, model.id)
+            ).all())
+
+        # Названия, добавленные параллельно (например, в админке), вставка не вернула
+        missing = [name for name in missing if name not in known]
+        if missing:
+            known.update(self.session.execute(
+                select(model.name, model.id).where(model.name.in_(missing))
+            ).all())
+
+    def _resolve_device_models(self, pairs):
+        known = self.device_model_ids
+        missing = {pair for pair in pairs if pair not in known}
+        if not missing:
+            return
+
+        names = sorted({name for _, name in missing})
+        for part in _chunks(names, self.chunk_size):
+            rows = self.session.execute(
+                select(DeviceModels.device_brand_id, DeviceModels.name, func.min(DeviceModels.id))
+                .where(DeviceModels.name.in_(part))
+                .group_by(DeviceModels.device_brand_id, DeviceModels.name)
+            ).all()
+            known.update({(brand_id, name): model_id for brand_id, name, model_id in rows})
+        missing = sorted(pair for pair in missing if pair not in known)
+        for part in _chunks(missing, self.chunk_size):
+            rows = self.session.execute(
+                pg_insert(DeviceModels)
+                .values([{"device_brand_id": brand_id, "name": name} for brand_id, name in part])
+                .returning(DeviceModels.device_brand_id, DeviceModels.name, DeviceModels.id)
+            ).all()
+            known.update({(brand_id, name): model_id for brand_id, name, model_id in rows})
+
+    def resolve(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """Добавить к нормализованной таблице id справочников, создав недостающие записи"""
+        frame = frame.copy()
+        for facet in NAME_DICTIONARIES:
+            names = frame[facet].dropna().unique()
+            self._resolve_names(facet, names)
+            frame[f"{facet}_id"] = frame[facet].map(self.ids[facet]).astype("Int64")
+
+        models = frame.loc[frame["device_model"].notna(), ["device_brand_id", "device_model"]].drop_duplicates()
+        pairs = list(zip(models["device_brand_id"].astype(int), models["device_model"]))
+        self._resolve_device_models(pairs)
+        model_ids = pd.Series(
+            [self.device_model_ids.get(pair) for pair in pairs],
+            index=pd.MultiIndex.from_tuples(pairs, names=["device_brand_id", "device_model"]) if pairs else None,
+            dtype="Int64",
+            name="device_model_id"
+        )
+        if pairs:
+            frame = frame.join(model_ids, on=["device_brand_id", "device_model"])
+        else:
+            frame["device_model_id"] = pd.Series(pd.NA, index=frame.index, dtype="Int64")
+        return frame
+
+    # ---------- продукты ----------
+
+    def _load_products(self) -> dict:
+        """Все продукты по набору колонок uq_product_combination (одним запросом)"""
+        if self._products is None:
+            rows = self.session.execute(
+                select(Products.id, *(getattr(Products, column) for column in PRODUCT_KEY))
+            ).all()
+            self._products = {tuple(row[1:]): row[0] for row in rows}
+        return self._products
+
+    def upsert(self, frame: pd.DataFrame):
+        """
+        Записать продукты пачками по chunk_size.
+        Уникальный ключ содержит NULL-колонки, а NULL в нем не конфликтуют,
+        поэтому существующие продукты находим по загруженному ключу и обновляем
+        по id, а новые вставляем с ON CONFLICT ON CONSTRAINT uq_product_combination.
+        """
+        # Повторы строки в файле - побеждает последняя
+        deduplicated = frame.drop_duplicates(subset=list(PRODUCT_KEY), keep="last")
+        self.processed_rows += len(frame) - len(deduplicated)
+        frame = deduplicated
+        products = self._load_products()
+        records = list(zip(frame.index, _records(frame, PRODUCT_KEY + ("price",))))
+
+        for part in _chunks(records, self.chunk_size):
+            updates = []
+            inserts = []
+            for _, record in part:
+                product_id = products.get(tuple(record[column] for column in PRODUCT_KEY))
+                if product_id is None:
+                    inserts.append({**record, "is_active": True})
+                else:
+                    updates.append({"product_id": product_id, "new_price": record["price"]})
+
+            try:
+                with self.session.begin_nested():
+                    if updates:
+                        self.session.execute(
+                            update(Products.__table__)
+                            .where(Products.__table__.c.id == bindparam("product_id"))
+                            .values(
+                                price=func.coalesce(bindparam("new_price"), Products.__table__.c.price),
+                                is_active=True
+                            ),
+                            updates
+                        )
+                    if inserts:
+                        insert_stmt = pg_insert(Products).values(inserts)
+                        rows = self.session.execute(
+                            insert_stmt.on_conflict_do_update(
+                                constraint="uq_product_combination",
+                                set_={
+                                    "price": func.coalesce(insert_stmt.excluded.price, Products.price),
+                                    "is_active": True,
+                                }
+                            ).returning(Products.id, *(getattr(Products, column) for column in PRODUCT_KEY))
+                        ).all()
+                        products.update({tuple(row[1:]): row[0] for row in rows})
+            except SQLAlchemyError as e:
+                self.error_count += len(part)
+                self._add_errors([index for index, _ in part], f"Ошибка записи в БД: {str(e)[:200]}")
+                print(f"Ошибка записи пачки продуктов: {e}")
+            else:
+                self.updated_count += len(updates)
+                self.added_count += len(inserts)
+
+            self.processed_rows += len(part)
+            self._report()
+
+    def import_frame(self, df: pd.DataFrame):
+        """Импортировать таблицу из файла (или очередную пачку строк)"""
+        frame = normalize_frame(df)
+        self.skip(df.index.difference(frame.index))
+        self.upsert(self.resolve(frame))
+        return self.added_count, self.updated_count, self.error_count
+
+    def import_chunks(self, chunks):
+        """
+        Импортировать файл пачками из read_table: в памяти одновременно только одна пачка,
+        а справочники и ключи продуктов накапливаются между пачками
+        """
+        for df in chunks:
+            self.import_frame(df)
+        return self.added_count, self.updated_count, self.error_count
+
+
+# =============================
+# ПОЛНАЯ СИНХРОНИЗАЦИЯ КАТАЛОГА
+# =============================
+
+# Сколько примеров каждого вида изменений показывать в предпросмотре
+PREVIEW_LIMIT = 20
+
+# Промежуточная таблица с содержимым файла: временная, удаляется в конце транзакции
+_staging_metadata = MetaData()
+staging = SqlTable(
+    "import_staging",
+    _staging_metadata,
+    Column("row_number", Integer, primary_key=True),
+    Column("product_id", Integer),
+    *(Column(column, Integer) for column in PRODUCT_KEY),
+    Column("price", Integer),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP"
+)
+
+
+def _same_key(left, right):
+    """
+    Совпадение ключа uq_product_combination с продуктом (right - колонки products).
+    Для NULL-колонок сравниваем через COALESCE, а не IS NOT DISTINCT FROM,
+    чтобы Postgres мог соединять таблицы хэшированием
+    """
+    conditions = []
+    for column in PRODUCT_KEY:
+        left_column, right_column = getattr(left, column), getattr(right, column)
+        if right_column.nullable:
+            conditions.append(func.coalesce(left_column, 0) == func.coalesce(right_column, 0))
+        else:
+            conditions.append(left_column == right_column)
+    return and_(*conditions)
+
+
+def _named(source, keys):
+    """source, соединенный со справочниками по колонкам ключа keys, и выражение названия продукта"""
+    source = (
+        source
+        .outerjoin(Categories, Categories.id == keys.category_id)
+        .outerjoin(AccessoryBrands, AccessoryBrands.id == keys.accessory_brand_id)
+        .outerjoin(DeviceModels, DeviceModels.id == keys.device_model_id)
+        .outerjoin(DeviceBrands, DeviceBrands.id == DeviceModels.device_brand_id)
+        .outerjoin(Series, Series.id == keys.series_id)
+        .outerjoin(Variations, Variations.id == keys.variation_id)
+        .outerjoin(Colors, Colors.id == keys.color_id)
+    )
+    name = func.concat_ws(
+        " ",
+        Categories.name,
+        AccessoryBrands.name,
+        DeviceBrands.name,
+        DeviceModels.name,
+        Series.name,
+        Variations.name,
+        Colors.name
+    ).label("name")
+    return source, name
+
+
+class CatalogSync(CatalogImporter):
+    """
+    Полная синхронизация: файл загружается во временную таблицу, изменения
+    (добавленные, измененные, неизменные, удаленные) считаются запросами над
+    множествами, применяются только реальные изменения, а активные товары,
+    которых нет в файле, выключаются. Все - в транзакции вызывающего кода:
+    для предпросмотра ее достаточно откатить.
+    """
+
+    def __init__(self, session, chunk_size: int = CHUNK_SIZE, on_progress=None):
+        super().__init__(session, chunk_size, on_progress)
+        self.unchanged_count = 0
+        self.removed_count = 0
+        self.preview = {"added": [], "changed": [], "removed": []}
+
+    # ---------- загрузка ----------
+
+    def load(self, chunks):
+        """Разрешить справочники и записать строки файла во временную таблицу"""
+        staging.create(self.session.connection())
+        for df in chunks:
+            frame = normalize_frame(df)
+            self.skip(df.index.difference(frame.index))
+            frame = self.resolve(frame)
+            frame["row_number"] = frame.index + FIRST_DATA_ROW
+            records = _records(frame, ("row_number",) + PRODUCT_KEY + ("price",))
+            if records:
+                self.session.execute(insert(staging), records)
+            self.processed_rows += len(records)
+            self._report()
+
+        # Повторы строки в файле - побеждает последняя (GROUP BY считает NULL равными)
+        last_rows = select(func.max(staging.c.row_number)).group_by(*(staging.c[column] for column in PRODUCT_KEY))
+        self.session.execute(delete(staging).where(staging.c.row_number.not_in(last_rows)))
+
+        self.session.execute(
+            update(staging)
+            .values(product_id=Products.id)
+            .where(_same_key(staging.c, Products.__table__.c))
+        )
+        self.session.execute(text("ANALYZE import_staging"))
+
+    # ---------- разница ----------
+
+    def _changed(self):
+        """Условие: у найденного продукта меняется цена или он был выключен"""
+        return or_(
+            Products.price.is_distinct_from(func.coalesce(staging.c.price, Products.price)),
+            Products.is_active.is_not(True)
+        )
+
+    def _removed(self):
+        """Условие: активный продукт, которого нет в файле"""
+        return and_(
+            Products.is_active == True,
+            ~exists().where(staging.c.product_id == Products.id)
+        )
+
+    def diff(self):
+        """Посчитать изменения и собрать примеры для предпросмотра"""
+        matched = staging.join(Products, Products.id == staging.c.product_id)
+        changed = self._changed()
+        self.added_count, self.updated_count, self.unchanged_count = self.session.execute(
+            select(
+                func.count().filter(staging.c.product_id.is_(None)),
+                func.count(Products.id).filter(changed),
+                func.count(Products.id).filter(~changed)
+            ).select_from(staging.outerjoin(Products, Products.id == staging.c.product_id))
+        ).one()
+        self.removed_count = self.session.execute(
+            select(func.count(Products.id)).where(self._removed())
+        ).scalar()
+
+        source, name = _named(staging, staging.c)
+        self.preview["added"] = [
+            {"row": row.row_number, "product": row.name, "price": row.price}
+            for row in self.session.execute(
+                select(staging.c.row_number, name, staging.c.price)
+                .select_from(source)
+                .where(staging.c.product_id.is_(None))
+                .order_by(staging.c.row_number)
+                .limit(PREVIEW_LIMIT)
+            )
+        ]
+        source, name = _named(matched, staging.c)
+        self.preview["changed"] = [
+            {
+                "row": row.row_number,
+                "product": row.name,
+                "old_price": row.old_price,
+                "new_price": row.new_price,
+                "reactivated": not row.is_active,
+            }
+            for row in self.session.execute(
+                select(
+                    staging.c.row_number,
+                    name,
+                    Products.price.label("old_price"),
+                    func.coalesce(staging.c.price, Products.price).label("new_price"),
+                    func.coalesce(Products.is_active, False).label("is_active")
+                )
+                .select_from(source)
+                .where(changed)
+                .order_by(staging.c.row_number)
+                .limit(PREVIEW_LIMIT)
+            )
+        ]
+        source, name = _named(Products.__table__, Products.__table__.c)
+        self.preview["removed"] = [
+            {"id": row.id, "product": row.name, "price": row.price}
+            for row in self.session.execute(
+                select(Products.id, name, Products.price)
+                .select_from(source)
+                .where(self._removed())
+                .order_by(Products.id)
+                .limit(PREVIEW_LIMIT)
+            )
+        ]
+
+    # ---------- применение ----------
+
+    def apply(self):
+        """Записать только реальные изменения: три запроса над множествами"""
+        self.session.execute(
+            update(Products.__table__)
+            .values(price=func.coalesce(staging.c.price, Products.__table__.c.price), is_active=True)
+            .where(Products.__table__.c.id == staging.c.product_id)
+            .where(self._changed())
+        )
+        # До вставки: у новых продуктов нет product_id в import_staging, их выключать нельзя
+        self.session.execute(
+            update(Products.__table__)
+            .values(is_active=False)
+            .where(self._removed())
+        )
+        columns = PRODUCT_KEY + ("price",)
+        insert_stmt = pg_insert(Products).from_select(
+            columns + ("is_active",),
+            select(*(staging.c[column] for column in columns), literal(True))
+            .where(staging.c.product_id.is_(None))
+            .order_by(staging.c.row_number)
+        )
+        self.session.execute(
+            insert_stmt.on_conflict_do_update(
+                constraint="uq_product_combination",
+                set_={
+                    "price": func.coalesce(insert_stmt.excluded.price, Products.price),
+                    "is_active": True,
+                }
+            )
+        )
+
+    def sync_chunks(self, chunks, dry_run: bool = False):
+        """Загрузить файл, посчитать изменения и, если это не предпросмотр, применить их"""
+        self.load(chunks)
+        self.diff()
+        if not dry_run:
+            self.apply()
+        return self.added_count, self.updated_count, self.unchanged_count, self.removed_count
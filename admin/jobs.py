@@ -0,0 +1,121 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from admin.importer import CatalogImporter, CatalogSync, read_table
+from config_reader import config
+from data.crud import (
+    SyncSessionLocal,
+    bump_catalog_version_sync,
+    get_expired_import_previews_sync,
+    get_import_job_sync,
+    update_import_job_sync
+)
+
+# =============================
+# ФОНОВЫЕ ЗАДАНИЯ ИМПОРТА
+# =============================
+
+# Импорт идет в фоновых потоках процесса админки, HTTP-запрос только ставит задание
+_executor = ThreadPoolExecutor(max_workers=config.import_workers, thread_name_prefix="catalog-import")
+
+# Сколько хранить файл предпросмотра синхронизации, который так и не применили
+PREVIEW_TTL = timedelta(days=1)
+
+
+def submit_import_job(job_id: int):
+    """Поставить задание в очередь на импорт"""
+    _executor.submit(run_import_job, job_id)
+
+
+def _remove_file(file_path: str):
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
+
+
+def cleanup_import_previews():
+    """Удалить файлы старых непримененных предпросмотров"""
+    for job in get_expired_import_previews_sync(datetime.now() - PREVIEW_TTL):
+        _remove_file(job.file_path)
+        update_import_job_sync(job.id, file_path=None)
+
+
+def _progress_values(importer: CatalogImporter) -> dict:
+    values = {
+        "processed_rows": importer.processed_rows,
+        "added_count": importer.added_count,
+        "updated_count": importer.updated_count,
+        "error_count": importer.error_count,
+    }
+    if isinstance(importer, CatalogSync):
+        values["unchanged_count"] = importer.unchanged_count
+        values["removed_count"] = importer.removed_count
+    return values
+
+
+def run_import_job(job_id: int):
+    """Выполнить задание импорта: статус, прогресс и ошибки по строкам пишутся в import_jobs"""
+    job = get_import_job_sync(job_id)
+    file_path = job.file_path
+    update_import_job_sync(job_id, status="running", started_at=datetime.now())
+    importer = None
+    table = None
+    keep_file = False
+    session = SyncSessionLocal()
+    try:
+        # Заголовок проверяется здесь, строки читаются по мере импорта
+        table = read_table(file_path)
+        update_import_job_sync(job_id, total_rows=table.total_rows)
+
+        importer_class = CatalogSync if job.mode == "sync" else CatalogImporter
+        importer = importer_class(
+            session,
+            on_progress=lambda current: update_import_job_sync(job_id, **_progress_values(current))
+        )
+        values = {}
+        if job.mode == "sync":
+            importer.sync_chunks(table.chunks, dry_run=job.dry_run)
+            values["preview"] = json.dumps(importer.preview, ensure_ascii=False)
+        else:
+            importer.import_chunks(table.chunks)
+
+        if job.dry_run:
+            # Предпросмотр: все изменения (и новые записи справочников) откатываем,
+            # файл оставляем, чтобы применить синхронизацию без повторной загрузки
+            session.rollback()
+            keep_file = True
+        else:
+            # Сохраняем все изменения вместе с новой версией каталога
+            bump_catalog_version_sync(session)
+            session.commit()
+        update_import_job_sync(
+            job_id,
+            status="done",
+            finished_at=datetime.now(),
+            # Для CSV число строк заранее неизвестно, а размер листа xlsx - лишь оценка
+            total_rows=importer.processed_rows,
+            errors=json.dumps([{"row": row, "error": error} for row, error in importer.errors], ensure_ascii=False),
+            file_path=file_path if keep_file else None,
+            **values,
+            **_progress_values(importer)
+        )
+    except Exception as e:
+        session.rollback()
+        print(f"Ошибка импорта из файла: {e}")
+        values = _progress_values(importer) if importer else {}
+        update_import_job_sync(
+            job_id,
+            status="failed",
+            finished_at=datetime.now(),
+            message=str(e)[:500],
+            file_path=None,
+            **values
+        )
+    finally:
+        if table is not None:
+            # Закрыть файл, даже если импорт прервался на середине
+            table.chunks.close()
+        session.close()
+        if not keep_file:
+            _remove_file(file_path)
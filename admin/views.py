@@ -2,14 +2,14 @@ from aiohttp import request
 from flask_appbuilder import has_access, BaseView, expose
 from flask_appbuilder.views import ModelView
 from flask_appbuilder.models.sqla.interface import SQLAInterface
-from openpyxl.reader.excel import load_workbook
 from werkzeug.utils import secure_filename
 from wtforms import FileField
-from flask import request, url_for, redirect, flash, render_template
+from flask import request, url_for, redirect, flash, render_template, jsonify
 from config_reader import base_dir
 from markupsafe import Markup
+import json
 import os
-from io import BytesIO
+import uuid
 import pandas as pd
 
 from data.model import (
@@ -30,13 +30,38 @@ from data.model import (
     CartItems
 )
 
-from data.crud import get_or_create_sync, SyncSessionLocal
+from admin.importer import ALLOWED_EXTENSIONS
+from admin.jobs import submit_import_job, cleanup_import_previews
+from data.crud import (
+    file_content_hash,
+    image_full_path,
+    mark_catalog_change_sync,
+    create_import_job_sync,
+    get_import_job_sync,
+    get_recent_import_jobs_sync,
+    take_import_job_file_sync
+)
 
 # =============================
 # VIEWS ДЛЯ ОСНОВНЫХ СУЩНОСТЕЙ
 # =============================
 
-class CategoriesView(ModelView):
+class CatalogChangeMixin:
+    """
+    Любое изменение каталога перестраивает catalog_facets и увеличивает версию каталога
+    (бот сбросит закэшированные карточки и индекс) в той же транзакции, что и сама правка
+    """
+
+    def pre_add(self, item):
+        mark_catalog_change_sync(self.datamodel.session)
+
+    def pre_update(self, item):
+        mark_catalog_change_sync(self.datamodel.session)
+
+    def pre_delete(self, item):
+        mark_catalog_change_sync(self.datamodel.session)
+
+class CategoriesView(CatalogChangeMixin, ModelView):
     datamodel = SQLAInterface(Categories)
 
     columns = ["sort_order", "name"]
@@ -47,7 +72,7 @@ class CategoriesView(ModelView):
 
     label_columns = {"sort_order": "Порядок", "name": "Категория"}
 
-class AccessoryBrandsView(ModelView):
+class AccessoryBrandsView(CatalogChangeMixin, ModelView):
     datamodel = SQLAInterface(AccessoryBrands)
 
     columns = ["sort_order", "name"]
@@ -58,7 +83,7 @@ class AccessoryBrandsView(ModelView):
 
     label_columns = {"sort_order": "Порядок", "name": "Бренд аксессуара"}
 
-class DeviceBrandsView(ModelView):
+class DeviceBrandsView(CatalogChangeMixin, ModelView):
     datamodel = SQLAInterface(DeviceBrands)
 
     columns = ["sort_order", "name"]
@@ -69,7 +94,7 @@ class DeviceBrandsView(ModelView):
 
     label_columns = {"sort_order": "Порядок", "name": "Бренд устройства"}
 
-class DeviceModelsView(ModelView):
+class DeviceModelsView(CatalogChangeMixin, ModelView):
     datamodel = SQLAInterface(DeviceModels)
 
     columns = ["sort_order", "name", "device_brand"]
@@ -84,7 +109,7 @@ class DeviceModelsView(ModelView):
         "device_brand": "Бренд устройства"
     }
 
-class SeriesView(ModelView):
+class SeriesView(CatalogChangeMixin, ModelView):
     datamodel = SQLAInterface(Series)
 
     columns = ["name"]
@@ -95,7 +120,7 @@ class SeriesView(ModelView):
 
     label_columns = {"name": "Серия"}
 
-class VariationsView(ModelView):
+class VariationsView(CatalogChangeMixin, ModelView):
     datamodel = SQLAInterface(Variations)
 
     columns = ["name"]
@@ -106,7 +131,7 @@ class VariationsView(ModelView):
 
     label_columns = {"name": "Вариация"}
 
-class ColorsView(ModelView):
+class ColorsView(CatalogChangeMixin, ModelView):
     datamodel = SQLAInterface(Colors)
 
     columns = ["name"]
@@ -121,7 +146,7 @@ class ColorsView(ModelView):
 # VIEWS ДЛЯ ПРОДУКТОВ
 # =============================
 
-class ProductsView(ModelView):
+class ProductsView(CatalogChangeMixin, ModelView):
     datamodel = SQLAInterface(Products)
 
     list_columns = [
@@ -201,7 +226,7 @@ class ProductImagesView(ModelView):
         "is_main": "Главное"
     }
 
-    exclude_list = ["path"]
+    exclude_list = ["path", "telegram_file_id", "content_hash"]
     add_exclude_columns = search_exclude_columns = edit_exclude_columns = show_exclude_columns = exclude_list
 
     def _save_image(self, file_storage):
@@ -213,13 +238,22 @@ class ProductImagesView(ModelView):
         file_storage.save(filepath)
         return filename
 
+    # Фото не входят в catalog_facets: меняется только версия каталога (file_id в карточках)
     def pre_add(self, item):
+        mark_catalog_change_sync(self.datamodel.session, refresh_facets=False)
         file = request.files.get("upload")
         if file and file.filename:
             saved_path = self._save_image(file)
             item.path = saved_path
+            # Новый файл - бот загрузит его в Telegram заново при первом показе
+            item.telegram_file_id = None
+            item.content_hash = file_content_hash(image_full_path(saved_path))
+
+    def pre_update(self, item):
+        mark_catalog_change_sync(self.datamodel.session, refresh_facets=False)
 
     def pre_delete(self, item):
+        mark_catalog_change_sync(self.datamodel.session, refresh_facets=False)
         if item.path:
             full_path = os.path.join(base_dir, "stock", "devices_images", item.path)
             if os.path.isfile(full_path):
@@ -310,133 +344,6 @@ class AdminsView(ModelView):
 # EXCEL UPLOAD VIEW
 # =============================
 
-def import_from_excel(file_path):
-    """
-    Импорт данных из Excel файла
-    Структура: Категория, Бренд, Бренд устройства, Модель устройства, Серия, Вариация, Цвет, Цена
-    """
-    try:
-        # Читаем Excel файл
-        df = pd.read_excel(file_path)
-        
-        # Очищаем пробелы в названиях колонок
-        df.columns = df.columns.str.strip()
-        
-        session = SyncSessionLocal()
-        added_count = 0
-        updated_count = 0
-        error_count = 0
-        
-        try:
-            for index, row in df.iterrows():
-                try:
-                    # Извлекаем данные из строки
-                    category_name = str(row.get('Категория', '')).strip() if pd.notna(row.get('Категория')) else None
-                    brand_name = str(row.get('Бренд', '')).strip() if pd.notna(row.get('Бренд')) else None
-                    device_brand_name = str(row.get('Бренд устройства', '')).strip() if pd.notna(row.get('Бренд устройства')) else None
-                    device_model_name = str(row.get('Модель устройства', '')).strip() if pd.notna(row.get('Модель устройства')) else None
-                    series_name = str(row.get('Серия', '')).strip() if pd.notna(row.get('Серия')) else None
-                    variation = str(row.get('Вариация', '')).strip() if pd.notna(row.get('Вариация')) else None
-                    color_name = str(row.get('Цвет', '')).strip() if pd.notna(row.get('Цвет')) else None
-                    
-                    # Извлекаем цену
-                    price = None
-                    if pd.notna(row.get('Цена')):
-                        try:
-                            price = int(row.get('Цена'))
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    # Пропускаем строки без обязательных полей
-                    if not category_name or not brand_name:
-                        continue
-                    
-                    # Получаем или создаем категорию
-                    category = get_or_create_sync(session, Categories, name=category_name)
-                    
-                    # Получаем или создаем бренд аксессуара
-                    accessory_brand = get_or_create_sync(session, AccessoryBrands, name=brand_name)
-                    
-                    # Получаем или создаем бренд устройства (если указан)
-                    device_brand = None
-                    if device_brand_name:
-                        device_brand = get_or_create_sync(session, DeviceBrands, name=device_brand_name)
-                    
-                    # Получаем или создаем модель устройства (если указана)
-                    device_model = None
-                    if device_model_name and device_brand:
-                        device_model = get_or_create_sync(
-                            session, 
-                            DeviceModels, 
-                            name=device_model_name,
-                            device_brand_id=device_brand.id
-                        )
-                    
-                    # Получаем или создаем серию (если указана)
-                    series = None
-                    if series_name:
-                        series = get_or_create_sync(session, Series, name=series_name)
-                    
-                    # Получаем или создаем вариацию (если указана)
-                    variation_obj = None
-                    if variation:
-                        variation_obj = get_or_create_sync(session, Variations, name=variation)
-                    
-                    # Получаем или создаем цвет (если указан)
-                    color = None
-                    if color_name:
-                        color = get_or_create_sync(session, Colors, name=color_name)
-                    
-                    # Проверяем, существует ли уже такой продукт
-                    existing_product = session.query(Products).filter_by(
-                        category_id=category.id,
-                        accessory_brand_id=accessory_brand.id,
-                        device_model_id=device_model.id if device_model else None,
-                        series_id=series.id if series else None,
-                        variation_id=variation_obj.id if variation_obj else None,
-                        color_id=color.id if color else None
-                    ).first()
-                    
-                    if existing_product:
-                        # Обновляем существующий продукт
-                        if price is not None:
-                            existing_product.price = price
-                        existing_product.is_active = True
-                        updated_count += 1
-                    else:
-                        # Создаем новый продукт
-                        product = Products(
-                            category_id=category.id,
-                            accessory_brand_id=accessory_brand.id,
-                            device_model_id=device_model.id if device_model else None,
-                            series_id=series.id if series else None,
-                            variation_id=variation_obj.id if variation_obj else None,
-                            color_id=color.id if color else None,
-                            price=price,
-                            is_active=True
-                        )
-                        session.add(product)
-                        added_count += 1
-                    
-                except Exception as e:
-                    error_count += 1
-                    print(f"Ошибка обработки строки {index + 2}: {e}")
-                    continue
-            
-            # Сохраняем все изменения
-            session.commit()
-            return added_count, updated_count, error_count
-            
-        except Exception as e:
-            session.rollback()
-            raise e
-        finally:
-            session.close()
-            
-    except Exception as e:
-        print(f"Ошибка импорта из Excel: {e}")
-        raise e
-
 class ExcelUploadView(BaseView):
     route_base = "/excel_upload"
     default_view = "upload"
@@ -455,44 +362,107 @@ class ExcelUploadView(BaseView):
                     flash("Файл не выбран.", "danger")
                     return redirect(url_for("ExcelUploadView.upload"))
                 if allowed_file(file):
-                    filename = secure_filename(file.filename)
-                    file_path = os.path.join(self.upload_folder, filename)
-                    
+                    filename = file.filename
+                    extension = filename.rsplit(".", 1)[1].lower()
+                    # Уникальное имя: несколько загрузок могут ждать в очереди одновременно.
+                    # Расширение берем из исходного имени - secure_filename убирает кириллицу
+                    file_path = os.path.join(self.upload_folder, f"{uuid.uuid4().hex}.{extension}")
+
+                    # Полная синхронизация всегда начинается с предпросмотра изменений
+                    mode = "sync" if request.form.get("mode") == "sync" else "update"
+
                     try:
-                        # Сохраняем файл
+                        # Сохраняем файл и ставим импорт в очередь, файл удалит фоновое задание
+                        cleanup_import_previews()
                         file.save(file_path)
-                        
-                        # Импортируем данные
-                        added_count, updated_count, error_count = import_from_excel(file_path)
-                        
-                        # Выводим результат
-                        if error_count == 0:
-                            flash(f"Файл успешно обработан! Добавлено: {added_count}, обновлено: {updated_count}", "success")
-                        else:
-                            flash(f"Файл обработан с ошибками. Добавлено: {added_count}, обновлено: {updated_count}, ошибок: {error_count}", "warning")
-                        
-                        # Удаляем временный файл
-                        os.remove(file_path)
-                        
+                        job_id = create_import_job_sync(
+                            filename[:255],
+                            file_path=file_path,
+                            mode=mode,
+                            dry_run=mode == "sync"
+                        )
+                        submit_import_job(job_id)
                     except Exception as e:
                         flash(f"Ошибка обработки файла: {str(e)}", "danger")
                         # Удаляем файл в случае ошибки
                         if os.path.exists(file_path):
                             os.remove(file_path)
-                    
-                    return redirect(url_for("ExcelUploadView.upload"))
+                        return redirect(url_for("ExcelUploadView.upload"))
+
+                    return redirect(url_for("ExcelUploadView.job", job_id=job_id))
                 else:
-                    flash("Недопустимый формат файла. Разрешены: xlsx, xls", "danger")
+                    flash("Недопустимый формат файла. Разрешены: xlsx, csv", "danger")
                     return redirect(url_for("ExcelUploadView.upload"))
 
-        return self.render_template("excel_upload.html")
+        return self.render_template("excel_upload.html", jobs=get_recent_import_jobs_sync())
+
+    @expose('/job/<int:job_id>')
+    @has_access
+    def job(self, job_id):
+        job = get_import_job_sync(job_id)
+        if job is None:
+            flash("Задание импорта не найдено.", "danger")
+            return redirect(url_for("ExcelUploadView.upload"))
+        return self.render_template("import_job.html", job=job)
+
+    @expose('/job/<int:job_id>/status')
+    @has_access
+    def job_status(self, job_id):
+        """Прогресс задания импорта для опроса со страницы задания"""
+        job = get_import_job_sync(job_id)
+        if job is None:
+            return jsonify({"error": "not found"}), 404
+        return jsonify({
+            "id": job.id,
+            "filename": job.filename,
+            "status": job.status,
+            "total_rows": job.total_rows,
+            "processed_rows": job.processed_rows,
+            "added_count": job.added_count,
+            "updated_count": job.updated_count,
+            "unchanged_count": job.unchanged_count,
+            "removed_count": job.removed_count,
+            "error_count": job.error_count,
+            "errors": json.loads(job.errors) if job.errors else [],
+            "preview": json.loads(job.preview) if job.preview else None,
+            "mode": job.mode,
+            "dry_run": job.dry_run,
+            "can_apply": can_apply_import_job(job),
+            "message": job.message,
+        })
+
+    @expose('/job/<int:job_id>/apply', methods=["POST"])
+    @has_access
+    def apply_job(self, job_id):
+        """Применить синхронизацию по файлу из предпросмотра"""
+        job = get_import_job_sync(job_id)
+        if job is None or not can_apply_import_job(job):
+            flash("Предпросмотр уже применен или устарел, загрузите файл заново.", "danger")
+            return redirect(url_for("ExcelUploadView.upload"))
+
+        # Файл переходит к новому заданию, повторно применить предпросмотр нельзя
+        file_path = take_import_job_file_sync(job.id)
+        if file_path is None:
+            flash("Предпросмотр уже применен.", "warning")
+            return redirect(url_for("ExcelUploadView.job", job_id=job.id))
+        apply_job_id = create_import_job_sync(job.filename, file_path=file_path, mode="sync")
+        submit_import_job(apply_job_id)
+        return redirect(url_for("ExcelUploadView.job", job_id=apply_job_id))
+
+def can_apply_import_job(job):
+    """Готовый предпросмотр синхронизации, файл которого еще не применен и не удален"""
+    return (
+        job.mode == "sync"
+        and job.dry_run
+        and job.status == "done"
+        and job.file_path is not None
+        and os.path.exists(job.file_path)
+    )
 
 def allowed_file(file_storage):
-    try:
-        in_memory = BytesIO(file_storage.read())
-        load_workbook(filename=in_memory)
-        file_storage.seek(0)
-        return True
-    except Exception:
-        file_storage.seek(0)
-        return False
+    """
+    Проверка по расширению: содержимое и заголовок проверяет фоновое задание
+    при потоковом чтении, чтобы файл не разбирался дважды
+    """
+    filename = file_storage.filename or ""
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -0,0 +1,54 @@
+"""Unique cart item per user and product
+
+Revision ID: add_cart_unique_202610
+Revises: add_funnel_indexes_202610
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_cart_unique_202610'
+down_revision: Union[str, None] = 'add_funnel_indexes_202610'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Сначала сливаем дубликаты: количество суммируется в запись с наименьшим id
+    op.execute("""
+        UPDATE cart_items
+        SET quantity = totals.quantity
+        FROM (
+            SELECT MIN(id) AS id, SUM(COALESCE(quantity, 1)) AS quantity
+            FROM cart_items
+            GROUP BY user_id, product_id
+            HAVING COUNT(*) > 1
+        ) AS totals
+        WHERE cart_items.id = totals.id
+    """)
+    op.execute("""
+        DELETE FROM cart_items
+        WHERE id NOT IN (
+            SELECT MIN(id)
+            FROM cart_items
+            GROUP BY user_id, product_id
+        )
+    """)
+
+    # Уникальный constraint заменяет обычный индекс по тем же полям
+    op.drop_index('ix_cart_items_user_product', table_name='cart_items')
+    op.create_unique_constraint(
+        'uq_cart_items_user_product',
+        'cart_items',
+        ['user_id', 'product_id']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_cart_items_user_product', 'cart_items', type_='unique')
+    op.create_index('ix_cart_items_user_product', 'cart_items', ['user_id', 'product_id'])
@@ -0,0 +1,98 @@
+"""Add catalog_facets table
+
+Revision ID: add_catalog_facets_202610
+Revises: add_import_sync_202610
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_catalog_facets_202610'
+down_revision: Union[str, None] = 'add_import_sync_202610'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Плоская таблица активных продуктов для воронки выбора
+    op.create_table(
+        'catalog_facets',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('price', sa.Integer(), nullable=True),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.Column('category_name', sa.String(length=100), nullable=False),
+        sa.Column('category_sort', sa.Integer(), nullable=False),
+        sa.Column('accessory_brand_id', sa.Integer(), nullable=False),
+        sa.Column('accessory_brand_name', sa.String(length=100), nullable=False),
+        sa.Column('accessory_brand_sort', sa.Integer(), nullable=False),
+        sa.Column('device_brand_id', sa.Integer(), nullable=True),
+        sa.Column('device_brand_name', sa.String(length=100), nullable=True),
+        sa.Column('device_brand_sort', sa.Integer(), nullable=True),
+        sa.Column('device_model_id', sa.Integer(), nullable=True),
+        sa.Column('device_model_name', sa.String(length=100), nullable=True),
+        sa.Column('device_model_sort', sa.Integer(), nullable=True),
+        sa.Column('series_id', sa.Integer(), nullable=True),
+        sa.Column('series_name', sa.String(length=100), nullable=True),
+        sa.Column('variation_id', sa.Integer(), nullable=True),
+        sa.Column('variation_name', sa.String(length=200), nullable=True),
+        sa.Column('color_id', sa.Integer(), nullable=True),
+        sa.Column('color_name', sa.String(length=100), nullable=True),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id')
+    )
+    op.create_index(
+        'ix_catalog_facets_funnel',
+        'catalog_facets',
+        [
+            'category_id',
+            'accessory_brand_id',
+            'device_brand_id',
+            'device_model_id',
+            'series_id',
+            'variation_id',
+            'color_id',
+            'product_id',
+        ]
+    )
+
+    # Первое заполнение, дальше таблицу перестраивает каждое изменение каталога
+    op.execute("""
+        INSERT INTO catalog_facets (
+            product_id, price,
+            category_id, category_name, category_sort,
+            accessory_brand_id, accessory_brand_name, accessory_brand_sort,
+            device_brand_id, device_brand_name, device_brand_sort,
+            device_model_id, device_model_name, device_model_sort,
+            series_id, series_name,
+            variation_id, variation_name,
+            color_id, color_name
+        )
+        SELECT
+            p.id, p.price,
+            p.category_id, c.name, COALESCE(c.sort_order, 0),
+            p.accessory_brand_id, ab.name, COALESCE(ab.sort_order, 0),
+            dm.device_brand_id, db.name, COALESCE(db.sort_order, 0),
+            p.device_model_id, dm.name, COALESCE(dm.sort_order, 0),
+            p.series_id, s.name,
+            p.variation_id, v.name,
+            p.color_id, cl.name
+        FROM products p
+        JOIN categories c ON c.id = p.category_id
+        JOIN accessory_brands ab ON ab.id = p.accessory_brand_id
+        LEFT JOIN device_models dm ON dm.id = p.device_model_id
+        LEFT JOIN device_brands db ON db.id = dm.device_brand_id
+        LEFT JOIN series s ON s.id = p.series_id
+        LEFT JOIN variations v ON v.id = p.variation_id
+        LEFT JOIN colors cl ON cl.id = p.color_id
+        WHERE p.is_active = true
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_catalog_facets_funnel', table_name='catalog_facets')
+    op.drop_table('catalog_facets')
@@ -0,0 +1,34 @@
+"""Add catalog_version table
+
+Revision ID: add_catalog_version_202610
+Revises: add_image_file_id_202610
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_catalog_version_202610'
+down_revision: Union[str, None] = 'add_image_file_id_202610'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Версия каталога - по ней бот сбрасывает кэши после изменений в админке и импорта
+    op.create_table(
+        'catalog_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO catalog_version (id, version, updated_at) VALUES (1, 0, now())")
+
+
+def downgrade() -> None:
+    op.drop_table('catalog_version')
@@ -0,0 +1,52 @@
+"""Add partial and composite indexes for hot bot queries
+
+Revision ID: add_funnel_indexes_202610
+Revises: add_catalog_facets_202610
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_funnel_indexes_202610'
+down_revision: Union[str, None] = 'add_catalog_facets_202610'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Фильтры воронки только по активным продуктам
+    op.create_index(
+        'ix_products_active_funnel',
+        'products',
+        ['category_id', 'accessory_brand_id', 'device_model_id', 'series_id', 'variation_id', 'color_id'],
+        postgresql_where=sa.text('is_active')
+    )
+    # Главное фото продукта и фото без file_id Telegram
+    op.create_index(
+        'ix_product_images_main',
+        'product_images',
+        ['product_id', 'color_id'],
+        postgresql_where=sa.text('is_main')
+    )
+    op.create_index(
+        'ix_product_images_without_file_id',
+        'product_images',
+        ['id'],
+        postgresql_where=sa.text('telegram_file_id IS NULL')
+    )
+    # Корзина пользователя и поиск позиции корзины по продукту
+    op.create_index('ix_cart_items_user_product', 'cart_items', ['user_id', 'product_id'])
+    op.create_index('ix_cart_items_product_id', 'cart_items', ['product_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_cart_items_product_id', table_name='cart_items')
+    op.drop_index('ix_cart_items_user_product', table_name='cart_items')
+    op.drop_index('ix_product_images_without_file_id', table_name='product_images')
+    op.drop_index('ix_product_images_main', table_name='product_images')
+    op.drop_index('ix_products_active_funnel', table_name='products')
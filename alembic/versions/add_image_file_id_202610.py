@@ -0,0 +1,31 @@
+"""Add Telegram file_id cache columns to product_images
+
+Revision ID: add_image_file_id_202610
+Revises: add_sort_order_202512
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_image_file_id_202610'
+down_revision: Union[str, None] = 'add_sort_order_202512'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # file_id фото, полученный от Telegram после первой загрузки
+    op.add_column('product_images', sa.Column('telegram_file_id', sa.String(length=255), nullable=True))
+    
+    # Хэш файла, для которого получен file_id (при замене файла file_id сбрасывается)
+    op.add_column('product_images', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('product_images', 'content_hash')
+    op.drop_column('product_images', 'telegram_file_id')
@@ -0,0 +1,37 @@
+"""Add full sync fields to import_jobs
+
+Revision ID: add_import_sync_202610
+Revises: add_import_jobs_202610
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_import_sync_202610'
+down_revision: Union[str, None] = 'add_import_jobs_202610'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Режим полной синхронизации с предпросмотром изменений
+    op.add_column('import_jobs', sa.Column('mode', sa.String(length=20), nullable=False, server_default='update'))
+    op.add_column('import_jobs', sa.Column('dry_run', sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.add_column('import_jobs', sa.Column('file_path', sa.String(length=500), nullable=True))
+    op.add_column('import_jobs', sa.Column('unchanged_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('import_jobs', sa.Column('removed_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('import_jobs', sa.Column('preview', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('import_jobs', 'preview')
+    op.drop_column('import_jobs', 'removed_count')
+    op.drop_column('import_jobs', 'unchanged_count')
+    op.drop_column('import_jobs', 'file_path')
+    op.drop_column('import_jobs', 'dry_run')
+    op.drop_column('import_jobs', 'mode')
@@ -0,0 +1,49 @@
+"""Add order_notifications outbox table
+
+Revision ID: add_order_notifications_202610
+Revises: add_catalog_version_202610
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_order_notifications_202610'
+down_revision: Union[str, None] = 'add_catalog_version_202610'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Уведомления админам о заказах, которые бот отправляет в фоне
+    op.create_table(
+        'order_notifications',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('order_id', sa.Integer(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('sent_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('last_error', sa.String(length=500), nullable=True),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_order_notifications_order_id', 'order_notifications', ['order_id'])
+    op.create_index(
+        'ix_order_notifications_status_next_attempt',
+        'order_notifications',
+        ['status', 'next_attempt_at']
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_order_notifications_status_next_attempt', table_name='order_notifications')
+    op.drop_index('ix_order_notifications_order_id', table_name='order_notifications')
+    op.drop_table('order_notifications')
@@ -0,0 +1,41 @@
+"""Drop the unused funnel index of catalog_facets
+
+Revision ID: drop_catalog_facets_funnel_202610
+Revises: add_cart_unique_202610
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'drop_catalog_facets_funnel_202610'
+down_revision: Union[str, None] = 'add_cart_unique_202610'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Бот читает catalog_facets целиком, индекс по фасетам не используется ни одним запросом
+    # и только замедляет перестроение таблицы
+    op.drop_index('ix_catalog_facets_funnel', table_name='catalog_facets')
+
+
+def downgrade() -> None:
+    op.create_index(
+        'ix_catalog_facets_funnel',
+        'catalog_facets',
+        [
+            'category_id',
+            'accessory_brand_id',
+            'device_brand_id',
+            'device_model_id',
+            'series_id',
+            'variation_id',
+            'color_id',
+            'product_id',
+        ]
+    )
@@ -0,0 +1,183 @@
+"""
+Микробенчмарк: сколько процессорного времени Python уходит на построение
+горячих запросов бота до и после перевода их на lambda_stmt.
+
+Для каждого запроса меряется то, что SQLAlchemy делает до отправки в БД:
+построение select(), вычисление ключа кэша и поиск скомпилированного SQL в кэше.
+Сама БД не нужна, но нужны настройки из .env (как для бота).
+
+Запуск: python bench_queries.py [число повторов]
+"""
+
+import sys
+import time
+
+from sqlalchemy import func, lambda_stmt, select
+from sqlalchemy.util import LRUCache
+
+from data.crud import product_info_stmt
+from data.model import (
+    engine,
+    Products,
+    Categories,
+    AccessoryBrands,
+    DeviceModels,
+    Series,
+    Variations,
+    Colors,
+    CartItems,
+    Customers,
+    CatalogVersion
+)
+
+# =============================
+# ЗАПРОСЫ ДО И ПОСЛЕ
+# =============================
+
+def card_before(product_id):
+    return product_info_stmt().where(Products.id == product_id)
+
+def card_after(product_id):
+    return lambda_stmt(product_info_stmt) + (lambda s: s.where(Products.id == product_id))
+
+def catalog_version_before(_):
+    return select(CatalogVersion.version).where(CatalogVersion.id == 1)
+
+def catalog_version_after(_):
+    return lambda_stmt(lambda: select(CatalogVersion.version).where(CatalogVersion.id == 1))
+
+def customer_before(user_id):
+    return select(Customers).filter_by(telegram_id=user_id)
+
+def customer_after(user_id):
+    return lambda_stmt(lambda: select(Customers).filter_by(telegram_id=user_id))
+
+def cart_item_before(user_id):
+    return select(CartItems).filter_by(user_id=user_id, product_id=user_id % 100)
+
+def cart_item_after(user_id):
+    product_id = user_id % 100
+    return lambda_stmt(lambda: select(CartItems).filter_by(user_id=user_id, product_id=product_id))
+
+def _cart_items(user_id):
+    return (
+        select(
+            Products.id.label("product_id"),
+            Categories.name.label("category"),
+            AccessoryBrands.name.label("brand"),
+            DeviceModels.name.label("device_model"),
+            Series.name.label("series"),
+            Variations.name.label("variation"),
+            Colors.name.label("color"),
+            Products.price,
+            (Products.price * CartItems.quantity).label("sum"),
+            CartItems.quantity
+        )
+        .select_from(CartItems)
+        .outerjoin(Products, CartItems.product_id == Products.id)
+        .outerjoin(Categories, Products.category_id == Categories.id)
+        .outerjoin(AccessoryBrands, Products.accessory_brand_id == AccessoryBrands.id)
+        .outerjoin(DeviceModels, Products.device_model_id == DeviceModels.id)
+        .outerjoin(Series, Products.series_id == Series.id)
+        .outerjoin(Variations, Products.variation_id == Variations.id)
+        .outerjoin(Colors, Products.color_id == Colors.id)
+        .where(CartItems.user_id == user_id)
+        .order_by(Categories.name, AccessoryBrands.name)
+    )
+
+def cart_items_before(user_id):
+    return _cart_items(user_id)
+
+def cart_items_after(user_id):
+    return lambda_stmt(lambda: (
+        select(
+            Products.id.label("product_id"),
+            Categories.name.label("category"),
+            AccessoryBrands.name.label("brand"),
+            DeviceModels.name.label("device_model"),
+            Series.name.label("series"),
+            Variations.name.label("variation"),
+            Colors.name.label("color"),
+            Products.price,
+            (Products.price * CartItems.quantity).label("sum"),
+            CartItems.quantity
+        )
+        .select_from(CartItems)
+        .outerjoin(Products, CartItems.product_id == Products.id)
+        .outerjoin(Categories, Products.category_id == Categories.id)
+        .outerjoin(AccessoryBrands, Products.accessory_brand_id == AccessoryBrands.id)
+        .outerjoin(DeviceModels, Products.device_model_id == DeviceModels.id)
+        .outerjoin(Series, Products.series_id == Series.id)
+        .outerjoin(Variations, Products.variation_id == Variations.id)
+        .outerjoin(Colors, Products.color_id == Colors.id)
+        .where(CartItems.user_id == user_id)
+        .order_by(Categories.name, AccessoryBrands.name)
+    ))
+
+def cart_sum_before(user_id):
+    return (
+        select(func.sum(CartItems.quantity * Products.price).label("total_sum"))
+        .select_from(CartItems)
+        .outerjoin(Products, CartItems.product_id == Products.id)
+        .where(CartItems.user_id == user_id)
+    )
+
+def cart_sum_after(user_id):
+    return lambda_stmt(lambda: (
+        select(func.sum(CartItems.quantity * Products.price).label("total_sum"))
+        .select_from(CartItems)
+        .outerjoin(Products, CartItems.product_id == Products.id)
+        .where(CartItems.user_id == user_id)
+    ))
+
+QUERIES = {
+    "карточка товара": (card_before, card_after),
+    "версия каталога": (catalog_version_before, catalog_version_after),
+    "покупатель": (customer_before, customer_after),
+    "позиция корзины": (cart_item_before, cart_item_after),
+    "товары корзины": (cart_items_before, cart_items_after),
+    "сумма корзины": (cart_sum_before, cart_sum_after),
+}
+
+# Какие запросы делает одно нажатие
+TAPS = {
+    "открыть карточку": ["версия каталога", "карточка товара"],
+    "добавить в корзину": ["покупатель", "позиция корзины"],
+    "показать корзину": ["товары корзины", "сумма корзины"],
+}
+
+# =============================
+# ЗАМЕР
+# =============================
+
+def measure(build, repeats: int) -> float:
+    """Среднее время (мкс) на построение запроса и получение SQL из кэша компиляции"""
+    dialect = engine.sync_engine.dialect
+    cache = LRUCache(500)
+    for i in range(100):
+        build(i)._compile_w_cache(dialect, compiled_cache=cache, column_keys=[])
+
+    started = time.process_time()
+    for i in range(repeats):
+        build(i)._compile_w_cache(dialect, compiled_cache=cache, column_keys=[])
+    return (time.process_time() - started) / repeats * 1_000_000
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    results = {}
+    print(f"{'запрос':<20}{'до, мкс':>10}{'после, мкс':>12}{'ускорение':>11}")
+    for name, (before, after) in QUERIES.items():
+        results[name] = measure(before, repeats), measure(after, repeats)
+        print(f"{name:<20}{results[name][0]:>10.1f}{results[name][1]:>12.1f}{results[name][0] / results[name][1]:>10.1f}x")
+
+    print()
+    print(f"{'нажатие':<20}{'до, мкс':>10}{'после, мкс':>12}")
+    for tap, names in TAPS.items():
+        before = sum(results[name][0] for name in names)
+        after = sum(results[name][1] for name in names)
+        print(f"{tap:<20}{before:>10.1f}{after:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import asyncio
+import logging
 import os.path
 import inspect
 
@@ -6,22 +8,26 @@ from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import FSInputFile, InputMediaPhoto
 
 import keyboards
-from states.states import ChoseProduct, push_state, pop_state, state_handlers, get_next_state
+from states.states import ChoseProduct, push_state, pop_state, state_handlers, resolve_next_state
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import StateFilter
 from data.crud import (
     get_product_by_id,
-    get_product_image,
-    get_product_full_info,
-    add_new_customer,
-    add_cart_item,
-    get_cart_items,
-    count_cart_sum,
+    save_image_file_id,
+    file_content_hash,
     clear_user_cart,
-    make_order,
-    get_admins,
-    get_order_details
+    make_order
 )
+from services.carts import get_cart_text
+from services.customers import add_to_cart
+from services.image_prewarm import image_uploads
+from services.notifications import OrderNotifier
+from services.product_cards import get_product_card
+
+logger = logging.getLogger(__name__)
+
+# Ошибки Telegram, означающие, что сохраненный file_id больше не принимается
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier")
 
 router = Router()
 
@@ -72,89 +78,102 @@ async def safe_edit_message(callback: types.CallbackQuery, text: str = None, rep
             except Exception as e2:
                 print(f"Ошибка отправки сообщения: {e2}")
 
+async def edit_product_photo(callback: types.CallbackQuery, image: dict, caption: str, reply_markup=None):
+    """
+    Показать фото продукта, переиспользуя сохраненный file_id Telegram.
+    Файл загружается только при первом показе (при замене файла админка сбрасывает
+    file_id) или если Telegram больше не принимает file_id. Если это фото уже
+    загружает прогрев или карточка у другого покупателя, ждем ту загрузку.
+    :return: file_id показанного фото
+    """
+    cached = image["file_id"]
+    if not cached:
+        cached = await image_uploads.wait(image["id"])
+        if cached:
+            # Запись фото может лежать в кэше карточек - обновляем и ее
+            image["file_id"] = cached
+
+    if cached:
+        try:
+            message = await callback.message.edit_media(
+                media=InputMediaPhoto(media=cached, caption=caption),
+                reply_markup=reply_markup
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return cached
+            if not any(error in str(e).lower() for error in FILE_ID_ERRORS):
+                # Загрузка файла заново не поможет (сообщение удалено, слишком длинная подпись и т.п.)
+                raise
+            # file_id больше не принимается (например, сменился токен бота) - загружаем заново
+            logger.warning("file_id фото %s не принят, загружаем файл заново: %s", image["id"], e)
+        else:
+            if isinstance(message, types.Message) and message.photo:
+                return message.photo[-1].file_id
+            return cached
+
+    upload = image_uploads.start(image["id"])
+    file_id = None
+    try:
+        message = await callback.message.edit_media(
+            media=InputMediaPhoto(media=FSInputFile(image["path"]), caption=caption),
+            reply_markup=reply_markup
+        )
+        if isinstance(message, types.Message) and message.photo:
+            file_id = message.photo[-1].file_id
+            # Хэш файла записывает админка; считаем его здесь, только если его нет
+            content_hash = image["content_hash"] or await asyncio.to_thread(file_content_hash, image["path"])
+            await save_image_file_id(image["id"], file_id, content_hash)
+            image["file_id"] = file_id
+            image["content_hash"] = content_hash
+    finally:
+        image_uploads.finish(image["id"], upload, file_id)
+    return file_id
+
+async def send_product_card(callback: types.CallbackQuery, state: FSMContext, card):
+    """Показать карточку товара (фото с подписью или текст) и запомнить фото в состоянии"""
+    image = card.image
+    # С сохраненным file_id файл на диске не нужен
+    if image and (image["file_id"] or os.path.exists(image["path"])):
+        file_id = await edit_product_photo(callback, image, card.text, keyboards.builders.product_kb())
+        await state.update_data(image_path=image["path"], image_file_id=file_id)
+    else:
+        try:
+            await callback.message.edit_text(
+                card.text,
+                reply_markup=keyboards.builders.product_kb()
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+
 async def transition_to_next_state(callback: types.CallbackQuery, state: FSMContext):
     """Переход к следующему состоянию с учетом динамического пропуска"""
     current_state = await state.get_state()
     data = await state.get_data()
     
-    next_state = await get_next_state(current_state, data)
+    # Следующий этап и варианты для его клавиатуры - за один проход по индексу фасетов
+    step = await resolve_next_state(current_state, data)
+    next_state = step.state
     
     if next_state:
         # Специальная обработка для состояния showing_products
         # Если товар один - сразу показываем карточку, пропуская состояние showing_products
         if next_state == ChoseProduct.showing_products:
-            from data.model import AsyncSessionLocal, Products
-            from sqlalchemy import select, func
+            products = step.items
             
-            async with AsyncSessionLocal() as session:
-                stmt = (
-                    select(Products)
-                    .where(
-                        Products.category_id == data["chosen_category"],
-                        Products.accessory_brand_id == data["chosen_accessory_brand"],
-                        Products.is_active == True
-                    )
-                )
+            # Если товар ровно один - сразу показываем карточку, пропускаем showing_products
+            if len(products) == 1:
+                product = products[0]
+                await state.update_data(chosen_product=product.id)
                 
-                if data.get("chosen_device_model"):
-                    stmt = stmt.where(Products.device_model_id == data["chosen_device_model"])
-                if data.get("chosen_series"):
-                    stmt = stmt.where(Products.series_id == data["chosen_series"])
-                if data.get("chosen_variation"):
-                    stmt = stmt.where(Products.variation_id == data["chosen_variation"])
-                if data.get("chosen_color"):
-                    stmt = stmt.where(Products.color_id == data["chosen_color"])
-                
-                result = await session.execute(stmt)
-                products = result.scalars().all()
-                
-                # Если товар ровно один - сразу показываем карточку, пропускаем showing_products
-                if len(products) == 1:
-                    product = products[0]
-                    await state.update_data(chosen_product=product.id)
+                card = await get_product_card(product.id)
+                if card:
+                    await send_product_card(callback, state, card)
                     
-                    product_info = await get_product_full_info(product.id)
-                    if product_info:
-                        # Формируем текст карточки
-                        text_parts = ["<b>Информация о товаре:</b>\n"]
-                        if product_info["category"]:
-                            text_parts.append(f"Категория: {product_info['category']}")
-                        if product_info["accessory_brand"]:
-                            text_parts.append(f"Бренд: {product_info['accessory_brand']}")
-                        if product_info["device_model"]:
-                            text_parts.append(f"Совместимость: {product_info['device_model']}")
-                        if product_info["series"]:
-                            text_parts.append(f"Серия: {product_info['series']}")
-                        if product_info["variation"]:
-                            text_parts.append(f"Вариация: {product_info['variation']}")
-                        if product_info["color"]:
-                            text_parts.append(f"Цвет: {product_info['color']}")
-                        if product_info["price"]:
-                            text_parts.append(f"\n<b>Цена: {product_info['price']} руб</b>")
-                        else:
-                            text_parts.append("\n<b>Цену уточнять</b>")
-                        
-                        text = "\n".join(text_parts)
-                        
-                        # Получаем изображение
-                        image_path = await get_product_image(product.id, product_info.get("color_id"))
-                        
-                        if image_path and os.path.exists(image_path):
-                            await state.update_data(image_path=image_path)
-                            photo = FSInputFile(image_path)
-                            await callback.message.edit_media(
-                                media=InputMediaPhoto(media=photo, caption=text),
-                                reply_markup=keyboards.builders.product_kb()
-                            )
-                        else:
-                            await callback.message.edit_text(
-                                text,
-                                reply_markup=keyboards.builders.product_kb()
-                            )
-                        
-                        # Переходим сразу к showing_product, минуя showing_products
-                        await push_state(state, ChoseProduct.showing_product)
-                        return
+                    # Переходим сразу к showing_product, минуя showing_products
+                    await push_state(state, ChoseProduct.showing_product)
+                    return
         
         # Обычный переход к следующему состоянию
         await push_state(state, next_state)
@@ -166,11 +185,12 @@ async def transition_to_next_state(callback: types.CallbackQuery, state: FSMCont
             markup_source = handler["markup"]
             
             # Проверяем, является ли это асинхронной функцией
+            # Варианты выбора уже посчитаны резолвером - передаем их в клавиатуру
             if inspect.iscoroutinefunction(markup_source):
-                markup = await markup_source(data)
+                markup = await markup_source(data, step.items)
             # Проверяем, является ли это обычной функцией
             elif callable(markup_source):
-                markup = markup_source(data)
+                markup = markup_source(data, step.items)
                 # Если результат - корутина, нужно ее await-нуть
                 if inspect.iscoroutine(markup):
                     markup = await markup
@@ -220,13 +240,13 @@ async def process_category_selection(callback: types.CallbackQuery, state: FSMCo
 async def process_category_pagination(callback: types.CallbackQuery, state: FSMContext):
     data_split = callback.data.split("_")
     try:
-        page = int(data_split[3])
+        page, anchor = keyboards.builders.parse_page(data_split[3])
     except (IndexError, ValueError):
         await callback.answer("Некорректные данные.")
         return
 
     await callback.message.edit_text(
-        "Выберите категорию аксессуара", reply_markup=await keyboards.builders.categories_kb(page)
+        "Выберите категорию аксессуара", reply_markup=await keyboards.builders.categories_kb(page, anchor=anchor)
     )
     await callback.answer()
 
@@ -255,13 +275,13 @@ async def process_accessory_brand_pagination(callback: types.CallbackQuery, stat
     data_split = callback.data.split("_")
     try:
         category_id = int(data_split[4])
-        page = int(data_split[5])
+        page, anchor = keyboards.builders.parse_page(data_split[5])
     except (IndexError, ValueError):
         await callback.answer("Некорректные данные.")
         return
 
     await callback.message.edit_text(
-        "Выберите бренд аксессуара", reply_markup=await keyboards.builders.accessory_brands_kb(category_id, page)
+        "Выберите бренд аксессуара", reply_markup=await keyboards.builders.accessory_brands_kb(category_id, page, anchor=anchor)
     )
     await callback.answer()
 
@@ -292,14 +312,14 @@ async def process_device_brand_pagination(callback: types.CallbackQuery, state:
     try:
         category_id = int(data_split[4])
         accessory_brand_id = int(data_split[5])
-        page = int(data_split[6])
+        page, anchor = keyboards.builders.parse_page(data_split[6])
     except (IndexError, ValueError):
         await callback.answer("Некорректные данные.")
         return
 
     await callback.message.edit_text(
         "Выберите бренд устройства",
-        reply_markup=await keyboards.builders.device_brands_kb(category_id, accessory_brand_id, page)
+        reply_markup=await keyboards.builders.device_brands_kb(category_id, accessory_brand_id, page, anchor=anchor)
     )
     await callback.answer()
 
@@ -331,7 +351,7 @@ async def process_device_model_pagination(callback: types.CallbackQuery, state:
         category_id = int(data_split[4])
         accessory_brand_id = int(data_split[5])
         device_brand_id = int(data_split[6]) if len(data_split) > 7 else None
-        page = int(data_split[7] if len(data_split) > 7 else data_split[6])
+        page, anchor = keyboards.builders.parse_page(data_split[7] if len(data_split) > 7 else data_split[6])
     except (IndexError, ValueError):
         await callback.answer("Некорректные данные.")
         return
@@ -339,7 +359,7 @@ async def process_device_model_pagination(callback: types.CallbackQuery, state:
     await callback.message.edit_text(
         "Выберите модель устройства",
         reply_markup=await keyboards.builders.device_models_kb(
-            category_id, accessory_brand_id, device_brand_id, page
+            category_id, accessory_brand_id, device_brand_id, page, anchor=anchor
         )
     )
     await callback.answer()
@@ -372,14 +392,16 @@ async def process_series_pagination(callback: types.CallbackQuery, state: FSMCon
         category_id = int(data_split[3])
         accessory_brand_id = int(data_split[4])
         device_model_id = int(data_split[5]) if len(data_split) > 6 else None
-        page = int(data_split[6] if len(data_split) > 6 else data_split[5])
+        page, anchor = keyboards.builders.parse_page(data_split[6] if len(data_split) > 6 else data_split[5])
     except (IndexError, ValueError):
         await callback.answer("Некорректные данные.")
         return
 
     await callback.message.edit_text(
         "Выберите серию",
-        reply_markup=await keyboards.builders.series_kb(category_id, accessory_brand_id, device_model_id, page)
+        reply_markup=await keyboards.builders.series_kb(
+            category_id, accessory_brand_id, device_model_id, page, anchor=anchor
+        )
     )
     await callback.answer()
 
@@ -412,7 +434,7 @@ async def process_variation_pagination(callback: types.CallbackQuery, state: FSM
         accessory_brand_id = int(data_split[4])
         device_model_id = int(data_split[5]) if len(data_split) > 7 else None
         series_id = int(data_split[6]) if len(data_split) > 7 else None
-        page = int(data_split[-1])
+        page, anchor = keyboards.builders.parse_page(data_split[-1])
     except (IndexError, ValueError):
         await callback.answer("Некорректные данные.")
         return
@@ -420,7 +442,7 @@ async def process_variation_pagination(callback: types.CallbackQuery, state: FSM
     await callback.message.edit_text(
         "Выберите вариацию",
         reply_markup=await keyboards.builders.variations_kb(
-            category_id, accessory_brand_id, device_model_id, series_id, page
+            category_id, accessory_brand_id, device_model_id, series_id, page, anchor=anchor
         )
     )
     await callback.answer()
@@ -452,7 +474,7 @@ async def process_color_pagination(callback: types.CallbackQuery, state: FSMCont
     data = await state.get_data()
     
     try:
-        page = int(data_split[-1])
+        page, anchor = keyboards.builders.parse_page(data_split[-1])
     except (IndexError, ValueError):
         await callback.answer("Некорректные данные.")
         return
@@ -465,7 +487,8 @@ async def process_color_pagination(callback: types.CallbackQuery, state: FSMCont
             data.get("chosen_device_model"),
             data.get("chosen_series"),
             data.get("chosen_variation"),
-            page
+            page,
+            anchor=anchor
         )
     )
     await callback.answer()
@@ -497,7 +520,7 @@ async def process_product_pagination(callback: types.CallbackQuery, state: FSMCo
     data = await state.get_data()
     
     try:
-        page = int(data_split[-1])
+        page, anchor = keyboards.builders.parse_page(data_split[-1])
     except (IndexError, ValueError):
         await callback.answer("Некорректные данные.")
         return
@@ -511,7 +534,8 @@ async def process_product_pagination(callback: types.CallbackQuery, state: FSMCo
             data.get("chosen_series"),
             data.get("chosen_variation"),
             data.get("chosen_color"),
-            page
+            page,
+            anchor=anchor
         )
     )
     await callback.answer()
@@ -529,49 +553,13 @@ async def show_product_card(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("Некорректные данные.")
         return
 
-    product_info = await get_product_full_info(product_id)
-    if not product_info:
+    card = await get_product_card(product_id)
+    if not card:
         await callback.answer("Товар не найден")
         return
 
     await state.update_data(chosen_product=product_id)
-
-    # Формируем текст карточки
-    text_parts = ["<b>Информация о товаре:</b>\n"]
-    if product_info["category"]:
-        text_parts.append(f"Категория: {product_info['category']}")
-    if product_info["accessory_brand"]:
-        text_parts.append(f"Бренд: {product_info['accessory_brand']}")
-    if product_info["device_model"]:
-        text_parts.append(f"Совместимость: {product_info['device_model']}")
-    if product_info["series"]:
-        text_parts.append(f"Серия: {product_info['series']}")
-    if product_info["variation"]:
-        text_parts.append(f"Вариация: {product_info['variation']}")
-    if product_info["color"]:
-        text_parts.append(f"Цвет: {product_info['color']}")
-    if product_info["price"]:
-        text_parts.append(f"\n<b>Цена: {product_info['price']} руб</b>")
-    else:
-        text_parts.append("\n<b>Цену уточнять</b>")
-    
-    text = "\n".join(text_parts)
-
-    # Получаем изображение
-    image_path = await get_product_image(product_id, product_info.get("color_id"))
-    
-    if image_path and os.path.exists(image_path):
-        await state.update_data(image_path=image_path)
-        photo = FSInputFile(image_path)
-        await callback.message.edit_media(
-            media=InputMediaPhoto(media=photo, caption=text),
-            reply_markup=keyboards.builders.product_kb()
-        )
-    else:
-        await callback.message.edit_text(
-            text,
-            reply_markup=keyboards.builders.product_kb()
-        )
+    await send_product_card(callback, state, card)
 
     await push_state(state, ChoseProduct.showing_product)
     await callback.answer()
@@ -635,10 +623,8 @@ async def process_quantity_selection(callback: types.CallbackQuery, state: FSMCo
         
         user_id = callback.from_user.id
         username = callback.from_user.username or "Без имени"
-        customer = await add_new_customer(user_id, username)
-        await add_cart_item(product_id, customer.telegram_id, quantity)
+        await add_to_cart(product_id, user_id, quantity, username)
         
-        product_info = await get_product_full_info(product_id)
         text = f"Товар добавлен в корзину!\nКоличество: {quantity} шт."
         
         # Пытаемся удалить предыдущее сообщение
@@ -721,25 +707,8 @@ async def process_quantity_selection(callback: types.CallbackQuery, state: FSMCo
 
 @router.callback_query(F.data == "cart", StateFilter("*"))
 async def show_cart(callback: types.CallbackQuery, state: FSMContext):
-    cart_items = await get_cart_items(callback.from_user.id)
-    cart_sum = await count_cart_sum(callback.from_user.id)
-
-    if cart_items:
-        text = "Ваша 🛒:\n\n" + "\n\n".join([
-            "".join([
-                f"<b>{item.category} </b>" if item.category else "",
-                f"<b>{item.brand} </b>" if item.brand else "",
-                f"<b>{item.device_model} </b>" if item.device_model else "",
-                f"<b>{item.series} </b>" if item.series else "",
-                f"<b>{item.color} </b>" if item.color else "",
-                f"<b>{item.variation} </b>" if item.variation else "",
-                "- ",
-                f"{item.quantity} шт. " if item.quantity else "",
-                f"сумма: {item.sum} руб " if item.sum else "цену уточнять",
-            ]).strip() for item in cart_items
-        ]) + f"\n\n<b>Общая сумма: {cart_sum} руб</b>"
-    else:
-        text = "Ваша 🛒:\n\nВ вашей корзине пока что нет товаров"
+    # Повторное открытие корзины берется из кэша без запросов к БД
+    text = await get_cart_text(callback.from_user.id)
 
     await safe_edit_message(callback, text, keyboards.inline.kart_kb)
     await state.clear()
@@ -753,16 +722,16 @@ async def clear_user_cart_items(callback: types.CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "make_order")
-async def send_order(callback: types.CallbackQuery, bot: Bot):
+async def send_order(callback: types.CallbackQuery, order_notifier: OrderNotifier):
     user_id = callback.from_user.id
     username = callback.from_user.username
     date = callback.message.date
-    order = await make_order(user_id, date)
+    # Уведомления админам записываются в очередь в той же транзакции, что и заказ
+    order = await make_order(user_id, date, lambda order: make_message(order, username))
     
     if order:
-        admins, text = await make_message(order.id, username)
-        for admin in admins:
-            await bot.send_message(admin.id, text)
+        # Отправка админам идет в фоне - ответ покупателю не ждет рассылки
+        order_notifier.wake()
         text = "Ваш заказ отправлен менеджеру. В ближайшее время с вами свяжутся"
     else:
         text = "Ваша корзина пуста, для создания заказа необходимо добавить товар в корзину"
@@ -776,11 +745,11 @@ async def send_order(callback: types.CallbackQuery, bot: Bot):
             raise
     await callback.answer()
 
-async def make_message(order_id, username):
-    admins = await get_admins()
-    order_items = await get_order_details(order_id)
+def make_message(order, username):
+    # Состав заказа уже выбран в транзакции оформления - повторно в БД не ходим
+    order_items = order.items
     text = (
-        f"Заказ № {order_id} от пользователя @{username}:\n\n" + "\n\n".join([
+        f"Заказ № {order.id} от пользователя @{username}:\n\n" + "\n\n".join([
             "".join([
                 f"<b>{item.category} </b>" if item.category else "",
                 f"<b>{item.brand} </b>" if item.brand else "",
@@ -794,7 +763,7 @@ async def make_message(order_id, username):
             ]).strip() for item in order_items
         ])
     )
-    return admins, text
+    return text
 
 # =============================
 # НАВИГАЦИЯ
@@ -816,64 +785,22 @@ async def go_back(callback: types.CallbackQuery, state: FSMContext):
             callback, "🏠 Главное меню.", keyboards.inline.menu_kb
         )
         # Очищаем image_path при возврате в главное меню
-        await state.update_data(image_path=None)
+        await state.update_data(image_path=None, image_file_id=None)
         return
 
     data = await state.get_data()
     
     # Очищаем image_path, если возвращаемся не в showing_product
     if prev_state != ChoseProduct.showing_product:
-        await state.update_data(image_path=None)
+        await state.update_data(image_path=None, image_file_id=None)
     
     # Специальная обработка для состояния showing_product
     if prev_state == ChoseProduct.showing_product:
         product_id = data.get("chosen_product")
         if product_id:
-            product_info = await get_product_full_info(product_id)
-            if product_info:
-                # Формируем текст карточки
-                text_parts = ["<b>Информация о товаре:</b>\n"]
-                if product_info["category"]:
-                    text_parts.append(f"Категория: {product_info['category']}")
-                if product_info["accessory_brand"]:
-                    text_parts.append(f"Бренд: {product_info['accessory_brand']}")
-                if product_info["device_model"]:
-                    text_parts.append(f"Совместимость: {product_info['device_model']}")
-                if product_info["series"]:
-                    text_parts.append(f"Серия: {product_info['series']}")
-                if product_info["variation"]:
-                    text_parts.append(f"Вариация: {product_info['variation']}")
-                if product_info["color"]:
-                    text_parts.append(f"Цвет: {product_info['color']}")
-                if product_info["price"]:
-                    text_parts.append(f"\n<b>Цена: {product_info['price']} руб</b>")
-                else:
-                    text_parts.append("\n<b>Цену уточнять</b>")
-                
-                text = "\n".join(text_parts)
-                
-                # Получаем изображение
-                image_path = data.get("image_path")
-                if image_path and os.path.exists(image_path):
-                    photo = FSInputFile(image_path)
-                    try:
-                        await callback.message.edit_media(
-                            media=InputMediaPhoto(media=photo, caption=text),
-                            reply_markup=keyboards.builders.product_kb()
-                        )
-                    except TelegramBadRequest as e:
-                        if "message is not modified" not in str(e):
-                            raise
-                else:
-                    try:
-                        await callback.message.edit_text(
-                            text,
-                            reply_markup=keyboards.builders.product_kb()
-                        )
-                    except TelegramBadRequest as e:
-                        if "message is not modified" not in str(e):
-                            raise
-                
+            card = await get_product_card(product_id)
+            if card:
+                await send_product_card(callback, state, card)
                 await callback.answer()
                 return
 
@@ -3,6 +3,7 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import SecretStr
 from dotenv import load_dotenv
 import os
+from typing import Optional
 
 
 class Settings(BaseSettings):
@@ -11,6 +12,81 @@ class Settings(BaseSettings):
     db_link_async: str
     secret_key: str
 
+    # Пул соединений с БД: размер, сверх пула, ожидание свободного соединения и пересоздание (секунд),
+    # проверка соединения перед выдачей из пула
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # Ограничение времени запроса бота, миллисекунд (0 - без ограничения)
+    db_statement_timeout: int = 15000
+    # Сколько миллисекунд соединение может простаивать в открытой транзакции, прежде чем сервер ее оборвет
+    db_idle_in_transaction_timeout: int = 60000
+    # Кэш подготовленных запросов asyncpg на соединение (0 - выключить, нужно за pgbouncer в режиме transaction)
+    db_prepared_statement_cache_size: int = 500
+    # Логирование SQL: false, true (запросы) или debug (запросы и результаты)
+    db_echo: str = "false"
+
+    # Время жизни индекса фасетов каталога в памяти бота, секунд
+    facet_index_ttl: int = 300
+
+    # Сколько отрисованных карточек товаров держать в памяти и как часто (секунд) сверять версию каталога
+    product_card_cache_size: int = 1024
+    catalog_version_check_interval: int = 10
+
+    # Реестр известных покупателей в памяти бота: сколько держать и через сколько секунд перепроверять
+    customer_cache_size: int = 50000
+    customer_cache_ttl: int = 24 * 60 * 60
+    # Сколько отрисованных корзин держать в памяти и сколько секунд (правки корзин в админке бот не видит).
+    # Кэш работает только при bot_processes = 1: корзину может изменить другой процесс бота; 0 - выключить
+    cart_cache_size: int = 10000
+    cart_cache_ttl: int = 30
+
+    # Служебный чат для предварительной загрузки фото товаров в Telegram (не задан - загрузка отключена)
+    image_cache_chat_id: Optional[int] = None
+    image_prewarm_concurrency: int = 3
+    image_prewarm_interval: int = 600
+
+    # Рассылка уведомлений о заказах: параллельность, лимиты Telegram (сообщений в секунду всего и на чат)
+    order_notify_concurrency: int = 8
+    order_notify_global_rate: float = 25
+    order_notify_per_chat_rate: float = 1
+    # Сколько секунд при остановке бота ждать досылки текущей пачки уведомлений
+    order_notify_stop_timeout: int = 30
+
+    # Сколько импортов каталога админка выполняет одновременно (в фоновых потоках)
+    import_workers: int = 1
+
+    # Режим получения апдейтов: polling (для разработки) или webhook
+    bot_mode: str = "polling"
+    webhook_base_url: Optional[str] = None
+    webhook_path: str = "/webhook"
+    webhook_secret: Optional[str] = None
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8081
+    # Сколько параллельных соединений может открыть Telegram и сколько апдейтов обрабатываем одновременно
+    webhook_max_connections: int = 40
+    webhook_max_concurrent_updates: int = 100
+    # Сколько секунд ждать завершения обработчиков при остановке
+    webhook_drain_timeout: int = 30
+    # Выбросить накопившиеся у Telegram апдейты при установке webhook (при нескольких репликах - нельзя)
+    webhook_drop_pending_updates: bool = False
+
+    # Метрики задержек апдейтов в формате Prometheus: GET /metrics на этом адресе (порт 0 - выключены)
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9101
+
+    # Сколько процессов бота обрабатывают апдейты одновременно (воркеры и реплики webhook).
+    # При нескольких процессах выключен кэш корзин: об изменениях в других процессах он не знает
+    bot_processes: int = 1
+
+    # Хранилище FSM: memory, redis или sqlite; ttl - через сколько секунд брошенная сессия удаляется
+    fsm_storage: str = "memory"
+    redis_url: Optional[str] = None
+    fsm_sqlite_path: str = "fsm_storage.sqlite3"
+    fsm_ttl: Optional[int] = 7 * 24 * 60 * 60
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8"
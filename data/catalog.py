@@ -0,0 +1,45 @@
+import time
+
+from config_reader import config
+from data.crud import get_catalog_version
+
+# ==========================================
+# ВЕРСИЯ КАТАЛОГА И СБРОС КЭШЕЙ БОТА
+# ==========================================
+
+# Админка и импорт работают в другом процессе, поэтому бот узнает об изменениях
+# каталога по счетчику в БД, сверяя его не чаще раза в catalog_version_check_interval секунд
+
+_version = None
+_checked_at = 0.0
+_listeners = []
+
+
+def on_catalog_change(callback):
+    """Зарегистрировать функцию без аргументов, которая сбрасывает кэш при изменении каталога"""
+    _listeners.append(callback)
+    return callback
+
+
+def catalog_changed():
+    """Сбросить все кэши каталога в этом процессе"""
+    for callback in _listeners:
+        callback()
+
+
+async def check_catalog_version() -> int:
+    """
+    Актуальная версия каталога.
+    Если версия в БД изменилась с прошлой проверки - сбрасываем кэши.
+    """
+    global _version, _checked_at
+    now = time.monotonic()
+    if _version is not None and now - _checked_at < config.catalog_version_check_interval:
+        return _version
+
+    _checked_at = now
+    version = await get_catalog_version()
+    if _version is not None and version != _version:
+        catalog_changed()
+    _version = version
+    return version
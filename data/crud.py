@@ -1,18 +1,41 @@
 import pandas as pd
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 from data.model import *
-from sqlalchemy import select, func, delete
+from sqlalchemy import select, func, delete, update, insert, literal, bindparam, lambda_stmt, text, event
 from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from config_reader import base_dir, db_link
+import hashlib
 import os
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import create_engine
 
 # ==========================================
 # АСИНХРОННЫЕ ФУНКЦИИ ДЛЯ БОТА
 # ==========================================
 
+# Горячие запросы бота собраны через lambda_stmt: функция-построитель выполняется
+# один раз, дальше SQLAlchemy берет готовый (и уже скомпилированный) запрос из кэша
+# по месту в коде, а значения из замыкания подставляет как параметры.
+# Условные фильтры добавляются отдельными лямбдами - у каждого сочетания свой ключ кэша.
+
+def _with_product_filters(stmt, category_id, accessory_brand_id, device_model_id, series_id, color_id):
+    if category_id is not None:
+        stmt += lambda s: s.filter(Products.category_id == category_id)
+    if accessory_brand_id is not None:
+        stmt += lambda s: s.filter(Products.accessory_brand_id == accessory_brand_id)
+    if device_model_id is not None:
+        stmt += lambda s: s.filter(Products.device_model_id == device_model_id)
+    if series_id is not None:
+        stmt += lambda s: s.filter(Products.series_id == series_id)
+    if color_id is not None:
+        stmt += lambda s: s.filter(Products.color_id == color_id)
+    return stmt
+
 async def get_products_for_selection(
     category_id: int = None,
     accessory_brand_id: int = None,
@@ -26,25 +49,16 @@ async def get_products_for_selection(
     Получить продукты с фильтрацией по выбранным критериям
     :return: список продуктов
     """
-    stmt = select(Products).filter(Products.is_active == True)
-    
-    if category_id is not None:
-        stmt = stmt.filter(Products.category_id == category_id)
-    if accessory_brand_id is not None:
-        stmt = stmt.filter(Products.accessory_brand_id == accessory_brand_id)
-    if device_model_id is not None:
-        stmt = stmt.filter(Products.device_model_id == device_model_id)
-    if series_id is not None:
-        stmt = stmt.filter(Products.series_id == series_id)
-    if color_id is not None:
-        stmt = stmt.filter(Products.color_id == color_id)
-    
+    stmt = _with_product_filters(
+        lambda_stmt(lambda: select(Products).filter(Products.is_active == True)),
+        category_id, accessory_brand_id, device_model_id, series_id, color_id
+    )
     if offset is not None:
-        stmt = stmt.offset(offset)
+        stmt += lambda s: s.offset(offset)
     if limit is not None:
-        stmt = stmt.limit(limit)
-    
-    async with AsyncSessionLocal() as session:
+        stmt += lambda s: s.limit(limit)
+
+    async with get_session() as session:
         result = await session.execute(stmt)
         return result.scalars().all()
 
@@ -56,35 +70,27 @@ async def count_products(
     color_id: int = None
 ) -> int:
     """Подсчет количества продуктов с фильтрацией"""
-    stmt = select(func.count(Products.id)).filter(Products.is_active == True)
-    
-    if category_id is not None:
-        stmt = stmt.filter(Products.category_id == category_id)
-    if accessory_brand_id is not None:
-        stmt = stmt.filter(Products.accessory_brand_id == accessory_brand_id)
-    if device_model_id is not None:
-        stmt = stmt.filter(Products.device_model_id == device_model_id)
-    if series_id is not None:
-        stmt = stmt.filter(Products.series_id == series_id)
-    if color_id is not None:
-        stmt = stmt.filter(Products.color_id == color_id)
-    
-    async with AsyncSessionLocal() as session:
+    stmt = _with_product_filters(
+        lambda_stmt(lambda: select(func.count(Products.id)).filter(Products.is_active == True)),
+        category_id, accessory_brand_id, device_model_id, series_id, color_id
+    )
+
+    async with get_session() as session:
         result = await session.execute(stmt)
         count = result.scalar()
     return count or 0
 
 async def get_product_by_id(product_id: int):
     """Получить продукт по ID"""
-    async with AsyncSessionLocal() as session:
+    async with get_session() as session:
         result = await session.execute(
-            select(Products).filter(Products.id == product_id)
+            lambda_stmt(lambda: select(Products).filter(Products.id == product_id))
         )
         return result.scalar()
 
 async def get_product_image(product_id: int, color_id: int = None):
     """Получить изображение продукта"""
-    async with AsyncSessionLocal() as session:
+    async with get_session() as session:
         stmt = select(ProductImages).filter(ProductImages.product_id == product_id)
         if color_id:
             stmt = stmt.filter(ProductImages.color_id == color_id)
@@ -94,46 +100,307 @@ async def get_product_image(product_id: int, color_id: int = None):
         img_obj = result.scalar()
         
         if img_obj:
-            return os.path.join(base_dir, "stock", "devices_images", img_obj.path)
+            return image_full_path(img_obj.path)
+        return None
+
+def image_full_path(path: str) -> str:
+    """Полный путь к файлу изображения продукта"""
+    return os.path.join(base_dir, "stock", "devices_images", path)
+
+# Кэш хэшей файлов: {путь: ((mtime_ns, size), sha256)}
+_content_hashes = {}
+
+def file_content_hash(file_path: str):
+    """
+    SHA-256 содержимого файла.
+    Пересчитывается только если у файла изменились размер или время изменения.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
         return None
+    fingerprint = (stat.st_mtime_ns, stat.st_size)
+    cached = _content_hashes.get(file_path)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+    _content_hashes[file_path] = (fingerprint, content_hash)
+    return content_hash
+
+async def get_product_image_record(product_id: int, color_id: int = None):
+    """Получить главное изображение продукта вместе с закэшированным file_id Telegram"""
+    async with get_session() as session:
+        stmt = lambda_stmt(lambda: select(
+            ProductImages.id,
+            ProductImages.path,
+            ProductImages.telegram_file_id,
+            ProductImages.content_hash
+        ).filter(ProductImages.product_id == product_id, ProductImages.is_main == True))
+        if color_id:
+            stmt += lambda s: s.filter(ProductImages.color_id == color_id)
+
+        result = await session.execute(stmt)
+        row = result.first()
+
+    if not row:
+        return None
+    return make_image_record(row.id, row.path, row.telegram_file_id, row.content_hash)
+
+async def save_image_file_id(image_id: int, file_id: str, content_hash: str):
+    """Сохранить file_id загруженного в Telegram фото"""
+    async with get_session() as session:
+        try:
+            await session.execute(
+                update(ProductImages)
+                .where(ProductImages.id == image_id)
+                .values(telegram_file_id=file_id, content_hash=content_hash)
+            )
+            await session.commit()
+        except SQLAlchemyError as e:
+            await session.rollback()
+            print(f"Ошибка сохранения file_id изображения {image_id}: {e}")
+
+async def get_images_without_file_id(limit: int = None):
+    """Получить изображения, которые еще не загружались в Telegram"""
+    stmt = (
+        select(ProductImages.id, ProductImages.path)
+        .where(ProductImages.telegram_file_id.is_(None))
+        .order_by(ProductImages.id)
+    )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    async with get_session() as session:
+        result = await session.execute(stmt)
+        return [
+            {"id": row.id, "path": image_full_path(row.path)}
+            for row in result.all()
+        ]
+
+# Плоская запись для карточки товара: названия из справочников и главное фото
+ProductInfo = namedtuple("ProductInfo", [
+    "id",
+    "category",
+    "accessory_brand",
+    "device_model",
+    "series",
+    "variation",
+    "color",
+    "color_id",
+    "price",
+    "description",
+    "image",
+])
+
+def product_info_stmt():
+    """
+    Один запрос с outer join всех справочников и главного фото продукта
+    (фото того же цвета, что и продукт, если цвет задан)
+    """
+    return (
+        select(
+            Products.id,
+            Categories.name.label("category"),
+            AccessoryBrands.name.label("accessory_brand"),
+            DeviceBrands.name.label("device_brand"),
+            DeviceModels.name.label("device_model"),
+            Series.name.label("series"),
+            Variations.name.label("variation"),
+            Colors.name.label("color"),
+            Products.color_id,
+            Products.price,
+            Products.description,
+            ProductImages.id.label("image_id"),
+            ProductImages.path.label("image_path"),
+            ProductImages.telegram_file_id.label("image_file_id"),
+            ProductImages.content_hash.label("image_content_hash")
+        )
+        .select_from(Products)
+        .outerjoin(Categories, Products.category_id == Categories.id)
+        .outerjoin(AccessoryBrands, Products.accessory_brand_id == AccessoryBrands.id)
+        .outerjoin(DeviceModels, Products.device_model_id == DeviceModels.id)
+        .outerjoin(DeviceBrands, DeviceModels.device_brand_id == DeviceBrands.id)
+        .outerjoin(Series, Products.series_id == Series.id)
+        .outerjoin(Variations, Products.variation_id == Variations.id)
+        .outerjoin(Colors, Products.color_id == Colors.id)
+        .outerjoin(
+            ProductImages,
+            (ProductImages.product_id == Products.id)
+            & (ProductImages.is_main == True)
+            & (Products.color_id.is_(None) | (ProductImages.color_id == Products.color_id))
+        )
+        .order_by(Products.id, ProductImages.id)
+    )
+
+def make_image_record(image_id, path, file_id, content_hash):
+    """Запись фото продукта для показа в Telegram"""
+    return {
+        "id": image_id,
+        "path": image_full_path(path),
+        "file_id": file_id,
+        "content_hash": content_hash,
+    }
+
+def _product_info(row) -> ProductInfo:
+    device_model = row.device_model
+    if device_model and row.device_brand:
+        device_model = f"{row.device_brand} {device_model}"
+    image = None
+    if row.image_id is not None:
+        image = make_image_record(row.image_id, row.image_path, row.image_file_id, row.image_content_hash)
+    return ProductInfo(
+        row.id,
+        row.category,
+        row.accessory_brand,
+        device_model,
+        row.series,
+        row.variation,
+        row.color,
+        row.color_id,
+        row.price,
+        row.description,
+        image
+    )
 
 async def get_product_full_info(product_id: int):
-    """Получить полную информацию о продукте для отображения карточки"""
-    async with AsyncSessionLocal() as session:
+    """
+    Получить полную информацию о продукте для отображения карточки одним запросом
+    :return: ProductInfo или None
+    """
+    async with get_session() as session:
         result = await session.execute(
-            select(Products)
-            .options(
-                selectinload(Products.category),
-                selectinload(Products.accessory_brand),
-                selectinload(Products.device_model).selectinload(DeviceModels.device_brand),
-                selectinload(Products.series),
-                selectinload(Products.variation),
-                selectinload(Products.color)
-            )
-            .filter(Products.id == product_id)
+            lambda_stmt(product_info_stmt) + (lambda s: s.where(Products.id == product_id))
         )
-        product = result.scalar()
-        
-        if not product:
-            return None
-        
-        return {
-            "id": product.id,
-            "category": product.category.name if product.category else None,
-            "accessory_brand": product.accessory_brand.name if product.accessory_brand else None,
-            "device_model": str(product.device_model) if product.device_model else None,
-            "series": product.series.name if product.series else None,
-            "variation": product.variation.name if product.variation else None,
-            "color": product.color.name if product.color else None,
-            "color_id": product.color_id,
-            "price": product.price,
-            "description": product.description,
-        }
-
-async def get_cart_items(user_id):
-    """Получить товары из корзины пользователя"""
-    from data.model import Variations
-    stmt = (
+        row = result.first()
+    return _product_info(row) if row else None
+
+async def get_products_full_info(product_ids) -> dict:
+    """
+    Пакетная версия get_product_full_info: все продукты одним запросом
+    :return: {product_id: ProductInfo} (ненайденных продуктов в словаре нет)
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    async with get_session() as session:
+        result = await session.execute(
+            lambda_stmt(product_info_stmt) + (lambda s: s.where(Products.id.in_(product_ids)))
+        )
+        rows = result.all()
+
+    infos = {}
+    for row in rows:
+        # У продукта может быть несколько главных фото - берем первое
+        if row.id not in infos:
+            infos[row.id] = _product_info(row)
+    return infos
+
+def catalog_facets_refresh_stmts():
+    """
+    Запросы перестроения catalog_facets: удалить все строки и вставить заново
+    активные продукты с названиями и порядком сортировки фасетов
+    """
+    source = (
+        select(
+            Products.id,
+            Products.price,
+            Products.category_id,
+            Categories.name,
+            func.coalesce(Categories.sort_order, 0),
+            Products.accessory_brand_id,
+            AccessoryBrands.name,
+            func.coalesce(AccessoryBrands.sort_order, 0),
+            DeviceModels.device_brand_id,
+            DeviceBrands.name,
+            func.coalesce(DeviceBrands.sort_order, 0),
+            Products.device_model_id,
+            DeviceModels.name,
+            func.coalesce(DeviceModels.sort_order, 0),
+            Products.series_id,
+            Series.name,
+            Products.variation_id,
+            Variations.name,
+            Products.color_id,
+            Colors.name
+        )
+        .select_from(Products)
+        .join(Categories, Products.category_id == Categories.id)
+        .join(AccessoryBrands, Products.accessory_brand_id == AccessoryBrands.id)
+        .outerjoin(DeviceModels, Products.device_model_id == DeviceModels.id)
+        .outerjoin(DeviceBrands, DeviceModels.device_brand_id == DeviceBrands.id)
+        .outerjoin(Series, Products.series_id == Series.id)
+        .outerjoin(Variations, Products.variation_id == Variations.id)
+        .outerjoin(Colors, Products.color_id == Colors.id)
+        .where(Products.is_active == True)
+    )
+    columns = [
+        "product_id", "price",
+        "category_id", "category_name", "category_sort",
+        "accessory_brand_id", "accessory_brand_name", "accessory_brand_sort",
+        "device_brand_id", "device_brand_name", "device_brand_sort",
+        "device_model_id", "device_model_name", "device_model_sort",
+        "series_id", "series_name",
+        "variation_id", "variation_name",
+        "color_id", "color_name",
+    ]
+    return delete(CatalogFacets), insert(CatalogFacets).from_select(columns, source)
+
+def catalog_facets_lock_stmt(dialect_name: str):
+    """
+    Параллельные перестроения (админка и импорт) выполняются по очереди, иначе второе
+    не увидит строк, вставленных первым, и упадет на первичном ключе. Чтение не блокируется
+    """
+    if dialect_name == "postgresql":
+        return text("LOCK TABLE catalog_facets IN EXCLUSIVE MODE")
+    return None
+
+async def refresh_catalog_facets():
+    """Перестроить catalog_facets (бот - если таблица еще не заполнена)"""
+    async with get_session() as session:
+        try:
+            lock_stmt = catalog_facets_lock_stmt(session.bind.dialect.name)
+            if lock_stmt is not None:
+                await session.execute(lock_stmt)
+            for stmt in catalog_facets_refresh_stmts():
+                await session.execute(stmt)
+            await session.commit()
+        except SQLAlchemyError as e:
+            await session.rollback()
+            print(f"Ошибка перестроения catalog_facets: {e}")
+
+async def get_catalog_version() -> int:
+    """Текущая версия каталога (0, если каталог еще не менялся)"""
+    async with get_session() as session:
+        result = await session.execute(
+            lambda_stmt(lambda: select(CatalogVersion.version).where(CatalogVersion.id == 1))
+        )
+        return result.scalar() or 0
+
+# Корзина: позиции (строки с полями карточки, price, sum, quantity) и общая сумма
+CartSummary = namedtuple("CartSummary", ["items", "total"])
+
+_cart_listeners = []
+
+def on_cart_change(callback):
+    """Зарегистрировать функцию user_id -> None, которая сбрасывает кэш корзины покупателя"""
+    _cart_listeners.append(callback)
+    return callback
+
+def cart_changed(user_id: int):
+    """Корзина покупателя изменилась (вызывается после commit)"""
+    for callback in _cart_listeners:
+        callback(user_id)
+
+async def get_cart_summary(user_id) -> CartSummary:
+    """
+    Позиции корзины и общая сумма одним запросом: сумма считается оконной функцией
+    по всем строкам корзины и приходит в каждой строке
+    """
+    stmt = lambda_stmt(lambda: (
         select(
             Products.id.label("product_id"),
             Categories.name.label("category"),
@@ -144,7 +411,8 @@ async def get_cart_items(user_id):
             Colors.name.label("color"),
             Products.price,
             (Products.price * CartItems.quantity).label("sum"),
-            CartItems.quantity
+            CartItems.quantity,
+            func.sum(Products.price * CartItems.quantity).over().label("total_sum")
         )
         .select_from(CartItems)
         .outerjoin(Products, CartItems.product_id == Products.id)
@@ -156,117 +424,212 @@ async def get_cart_items(user_id):
         .outerjoin(Colors, Products.color_id == Colors.id)
         .where(CartItems.user_id == user_id)
         .order_by(Categories.name, AccessoryBrands.name)
-    )
-    async with AsyncSessionLocal() as session:
+    ))
+    async with get_session() as session:
         result = await session.execute(stmt)
         cart_items = result.mappings().all()
-    return cart_items
+    if not cart_items:
+        return CartSummary([], 0)
+    return CartSummary(cart_items, cart_items[0]["total_sum"] or 0)
+
+def _upsert_insert(dialect_name: str):
+    """insert с поддержкой ON CONFLICT для диалекта БД (PostgreSQL в проде, SQLite локально)"""
+    if dialect_name == "postgresql":
+        return pg_insert
+    return sqlite_insert
+
+def customer_upsert_stmt(dialect_name: str, user_id: int, username: str):
+    """
+    Добавить покупателя, если его еще нет (ON CONFLICT DO NOTHING): существующая строка
+    не меняется и не блокируется. Смену username записывает update_customer_username
+    """
+    stmt = _upsert_insert(dialect_name)(Customers).values(telegram_id=user_id, username=username)
+    return stmt.on_conflict_do_nothing(index_elements=["telegram_id"])
+
+def cart_item_upsert_stmt(dialect_name: str, product_id: int, user_id: int, quantity: int):
+    """Добавить позицию корзины или увеличить количество существующей"""
+    stmt = _upsert_insert(dialect_name)(CartItems).values(
+        user_id=user_id, product_id=product_id, quantity=quantity
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "product_id"],
+        set_={"quantity": func.coalesce(CartItems.quantity, 0) + stmt.excluded.quantity}
+    )
+
+async def get_known_customers(limit: int):
+    """Последние зарегистрированные покупатели: [(telegram_id, username)]"""
+    async with get_session() as session:
+        result = await session.execute(
+            select(Customers.telegram_id, Customers.username)
+            .order_by(Customers.id.desc())
+            .limit(limit)
+        )
+        return result.all()
 
 async def add_new_customer(user_id: int, username: str):
-    """Добавить нового пользователя или получить существующего"""
-    async with AsyncSessionLocal() as session:
+    """Добавить нового пользователя, если его еще нет"""
+    async with get_session() as session:
         try:
-            result = await session.execute(
-                select(Customers).filter_by(telegram_id=user_id)
-            )
-            customer = result.scalar()
-            if not customer:
-                customer = Customers(telegram_id=user_id, username=username)
-                session.add(customer)
-                await session.commit()
-            return customer
+            await session.execute(customer_upsert_stmt(session.bind.dialect.name, user_id, username))
+            await session.commit()
         except SQLAlchemyError as e:
             await session.rollback()
             print(f"Ошибка добавления нового пользователя {user_id}: {e}")
 
-async def add_cart_item(product_id: int, user_id: int, quantity: int = 1):
-    """Добавить товар в корзину"""
-    async with AsyncSessionLocal() as session:
+async def update_customer_username(user_id: int, username: str):
+    """Обновить username покупателя, если он изменился"""
+    async with get_session() as session:
         try:
-            result = await session.execute(
-                select(CartItems).filter_by(user_id=user_id, product_id=product_id)
+            await session.execute(
+                update(Customers)
+                .where(Customers.telegram_id == user_id, Customers.username != username)
+                .values(username=username)
+                .execution_options(synchronize_session=False)
             )
-            cart_item = result.scalar()
-            if cart_item:
-                cart_item.quantity += quantity
-            else:
-                cart_item = CartItems(user_id=user_id, product_id=product_id, quantity=quantity)
-                session.add(cart_item)
             await session.commit()
         except SQLAlchemyError as e:
             await session.rollback()
-            print(f"Ошибка добавления товара в корзину {product_id}: {e}")
+            print(f"Ошибка обновления username пользователя {user_id}: {e}")
 
-async def count_cart_sum(user_id):
-    """Подсчитать общую сумму корзины"""
-    stmt = (
-        select(
-            func.sum(CartItems.quantity * Products.price).label("total_sum")
-        )
-        .select_from(CartItems)
-        .outerjoin(Products, CartItems.product_id == Products.id)
-        .where(CartItems.user_id == user_id)
-    )
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(stmt)
-        total = result.scalar()
-    return total or 0
+# Результаты add_cart_item
+CART_ITEM_ADDED = "added"
+CART_ITEM_NO_CUSTOMER = "no_customer"
+CART_ITEM_FAILED = "failed"
+
+def _violated_constraint(error: SQLAlchemyError):
+    """Имя нарушенного ограничения PostgreSQL (asyncpg), иначе None"""
+    original = getattr(error, "orig", None)
+    return getattr(getattr(original, "__cause__", None), "constraint_name", None)
+
+async def add_cart_item(product_id: int, user_id: int, quantity: int = 1, username: str = None):
+    """
+    Добавить товар в корзину одним запросом (INSERT ... ON CONFLICT DO UPDATE).
+    Если передан username, покупатель создается (если его нет) в той же транзакции,
+    а в PostgreSQL - в том же запросе (через CTE)
+    :return: CART_ITEM_ADDED; CART_ITEM_NO_CUSTOMER, если покупателя нет в БД
+        (username не передан); CART_ITEM_FAILED при любой другой ошибке
+    """
+    async with get_session() as session:
+        try:
+            dialect_name = session.bind.dialect.name
+            stmt = cart_item_upsert_stmt(dialect_name, product_id, user_id, quantity)
+            if username is not None:
+                customer_stmt = customer_upsert_stmt(dialect_name, user_id, username)
+                if dialect_name == "postgresql":
+                    # Внешний ключ проверяется в конце запроса и видит покупателя из CTE.
+                    # Явный RETURNING: иначе SQLAlchemy добавит его и к внешнему INSERT
+                    stmt = stmt.add_cte(
+                        customer_stmt.returning(Customers.telegram_id).cte("new_customer")
+                    )
+                else:
+                    await session.execute(customer_stmt)
+            await session.execute(stmt)
+            await session.commit()
+            cart_changed(user_id)
+            return CART_ITEM_ADDED
+        except SQLAlchemyError as e:
+            await session.rollback()
+            if _violated_constraint(e) == "cart_items_user_id_fkey":
+                return CART_ITEM_NO_CUSTOMER
+            print(f"Ошибка добавления товара в корзину {product_id}: {e}")
+            return CART_ITEM_FAILED
 
 async def clear_user_cart(user_id):
     """Очистить корзину пользователя"""
-    async with AsyncSessionLocal() as session:
+    async with get_session() as session:
         try:
             stmt = delete(CartItems).where(CartItems.user_id == user_id)
             await session.execute(stmt)
             await session.commit()
+            cart_changed(user_id)
         except SQLAlchemyError as e:
             await session.rollback()
             print(f"Ошибка очистки корзины пользователя {user_id}: {e}")
 
-async def make_order(user_id, date):
-    """Создать заказ из корзины"""
-    async with AsyncSessionLocal() as session:
+# Оформленный заказ: id, сумма и позиции (строки order_details_stmt)
+OrderSummary = namedtuple("OrderSummary", ["id", "total_price", "items"])
+
+async def make_order(user_id, date, render_notification=None):
+    """
+    Создать заказ из корзины одной транзакцией: заказ с суммой, посчитанной в SQL,
+    позиции через INSERT ... SELECT из корзины, очистка корзины и выборка состава заказа.
+    Число запросов не зависит от размера корзины.
+    :param render_notification: функция OrderSummary -> текст уведомления админам;
+        уведомления попадают в очередь order_notifications в той же транзакции
+    :return: OrderSummary или None, если корзина пуста
+    """
+    cart_total = (
+        select(func.coalesce(func.sum(CartItems.quantity * Products.price), 0))
+        .select_from(CartItems)
+        .outerjoin(Products, CartItems.product_id == Products.id)
+        .where(CartItems.user_id == user_id)
+        .scalar_subquery()
+    )
+    status_id = (
+        select(OrderStatuses.id)
+        .where(OrderStatuses.name == "В работе")
+        .limit(1)
+        .scalar_subquery()
+    )
+
+    async with get_session() as session:
         try:
-            total_price = await count_cart_sum(user_id)
-            result = await session.execute(
-                select(OrderStatuses).where(OrderStatuses.name == "В работе")
+            # Блокируем покупателя, чтобы параллельное оформление не продублировало заказ из той же корзины
+            await session.execute(
+                select(Customers.id).where(Customers.telegram_id == user_id).with_for_update()
             )
-            status = result.scalar_one_or_none()
-            order = Orders(customer_id=user_id, created_at=date, status=status, total_price=total_price)
+
+            order = Orders(customer_id=user_id, created_at=date, status_id=status_id, total_price=cart_total)
             session.add(order)
             await session.flush()
-            
-            stmt = (
-                select(
-                    CartItems.quantity,
-                    CartItems.product_id
+            order_id = order.id
+
+            result = await session.execute(
+                insert(OrderItems).from_select(
+                    ["order_id", "quantity", "product_id"],
+                    select(literal(order_id), CartItems.quantity, CartItems.product_id)
+                    .where(CartItems.user_id == user_id)
+                    .order_by(CartItems.id)
                 )
-                .select_from(CartItems)
-                .where(CartItems.user_id == user_id)
             )
-            result = await session.execute(stmt)
-            cart_items = result.mappings().all()
-            
-            if not cart_items:
+            if not result.rowcount:
                 print("Корзина пуста — заказ не создан.")
                 await session.rollback()
                 return None
-            
-            for cart_item in cart_items:
-                order_item = OrderItems(
-                    order_id=order.id,
-                    quantity=cart_item["quantity"],
-                    product_id=cart_item["product_id"]
-                )
-                session.add(order_item)
-            
-            await clear_user_cart(user_id)
+
+            await session.execute(delete(CartItems).where(CartItems.user_id == user_id))
+
+            result = await session.execute(order_details_stmt(order_id))
+            order_items = result.mappings().all()
+            order_summary = OrderSummary(order_id, sum(item["sum"] or 0 for item in order_items), order_items)
+
+            if render_notification is not None:
+                result = await session.execute(select(Admins.id))
+                admin_ids = result.scalars().all()
+                if admin_ids:
+                    text = render_notification(order_summary)
+                    now = datetime.now(timezone.utc)
+                    await session.execute(insert(OrderNotifications).values([
+                        {
+                            "order_id": order_id,
+                            "chat_id": admin_id,
+                            "text": text,
+                            "status": "pending",
+                            "attempts": 0,
+                            "next_attempt_at": now,
+                            "created_at": now,
+                        }
+                        for admin_id in admin_ids
+                    ]))
+
             await session.commit()
+            cart_changed(user_id)
         except SQLAlchemyError as e:
             await session.rollback()
             print(f"Ошибка создания заказа: {e}")
             return None
-        return order
+
+    return order_summary
 
 async def get_admins():
     """Получить список админов"""
@@ -276,15 +639,107 @@ async def get_admins():
             Admins.id
         ).select_from(Admins)
     )
-    async with AsyncSessionLocal() as session:
+    async with get_session() as session:
         result = await session.execute(stmt)
         admins = result.mappings().all()
     return admins
 
-async def get_order_details(order_id):
-    """Получить детали заказа"""
-    from data.model import Variations
-    stmt = (
+async def claim_order_notifications(limit: int, lease_seconds: int):
+    """
+    Забрать пачку уведомлений, готовых к отправке.
+    Строки блокируются с SKIP LOCKED, поэтому несколько воркеров не берут одно и то же,
+    и откладываются на lease_seconds: если воркер упадет, не дождавшись отправки,
+    уведомление вернется в очередь.
+    """
+    now = datetime.now(timezone.utc)
+    async with get_session() as session:
+        try:
+            result = await session.execute(
+                select(
+                    OrderNotifications.id,
+                    OrderNotifications.order_id,
+                    OrderNotifications.chat_id,
+                    OrderNotifications.text,
+                    OrderNotifications.attempts,
+                    OrderNotifications.created_at
+                )
+                .where(
+                    OrderNotifications.status == "pending",
+                    OrderNotifications.next_attempt_at <= now
+                )
+                .order_by(OrderNotifications.next_attempt_at, OrderNotifications.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            notifications = result.all()
+            if notifications:
+                await session.execute(
+                    update(OrderNotifications)
+                    .where(OrderNotifications.id.in_([row.id for row in notifications]))
+                    .values(next_attempt_at=now + timedelta(seconds=lease_seconds))
+                    .execution_options(synchronize_session=False)
+                )
+            await session.commit()
+        except SQLAlchemyError as e:
+            await session.rollback()
+            print(f"Ошибка выборки уведомлений о заказах: {e}")
+            return []
+    return notifications
+
+async def save_order_notification_results(results: list):
+    """
+    Сохранить результаты отправки одним executemany
+    :param results: словари id, status, attempts, next_attempt_at, sent_at, last_error
+    """
+    if not results:
+        return
+    async with get_session() as session:
+        try:
+            await session.execute(
+                update(OrderNotifications.__table__)
+                .where(OrderNotifications.__table__.c.id == bindparam("notification_id"))
+                .values(
+                    status=bindparam("status"),
+                    attempts=bindparam("attempts"),
+                    next_attempt_at=bindparam("next_attempt_at"),
+                    sent_at=bindparam("sent_at"),
+                    last_error=bindparam("last_error")
+                ),
+                [
+                    {"notification_id": result["id"], **{key: value for key, value in result.items() if key != "id"}}
+                    for result in results
+                ]
+            )
+            await session.commit()
+        except SQLAlchemyError as e:
+            await session.rollback()
+            print(f"Ошибка сохранения статусов уведомлений: {e}")
+
+async def get_order_notifications_backlog():
+    """
+    Очередь уведомлений
+    :return: (число неотправленных, время создания самого старого из них или None)
+    """
+    async with get_session() as session:
+        result = await session.execute(
+            select(func.count(OrderNotifications.id), func.min(OrderNotifications.created_at))
+            .where(OrderNotifications.status == "pending")
+        )
+        count, oldest = result.one()
+    return count, oldest
+
+async def get_order_notification_statuses(order_id: int) -> dict:
+    """Статусы доставки уведомлений заказа: {chat_id: status}"""
+    async with get_session() as session:
+        result = await session.execute(
+            select(OrderNotifications.chat_id, OrderNotifications.status)
+            .where(OrderNotifications.order_id == order_id)
+        )
+        return dict(result.all())
+
+def order_details_stmt(order_id):
+    """Позиции заказа с названиями из справочников"""
+    return (
         select(
             Categories.name.label("category"),
             AccessoryBrands.name.label("brand"),
@@ -307,8 +762,11 @@ async def get_order_details(order_id):
         .where(OrderItems.order_id == order_id)
         .order_by(Categories.name, AccessoryBrands.name)
     )
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(stmt)
+
+async def get_order_details(order_id):
+    """Получить детали заказа"""
+    async with get_session() as session:
+        result = await session.execute(order_details_stmt(order_id))
         order_items = result.mappings().all()
     return order_items
 
@@ -317,7 +775,7 @@ async def get_order_details(order_id):
 # ==========================================
 
 # Создаем синхронный движок для Flask
-sync_engine = create_engine(db_link, echo=True)
+sync_engine = create_engine(db_link, **engine_options(db_link))
 SyncSessionLocal = sessionmaker(bind=sync_engine)
 
 def get_or_create_sync(local_session, model, **kwargs):
@@ -329,3 +787,100 @@ def get_or_create_sync(local_session, model, **kwargs):
     local_session.add(instance)
     local_session.flush()
     return instance
+
+def refresh_catalog_facets_sync(session):
+    """Перестроить catalog_facets в транзакции сессии (читатели видят старые строки до коммита)"""
+    lock_stmt = catalog_facets_lock_stmt(session.bind.dialect.name)
+    if lock_stmt is not None:
+        session.execute(lock_stmt)
+    for stmt in catalog_facets_refresh_stmts():
+        session.execute(stmt)
+
+def bump_catalog_version_sync(session, refresh_facets: bool = True):
+    """
+    Увеличить версию каталога в транзакции сессии, чтобы бот сбросил закэшированные
+    карточки и индекс. Если изменились фасеты (продукты, справочники) - сначала
+    перестроить catalog_facets. Ошибку получает вызывающий - вместе с ней откатится и правка
+    """
+    if refresh_facets:
+        refresh_catalog_facets_sync(session)
+    updated = session.execute(
+        update(CatalogVersion)
+        .where(CatalogVersion.id == 1)
+        .values(version=CatalogVersion.version + 1, updated_at=datetime.now())
+    )
+    if not updated.rowcount:
+        session.add(CatalogVersion(id=1, version=1))
+
+# Правки в админке коммитит сам Flask-AppBuilder, поэтому view только отмечает изменение
+# каталога в сессии, а перестроение фасетов и новая версия выполняются перед ее commit
+CATALOG_CHANGE_KEY = "catalog_change"
+
+def mark_catalog_change_sync(session, refresh_facets: bool = True):
+    """Отметить изменение каталога: версия (и catalog_facets) обновятся в транзакции этой правки"""
+    session.info[CATALOG_CHANGE_KEY] = session.info.get(CATALOG_CHANGE_KEY, False) or refresh_facets
+
+@event.listens_for(Session, "before_commit")
+def _apply_catalog_change(session):
+    if CATALOG_CHANGE_KEY not in session.info:
+        return
+    refresh_facets = session.info.pop(CATALOG_CHANGE_KEY)
+    # Сама правка еще не записана: перестроение должно ее видеть
+    session.flush()
+    bump_catalog_version_sync(session, refresh_facets)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_catalog_change(session, previous_transaction):
+    session.info.pop(CATALOG_CHANGE_KEY, None)
+
+def create_import_job_sync(filename: str, file_path: str = None, mode: str = "update", dry_run: bool = False) -> int:
+    """Создать задание импорта в статусе queued"""
+    with SyncSessionLocal() as session:
+        job = ImportJobs(filename=filename, file_path=file_path, mode=mode, dry_run=dry_run, status="queued")
+        session.add(job)
+        session.commit()
+        return job.id
+
+def update_import_job_sync(job_id: int, **values):
+    """Обновить поля задания импорта отдельной короткой транзакцией (прогресс виден сразу)"""
+    with SyncSessionLocal() as session:
+        try:
+            session.execute(update(ImportJobs).where(ImportJobs.id == job_id).values(**values))
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"Ошибка обновления задания импорта {job_id}: {e}")
+
+def get_import_job_sync(job_id: int):
+    """Получить задание импорта"""
+    with SyncSessionLocal() as session:
+        return session.get(ImportJobs, job_id)
+
+def get_recent_import_jobs_sync(limit: int = 10):
+    """Последние задания импорта"""
+    with SyncSessionLocal() as session:
+        return session.query(ImportJobs).order_by(ImportJobs.id.desc()).limit(limit).all()
+
+def get_expired_import_previews_sync(before: datetime):
+    """Предпросмотры синхронизации, завершенные раньше before, чьи файлы еще не удалены"""
+    with SyncSessionLocal() as session:
+        return session.query(ImportJobs).filter(
+            ImportJobs.dry_run == True,
+            ImportJobs.file_path.isnot(None),
+            ImportJobs.finished_at < before
+        ).all()
+
+def take_import_job_file_sync(job_id: int):
+    """
+    Забрать файл задания импорта: атомарно обнуляет file_path,
+    поэтому повторное нажатие "Применить" не запустит синхронизацию второй раз
+    :return: путь к файлу или None, если его уже забрали
+    """
+    with SyncSessionLocal() as session:
+        file_path = session.execute(
+            select(ImportJobs.file_path).where(ImportJobs.id == job_id).with_for_update()
+        ).scalar()
+        if file_path is not None:
+            session.execute(update(ImportJobs).where(ImportJobs.id == job_id).values(file_path=None))
+        session.commit()
+        return file_path
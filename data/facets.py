@@ -0,0 +1,335 @@
+import asyncio
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from config_reader import config
+from data.catalog import check_catalog_version, on_catalog_change
+from data.crud import refresh_catalog_facets
+from data.model import get_session, CatalogFacets, Categories, Products
+
+# ==========================================
+# ИНДЕКС ФАСЕТОВ КАТАЛОГА (В ПАМЯТИ ПРОЦЕССА)
+# ==========================================
+
+# Фасеты в порядке воронки выбора товара
+FACETS = (
+    "category",
+    "accessory_brand",
+    "device_brand",
+    "device_model",
+    "series",
+    "variation",
+    "color",
+)
+
+FacetValue = namedtuple("FacetValue", ["id", "name", "sort_order"])
+ProductRow = namedtuple("ProductRow", ["id", "price", "variation"])
+
+# Максимальное число закэшированных выборок в одном снимке индекса
+MAX_CACHED_SELECTIONS = 4096
+
+
+def sort_key(value: FacetValue) -> tuple:
+    """Ключ сортировки и keyset-пагинации значений фасета: (sort_order, name, id)"""
+    return (value.sort_order, value.name, value.id)
+
+
+def _iter_bits(mask: int):
+    """Позиции установленных битов маски по возрастанию"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class FacetIndex:
+    """
+    Неизменяемый снимок активных продуктов каталога.
+
+    Каждая строка - один активный продукт (в порядке id). Для каждого фасета
+    хранится массив id значений по строкам (0 - значение не задано), битовая
+    маска строк для частых значений и отсортированные номера строк для редких.
+    Пересечение выбранных фильтров - это AND масок (или проверка строк редкого
+    значения по колонкам), поэтому ответы на вопросы воронки не требуют обращений к БД.
+    """
+
+    def __init__(self, rows, labels):
+        """
+        :param rows: строки (product_id, price, category_id, accessory_brand_id,
+            device_brand_id, device_model_id, series_id, variation_id, color_id)
+        :param labels: {фасет: {id: (name, sort_order)}} для всех записей справочников
+        """
+        self.built_at = time.monotonic()
+        self.size = len(rows)
+        self.all_rows = (1 << self.size) - 1
+        self.mask_bytes = (self.size + 7) // 8
+
+        self.product_ids = array("i", (row[0] for row in rows))
+        self.prices = [row[1] for row in rows]
+        self.columns = {}
+        self.bits = {}
+        self.rows = {}
+        for position, facet in enumerate(FACETS, start=2):
+            column = array("i", (row[position] or 0 for row in rows))
+            positions = {}
+            for row_number, value_id in enumerate(column):
+                if value_id:
+                    value_rows = positions.get(value_id)
+                    if value_rows is None:
+                        value_rows = positions[value_id] = array("i")
+                    value_rows.append(row_number)
+
+            # Частые значения - битовые маски, редкие - номера строк: маска стоит
+            # mask_bytes на значение независимо от числа строк, поэтому для фасетов
+            # с тысячами значений (модели устройств) память росла бы как значения x строки
+            bits = {}
+            for value_id, value_rows in positions.items():
+                if len(value_rows) * value_rows.itemsize > self.mask_bytes:
+                    buffer = bytearray(self.mask_bytes)
+                    for row_number in value_rows:
+                        buffer[row_number >> 3] |= 1 << (row_number & 7)
+                    bits[value_id] = int.from_bytes(buffer, "little")
+            for value_id in bits:
+                del positions[value_id]
+
+            self.columns[facet] = column
+            self.bits[facet] = bits
+            self.rows[facet] = positions
+
+        self.labels = {}
+        self.ordered = {}
+        for facet in FACETS:
+            values = [
+                FacetValue(value_id, name, sort_order or 0)
+                for value_id, (name, sort_order) in labels.get(facet, {}).items()
+            ]
+            values.sort(key=sort_key)
+            self.labels[facet] = {value.id: value for value in values}
+            self.ordered[facet] = values
+
+        self._cache = {}
+
+    def mask(self, **filters) -> int:
+        """Битовая маска строк, подходящих под выбранные фильтры (пустые фильтры игнорируются)"""
+        chosen = [(facet, value_id) for facet, value_id in filters.items() if value_id]
+        sparse = []
+        for facet, value_id in chosen:
+            value_rows = self.rows[facet].get(value_id)
+            if value_rows is not None:
+                sparse.append((len(value_rows), facet, value_id))
+            elif value_id not in self.bits[facet]:
+                return 0
+
+        if sparse:
+            # Кандидаты - строки самого редкого значения, остальные фильтры проверяются по колонкам
+            _, facet, value_id = min(sparse)
+            checks = [
+                (self.columns[other_facet], other_value)
+                for other_facet, other_value in chosen
+                if other_facet != facet
+            ]
+            buffer = bytearray(self.mask_bytes)
+            for row_number in self.rows[facet][value_id]:
+                if all(column[row_number] == other_value for column, other_value in checks):
+                    buffer[row_number >> 3] |= 1 << (row_number & 7)
+            return int.from_bytes(buffer, "little")
+
+        mask = self.all_rows
+        for facet, value_id in chosen:
+            mask &= self.bits[facet][value_id]
+            if not mask:
+                break
+        return mask
+
+    def count(self, **filters) -> int:
+        """Количество активных продуктов под выбранные фильтры"""
+        return self.mask(**filters).bit_count()
+
+    def values(self, facet: str, **filters) -> list:
+        """
+        Оставшиеся значения фасета при выбранных фильтрах
+        :return: список FacetValue, отсортированный по (sort_order, name, id)
+        """
+        key = (facet, tuple(sorted((name, value) for name, value in filters.items() if value)))
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        mask = self.mask(**filters)
+        facet_bits = self.bits[facet]
+        facet_rows = self.rows[facet]
+        if not mask:
+            result = []
+        elif mask.bit_count() < len(facet_bits) + len(facet_rows):
+            # Строк мало - собираем значения по самим строкам
+            column = self.columns[facet]
+            present = {column[row_number] for row_number in _iter_bits(mask)}
+            result = [value for value in self.ordered[facet] if value.id in present]
+        else:
+            # Редкие значения проверяем по байтам маски: сдвиг большого числа стоит O(строк)
+            mask_buffer = mask.to_bytes(self.mask_bytes, "little")
+            result = []
+            for value in self.ordered[facet]:
+                value_bits = facet_bits.get(value.id)
+                if value_bits is not None:
+                    if value_bits & mask:
+                        result.append(value)
+                elif any(
+                    mask_buffer[row_number >> 3] >> (row_number & 7) & 1
+                    for row_number in facet_rows.get(value.id, ())
+                ):
+                    result.append(value)
+
+        if len(self._cache) >= MAX_CACHED_SELECTIONS:
+            self._cache.clear()
+        self._cache[key] = result
+        return result
+
+    def distinct_count(self, facet: str, **filters) -> int:
+        """Количество различных значений фасета при выбранных фильтрах"""
+        return len(self.values(facet, **filters))
+
+    def all_values(self, facet: str) -> list:
+        """Все значения справочника фасета, в том числе без активных продуктов"""
+        return self.ordered[facet]
+
+    def seek(self, facet: str, items: list, anchor_id: int) -> int:
+        """
+        Позиция первого элемента списка, не меньшего якоря, по ключу сортировки.
+        Якорь ищется по справочнику, поэтому позиция корректна, даже если сам он
+        уже выпал из выборки. facet=None - список продуктов (ключ - id).
+        """
+        if facet is None:
+            return bisect_left(items, anchor_id, key=lambda product: product.id)
+        anchor = self.labels[facet].get(anchor_id)
+        if anchor is None:
+            return None
+        return bisect_left(items, sort_key(anchor), key=sort_key)
+
+    def products(self, **filters) -> list:
+        """Активные продукты под выбранные фильтры, в порядке id"""
+        variations = self.labels["variation"]
+        variation_column = self.columns["variation"]
+        result = []
+        for row_number in _iter_bits(self.mask(**filters)):
+            variation = variations.get(variation_column[row_number])
+            result.append(ProductRow(
+                self.product_ids[row_number],
+                self.prices[row_number],
+                variation.name if variation else None
+            ))
+        return result
+
+
+def _facet_rows_stmt():
+    """
+    Строки catalog_facets: product_id, price, id значений фасетов (в порядке FACETS),
+    затем для каждого фасета название и порядок сортировки (если он есть у справочника)
+    """
+    columns = [CatalogFacets.product_id, CatalogFacets.price]
+    columns += [getattr(CatalogFacets, f"{facet}_id") for facet in FACETS]
+    label_positions = []
+    for position, facet in enumerate(FACETS, start=2):
+        name_position = len(columns)
+        columns.append(getattr(CatalogFacets, f"{facet}_name"))
+        sort_column = getattr(CatalogFacets, f"{facet}_sort", None)
+        sort_position = None
+        if sort_column is not None:
+            sort_position = len(columns)
+            columns.append(sort_column)
+        label_positions.append((facet, position, name_position, sort_position))
+    return select(*columns).order_by(CatalogFacets.product_id), label_positions
+
+
+async def load_facet_index() -> FacetIndex:
+    """
+    Построить новый снимок индекса по catalog_facets: id, названия и порядок значений
+    всех фасетов приходят одним чтением одной таблицы. Отдельно читаются только
+    категории - их список показывается целиком, включая пустые
+    """
+    stmt, label_positions = _facet_rows_stmt()
+    async with get_session() as session:
+        result = await session.execute(stmt)
+        rows = result.all()
+        if not rows and await _has_active_products(session):
+            # Таблица еще не заполнена (новая БД) - перестраиваем и читаем снова
+            await refresh_catalog_facets()
+            result = await session.execute(stmt)
+            rows = result.all()
+
+        result = await session.execute(
+            select(Categories.id, Categories.name, Categories.sort_order)
+        )
+        labels = {facet: {} for facet in FACETS}
+        labels["category"] = {row[0]: (row[1], row[2]) for row in result.all()}
+
+    for row in rows:
+        for facet, position, name_position, sort_position in label_positions:
+            value_id = row[position]
+            if value_id and value_id not in labels[facet]:
+                sort_order = row[sort_position] if sort_position is not None else 0
+                labels[facet][value_id] = (row[name_position], sort_order)
+
+    return FacetIndex([row[:2 + len(FACETS)] for row in rows], labels)
+
+
+async def _has_active_products(session) -> bool:
+    result = await session.execute(select(Products.id).where(Products.is_active == True).limit(1))
+    return result.first() is not None
+
+
+_index = None
+_stale = False
+_lock = asyncio.Lock()
+
+
+async def rebuild_facet_index() -> FacetIndex:
+    """Принудительно перестроить индекс (например, после изменения каталога)"""
+    async with _lock:
+        return await _rebuild_locked()
+
+
+@on_catalog_change
+def invalidate_facet_index():
+    """Пометить индекс устаревшим: он будет перестроен при следующем обращении"""
+    global _stale
+    _stale = True
+
+
+async def get_facet_index() -> FacetIndex:
+    """
+    Получить актуальный индекс фасетов.
+    Индекс строится при первом обращении и перестраивается, если он помечен
+    устаревшим (изменилась версия каталога) или старше config.facet_index_ttl секунд.
+    """
+    await check_catalog_version()
+    index = _index
+    if (
+        index is not None
+        and not _stale
+        and time.monotonic() - index.built_at < config.facet_index_ttl
+    ):
+        return index
+
+    async with _lock:
+        # Индекс мог быть перестроен, пока мы ждали блокировку
+        index = _index
+        if (
+            index is None
+            or _stale
+            or time.monotonic() - index.built_at >= config.facet_index_ttl
+        ):
+            return await _rebuild_locked()
+        return index
+
+
+async def _rebuild_locked() -> FacetIndex:
+    global _index, _stale
+    # Сбрасываем флаг до загрузки, чтобы не потерять инвалидацию во время перестроения
+    _stale = False
+    _index = await load_facet_index()
+    return _index
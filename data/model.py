@@ -3,23 +3,76 @@ from operator import index
 from sqlalchemy import (
     create_engine,
     Column,
-    Integer, String,
+    Integer, String, Text,
     ForeignKey,
     Table,
     DateTime,
     BigInteger,
     UniqueConstraint,
-    Boolean
+    Boolean,
+    Index,
+    text
 )
 
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
-from config_reader import db_link_async
+from config_reader import config, db_link_async
+from contextlib import asynccontextmanager
 from datetime import datetime
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 
 Base = declarative_base()
 
-engine = create_async_engine(db_link_async, future=True, echo=True)
+
+def _echo(value: str):
+    value = str(value).strip().lower()
+    if value == "debug":
+        return "debug"
+    return value in ("1", "true", "yes", "info")
+
+
+def engine_options(url: str, statement_timeout: int = None, idle_in_transaction_timeout: int = None) -> dict:
+    """
+    Параметры движка из настроек: пул, pre-ping, логирование SQL, ограничение времени запроса
+    и простоя внутри открытой транзакции (миллисекунд).
+    Для SQLite пул не настраивается - у него свои классы пулов без этих параметров
+    """
+    options = {
+        "echo": _echo(config.db_echo),
+        "pool_pre_ping": config.db_pool_pre_ping,
+    }
+    if url.startswith("sqlite"):
+        return options
+
+    options.update(
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_timeout=config.db_pool_timeout,
+        pool_recycle=config.db_pool_recycle,
+    )
+    server_settings = {}
+    if statement_timeout:
+        server_settings["statement_timeout"] = str(statement_timeout)
+    if idle_in_transaction_timeout:
+        server_settings["idle_in_transaction_session_timeout"] = str(idle_in_transaction_timeout)
+
+    connect_args = {}
+    if "asyncpg" in url:
+        # Подготовленные на сервере запросы переиспользуются в пределах соединения
+        connect_args["prepared_statement_cache_size"] = config.db_prepared_statement_cache_size
+        if server_settings:
+            connect_args["server_settings"] = server_settings
+    elif server_settings and url.startswith("postgresql"):
+        connect_args["options"] = " ".join(f"-c {name}={value}" for name, value in server_settings.items())
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+engine = create_async_engine(
+    db_link_async,
+    future=True,
+    **engine_options(db_link_async, config.db_statement_timeout, config.db_idle_in_transaction_timeout)
+)
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
@@ -28,6 +81,15 @@ AsyncSessionLocal = sessionmaker(
     autocommit=False,
 )
 
+@asynccontextmanager
+async def get_session():
+    """
+    Сессия для запросов бота на время блока: соединение берется из пула только
+    на время запросов блока, поэтому апдейт не держит его во время обращений к Telegram
+    """
+    async with AsyncSessionLocal() as session:
+        yield session
+
 # Таблица Категория аксессуаров
 class Categories(Base):
     __tablename__ = "categories"
@@ -143,6 +205,19 @@ class Products(Base):
             'color_id', 
             name='uq_product_combination'
         ),
+        # Фильтры воронки по активным продуктам (в порядке воронки).
+        # SQLite применяет частичный индекс, только если условие запроса совпадает с ним буквально
+        Index(
+            "ix_products_active_funnel",
+            "category_id",
+            "accessory_brand_id",
+            "device_model_id",
+            "series_id",
+            "variation_id",
+            "color_id",
+            postgresql_where=text("is_active"),
+            sqlite_where=text("is_active = 1")
+        ),
     )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -197,6 +272,23 @@ class Products(Base):
 # Таблица изображений продуктов
 class ProductImages(Base):
     __tablename__ = "product_images"
+    __table_args__ = (
+        # Главное фото продукта (и его цвета)
+        Index(
+            "ix_product_images_main",
+            "product_id",
+            "color_id",
+            postgresql_where=text("is_main"),
+            sqlite_where=text("is_main = 1")
+        ),
+        # Фото, которые еще не загружались в Telegram
+        Index(
+            "ix_product_images_without_file_id",
+            "id",
+            postgresql_where=text("telegram_file_id IS NULL"),
+            sqlite_where=text("telegram_file_id IS NULL")
+        ),
+    )
     id = Column(Integer, primary_key=True)
     path = Column(String, nullable=False)
     is_main = Column(Boolean, default=False)
@@ -207,6 +299,10 @@ class ProductImages(Base):
     color_id = Column(Integer, ForeignKey("colors.id", ondelete="CASCADE"), nullable=True)
     color = relationship("Colors", back_populates="images")
 
+    # file_id фото после первой загрузки в Telegram и хэш файла, для которого он получен
+    telegram_file_id = Column(String(255), nullable=True)
+    content_hash = Column(String(64), nullable=True)
+
 class Customers(Base):
     __tablename__ = "customers"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -224,6 +320,11 @@ class Customers(Base):
 
 class CartItems(Base):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        # Одна позиция на продукт: повторное добавление увеличивает количество (ON CONFLICT)
+        UniqueConstraint("user_id", "product_id", name="uq_cart_items_user_product"),
+        Index("ix_cart_items_product_id", "product_id"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey("customers.telegram_id"), nullable=False)
 
@@ -273,6 +374,26 @@ class OrderItems(Base):
     def __repr__(self):
         return self.__str__()
 
+# Очередь уведомлений админам о заказах (outbox): строки пишутся в транзакции заказа,
+# фоновый воркер бота отправляет их и отмечает результат
+class OrderNotifications(Base):
+    __tablename__ = "order_notifications"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), nullable=False, index=True)
+    chat_id = Column(BigInteger, nullable=False)
+    text = Column(Text, nullable=False)
+    # pending - ждет отправки, sent - доставлено, failed - доставить не удалось
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(String(500), nullable=True)
+
+    __table_args__ = (
+        Index("ix_order_notifications_status_next_attempt", "status", "next_attempt_at"),
+    )
+
 class Admins(Base):
     __tablename__ = "admins"
     id = Column(BigInteger, unique=True,  primary_key=True)
@@ -296,6 +417,70 @@ class OrderStatuses(Base):
     def __repr__(self):
         return self.name
 
+# Задания импорта каталога из файла: выполняются в фоне, админка опрашивает прогресс
+class ImportJobs(Base):
+    __tablename__ = "import_jobs"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    filename = Column(String(255), nullable=False)
+    # update - только добавить и обновить, sync - полная синхронизация (товары не из файла выключаются)
+    mode = Column(String(20), nullable=False, default="update")
+    # Предпросмотр: изменения считаются и откатываются, файл остается для применения
+    dry_run = Column(Boolean, nullable=False, default=False)
+    file_path = Column(String(500), nullable=True)
+    # queued - в очереди, running - выполняется, done - завершено, failed - ошибка
+    status = Column(String(20), nullable=False, default="queued")
+    total_rows = Column(Integer, nullable=True)
+    processed_rows = Column(Integer, nullable=False, default=0)
+    added_count = Column(Integer, nullable=False, default=0)
+    updated_count = Column(Integer, nullable=False, default=0)
+    unchanged_count = Column(Integer, nullable=False, default=0)
+    removed_count = Column(Integer, nullable=False, default=0)
+    error_count = Column(Integer, nullable=False, default=0)
+    # Ошибки по строкам: JSON-список {"row": номер строки в файле, "error": текст}
+    errors = Column(Text, nullable=True)
+    # Примеры изменений синхронизации: JSON {"added": [...], "changed": [...], "removed": [...]}
+    preview = Column(Text, nullable=True)
+    message = Column(String(500), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=datetime.now)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+# Плоская копия активных продуктов для воронки выбора: id и названия всех фасетов в одной строке.
+# Перестраивается в транзакции каждого изменения каталога (crud.refresh_catalog_facets_sync).
+# Бот читает таблицу целиком одним запросом и отвечает на вопросы воронки по индексу
+# в памяти (data.facets), поэтому индексов по фасетам у нее нет
+class CatalogFacets(Base):
+    __tablename__ = "catalog_facets"
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    price = Column(Integer, nullable=True)
+
+    category_id = Column(Integer, nullable=False)
+    category_name = Column(String(100), nullable=False)
+    category_sort = Column(Integer, nullable=False, default=0)
+    accessory_brand_id = Column(Integer, nullable=False)
+    accessory_brand_name = Column(String(100), nullable=False)
+    accessory_brand_sort = Column(Integer, nullable=False, default=0)
+    device_brand_id = Column(Integer, nullable=True)
+    device_brand_name = Column(String(100), nullable=True)
+    device_brand_sort = Column(Integer, nullable=True)
+    device_model_id = Column(Integer, nullable=True)
+    device_model_name = Column(String(100), nullable=True)
+    device_model_sort = Column(Integer, nullable=True)
+    series_id = Column(Integer, nullable=True)
+    series_name = Column(String(100), nullable=True)
+    variation_id = Column(Integer, nullable=True)
+    variation_name = Column(String(200), nullable=True)
+    color_id = Column(Integer, nullable=True)
+    color_name = Column(String(100), nullable=True)
+
+# Версия каталога: увеличивается при каждом изменении каталога в админке или импорте,
+# по ней бот сбрасывает свои кэши (карточки товаров, индекс фасетов)
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), default=datetime.now, onupdate=datetime.now)
+
 async def init_models():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
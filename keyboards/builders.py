@@ -1,17 +1,5 @@
-import asyncio
 from aiogram.utils.keyboard import InlineKeyboardBuilder, InlineKeyboardButton
-from sqlalchemy import select, func, desc
-from data.model import (
-    AsyncSessionLocal,
-    Categories,
-    AccessoryBrands,
-    DeviceBrands,
-    DeviceModels,
-    Series,
-    Variations,
-    Colors,
-    Products
-)
+from data.facets import get_facet_index
 from keyboards.inline import main_menu_button, back_button
 
 MAX_PAGE_SIZE = 6
@@ -26,13 +14,26 @@ def count_pages(count, page_size, page):
     page = page % total_pages if total_pages > 0 else 0
     return page, total_pages
 
-def make_pagination_buttons(prefix: str, items: list, total_pages: int, page: int) -> list:
+def encode_page(page: int, anchor: int = None) -> str:
+    """Номер страницы для callback_data; якорь keyset-пагинации дописывается через ':'"""
+    return str(page) if anchor is None else f"{page}:{anchor}"
+
+def parse_page(value: str):
+    """
+    Разбор номера страницы из callback_data
+    :return: (номер страницы, id якоря или None для старых кнопок без якоря)
+    """
+    page, _, anchor = value.partition(":")
+    return int(page), int(anchor) if anchor else None
+
+def make_pagination_buttons(prefix: str, items: list, total_pages: int, page: int, anchors=None) -> list:
     """
     Создание кнопок пагинации
     :param prefix: префикс для callback_data (например, 'pg_category')
     :param items: список данных для callback_data
     :param total_pages: общее количество страниц
     :param page: текущая страница
+    :param anchors: id первых элементов предыдущей и следующей страниц (keyset-пагинация)
     :return: список кнопок
     """
     if items:
@@ -40,6 +41,8 @@ def make_pagination_buttons(prefix: str, items: list, total_pages: int, page: in
     else:
         callback_data_string = ""
 
+    prev_anchor, next_anchor = anchors or (None, None)
+
     pagination_buttons = []
     if total_pages > 1:
         prev_page = (page - 1) if page > 0 else total_pages - 1
@@ -48,135 +51,135 @@ def make_pagination_buttons(prefix: str, items: list, total_pages: int, page: in
         pagination_buttons.append(
             InlineKeyboardButton(
                 text="⬅️",
-                callback_data=f"{prefix}_prev{callback_data_string}_{prev_page}"
+                callback_data=f"{prefix}_prev{callback_data_string}_{encode_page(prev_page, prev_anchor)}"
             )
         )
         pagination_buttons.append(
             InlineKeyboardButton(
                 text="➡️",
-                callback_data=f"{prefix}_next{callback_data_string}_{next_page}"
+                callback_data=f"{prefix}_next{callback_data_string}_{encode_page(next_page, next_anchor)}"
             )
         )
     return pagination_buttons
 
+def paginate(index, facet, items: list, page_size: int, page=0, anchor: int = None):
+    """
+    Keyset-пагинация по отсортированному списку вариантов.
+    Страница начинается с элемента-якоря из callback_data, который находится
+    бинарным поиском по ключу (sort_order, name, id), поэтому страницы не
+    смещаются при изменении каталога. Без якоря страница выбирается по номеру.
+    :return: (элементы страницы, номер страницы, всего страниц, якоря соседних страниц)
+    """
+    count = len(items)
+    page, total_pages = count_pages(count, page_size, page)
+    start = page * page_size
+
+    if anchor is not None and count:
+        position = index.seek(facet, items, anchor)
+        if position is not None:
+            start = position if position < count else 0
+            page = start // page_size
+
+    if total_pages <= 1:
+        return items[start:start + page_size], page, total_pages, None
+
+    end = start + page_size
+    next_start = end if end < count else 0
+    if start == 0:
+        prev_start = (total_pages - 1) * page_size
+    else:
+        prev_start = max(start - page_size, 0)
+    anchors = (items[prev_start].id, items[next_start].id)
+    return items[start:end], page, total_pages, anchors
+
+def empty_kb():
+    """Пустая клавиатура с кнопками назад и в главное меню"""
+    builder = InlineKeyboardBuilder()
+    builder.row(back_button())
+    builder.row(main_menu_button())
+    return builder.as_markup()
+
 # =============================
 # КЛАВИАТУРЫ ДЛЯ ВЫБОРА
 # =============================
 
-async def categories_kb(page=0, page_size: int = MAX_PAGE_SIZE):
+async def categories_kb(
+    page=0,
+    page_size: int = MAX_PAGE_SIZE,
+    items: list = None,
+    anchor: int = None
+):
     """Клавиатура выбора категории"""
-    async with AsyncSessionLocal() as session:
-        result_count = await session.execute(select(func.count()).select_from(Categories))
-        categories_count = result_count.scalar_one()
-        page, total_pages = count_pages(categories_count, page_size, page)
-        
-        result = await session.execute(
-            select(Categories)
-            .offset(page * page_size)
-            .limit(page_size)
-            .order_by(Categories.sort_order, Categories.name)
-        )
-        categories = result.scalars().all()
+    index = await get_facet_index()
+    if items is None:
+        items = index.all_values("category")
+    categories, page, total_pages, anchors = paginate(index, "category", items, page_size, page, anchor)
 
     builder = InlineKeyboardBuilder()
     [builder.button(text=category.name, callback_data=f"category_{category.id}") for category in categories]
     builder.adjust(2)
 
-    pg_buttons = make_pagination_buttons("pg_category", [], total_pages, page)
+    pg_buttons = make_pagination_buttons("pg_category", [], total_pages, page, anchors)
     builder.row(*pg_buttons)
 
     builder.row(back_button())
     builder.row(main_menu_button())
     return builder.as_markup()
 
-async def accessory_brands_kb(category_id: int = None, page=0, page_size: int = MAX_PAGE_SIZE):
+async def accessory_brands_kb(
+    category_id: int = None,
+    page=0,
+    page_size: int = MAX_PAGE_SIZE,
+    items: list = None,
+    anchor: int = None
+):
     """Клавиатура выбора бренда аксессуара"""
     if not category_id:
         # Если нет категории, возвращаем пустую клавиатуру с кнопкой назад
-        builder = InlineKeyboardBuilder()
-        builder.row(back_button())
-        builder.row(main_menu_button())
-        return builder.as_markup()
+        return empty_kb()
     
-    async with AsyncSessionLocal() as session:
-        # Получаем уникальные бренды аксессуаров для выбранной категории
-        stmt = (
-            select(AccessoryBrands)
-            .join(Products, Products.accessory_brand_id == AccessoryBrands.id)
-            .where(
-                Products.category_id == category_id,
-                Products.is_active == True
-            )
-            .distinct()
-            .order_by(AccessoryBrands.sort_order, AccessoryBrands.name)
-        )
-        
-        brands_count = await session.execute(
-            select(func.count(func.distinct(AccessoryBrands.id)))
-            .select_from(AccessoryBrands)
-            .join(Products, Products.accessory_brand_id == AccessoryBrands.id)
-            .where(
-                Products.category_id == category_id,
-                Products.is_active == True
-            )
-        )
-        brands_count = brands_count.scalar_one()
-        page, total_pages = count_pages(brands_count, page_size, page)
-        
-        result = await session.execute(stmt.offset(page * page_size).limit(page_size))
-        brands = result.scalars().all()
+    # Уникальные бренды аксессуаров для выбранной категории
+    index = await get_facet_index()
+    if items is None:
+        items = index.values("accessory_brand", category=category_id)
+    brands, page, total_pages, anchors = paginate(index, "accessory_brand", items, page_size, page, anchor)
 
     builder = InlineKeyboardBuilder()
     for brand in brands:
         builder.button(text=brand.name, callback_data=f"accessory_brand_{brand.id}")
     builder.adjust(2)
 
-    pg_buttons = make_pagination_buttons("pg_accessory_brand", [category_id], total_pages, page)
+    pg_buttons = make_pagination_buttons("pg_accessory_brand", [category_id], total_pages, page, anchors)
     builder.row(*pg_buttons)
 
     builder.row(back_button())
     builder.row(main_menu_button())
     return builder.as_markup()
 
-async def device_brands_kb(category_id: int, accessory_brand_id: int, page=0, page_size: int = MAX_PAGE_SIZE):
+async def device_brands_kb(
+    category_id: int,
+    accessory_brand_id: int,
+    page=0,
+    page_size: int = MAX_PAGE_SIZE,
+    items: list = None,
+    anchor: int = None
+):
     """Клавиатура выбора бренда устройства"""
-    async with AsyncSessionLocal() as session:
-        stmt = (
-            select(DeviceBrands)
-            .join(DeviceModels, DeviceModels.device_brand_id == DeviceBrands.id)
-            .join(Products, Products.device_model_id == DeviceModels.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
-            .distinct()
-            .order_by(DeviceBrands.sort_order, DeviceBrands.name)
-        )
-        
-        brands_count = await session.execute(
-            select(func.count(func.distinct(DeviceBrands.id)))
-            .select_from(DeviceBrands)
-            .join(DeviceModels, DeviceModels.device_brand_id == DeviceBrands.id)
-            .join(Products, Products.device_model_id == DeviceModels.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
+    index = await get_facet_index()
+    if items is None:
+        items = index.values(
+            "device_brand",
+            category=category_id,
+            accessory_brand=accessory_brand_id
         )
-        brands_count = brands_count.scalar_one()
-        page, total_pages = count_pages(brands_count, page_size, page)
-        
-        result = await session.execute(stmt.offset(page * page_size).limit(page_size))
-        device_brands = result.scalars().all()
+    device_brands, page, total_pages, anchors = paginate(index, "device_brand", items, page_size, page, anchor)
 
     builder = InlineKeyboardBuilder()
     for brand in device_brands:
         builder.button(text=brand.name, callback_data=f"device_brand_{brand.id}")
     builder.adjust(2)
 
-    pg_buttons = make_pagination_buttons("pg_device_brand", [category_id, accessory_brand_id], total_pages, page)
+    pg_buttons = make_pagination_buttons("pg_device_brand", [category_id, accessory_brand_id], total_pages, page, anchors)
     builder.row(*pg_buttons)
 
     builder.row(back_button())
@@ -188,51 +191,30 @@ async def device_models_kb(
     accessory_brand_id: int,
     device_brand_id: int = None,
     page=0,
-    page_size: int = MAX_PAGE_SIZE
+    page_size: int = MAX_PAGE_SIZE,
+    items: list = None,
+    anchor: int = None
 ):
     """Клавиатура выбора модели устройства"""
-    async with AsyncSessionLocal() as session:
-        stmt = (
-            select(DeviceModels)
-            .join(Products, Products.device_model_id == DeviceModels.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
-        )
-        
-        if device_brand_id:
-            stmt = stmt.where(DeviceModels.device_brand_id == device_brand_id)
-        
-        stmt = stmt.distinct().order_by(DeviceModels.sort_order, DeviceModels.name)
-        
-        models_count = await session.execute(
-            select(func.count(func.distinct(DeviceModels.id)))
-            .select_from(DeviceModels)
-            .join(Products, Products.device_model_id == DeviceModels.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
+    index = await get_facet_index()
+    if items is None:
+        items = index.values(
+            "device_model",
+            category=category_id,
+            accessory_brand=accessory_brand_id,
+            device_brand=device_brand_id
         )
-        models_count = models_count.scalar_one()
-        page, total_pages = count_pages(models_count, page_size, page)
-        
-        result = await session.execute(stmt.offset(page * page_size).limit(page_size))
-        models = result.scalars().all()
+    models, page, total_pages, anchors = paginate(index, "device_model", items, page_size, page, anchor)
 
     builder = InlineKeyboardBuilder()
     for model in models:
-        # Загружаем связь с брендом
         builder.button(text=model.name, callback_data=f"device_model_{model.id}")
     builder.adjust(2)
 
     params = [category_id, accessory_brand_id]
     if device_brand_id:
         params.append(device_brand_id)
-    pg_buttons = make_pagination_buttons("pg_device_model", params, total_pages, page)
+    pg_buttons = make_pagination_buttons("pg_device_model", params, total_pages, page, anchors)
     builder.row(*pg_buttons)
 
     builder.row(back_button())
@@ -244,40 +226,20 @@ async def series_kb(
     accessory_brand_id: int,
     device_model_id: int = None,
     page=0,
-    page_size: int = MAX_PAGE_SIZE
+    page_size: int = MAX_PAGE_SIZE,
+    items: list = None,
+    anchor: int = None
 ):
     """Клавиатура выбора серии"""
-    async with AsyncSessionLocal() as session:
-        stmt = (
-            select(Series)
-            .join(Products, Products.series_id == Series.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
+    index = await get_facet_index()
+    if items is None:
+        items = index.values(
+            "series",
+            category=category_id,
+            accessory_brand=accessory_brand_id,
+            device_model=device_model_id
         )
-        
-        if device_model_id:
-            stmt = stmt.where(Products.device_model_id == device_model_id)
-        
-        stmt = stmt.distinct().order_by(Series.name)
-        
-        series_count = await session.execute(
-            select(func.count(func.distinct(Series.id)))
-            .select_from(Series)
-            .join(Products, Products.series_id == Series.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
-        )
-        series_count = series_count.scalar_one()
-        page, total_pages = count_pages(series_count, page_size, page)
-        
-        result = await session.execute(stmt.offset(page * page_size).limit(page_size))
-        series_list = result.scalars().all()
+    series_list, page, total_pages, anchors = paginate(index, "series", items, page_size, page, anchor)
 
     builder = InlineKeyboardBuilder()
     for s in series_list:
@@ -287,7 +249,7 @@ async def series_kb(
     params = [category_id, accessory_brand_id]
     if device_model_id:
         params.append(device_model_id)
-    pg_buttons = make_pagination_buttons("pg_series", params, total_pages, page)
+    pg_buttons = make_pagination_buttons("pg_series", params, total_pages, page, anchors)
     builder.row(*pg_buttons)
 
     builder.row(back_button())
@@ -300,42 +262,21 @@ async def variations_kb(
     device_model_id: int = None,
     series_id: int = None,
     page=0,
-    page_size: int = MAX_PAGE_SIZE
+    page_size: int = MAX_PAGE_SIZE,
+    items: list = None,
+    anchor: int = None
 ):
     """Клавиатура выбора вариации"""
-    async with AsyncSessionLocal() as session:
-        stmt = (
-            select(Variations)
-            .join(Products, Products.variation_id == Variations.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
-        )
-        
-        if device_model_id:
-            stmt = stmt.where(Products.device_model_id == device_model_id)
-        if series_id:
-            stmt = stmt.where(Products.series_id == series_id)
-        
-        stmt = stmt.distinct().order_by(Variations.name)
-        
-        variations_count = await session.execute(
-            select(func.count(func.distinct(Variations.id)))
-            .select_from(Variations)
-            .join(Products, Products.variation_id == Variations.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
+    index = await get_facet_index()
+    if items is None:
+        items = index.values(
+            "variation",
+            category=category_id,
+            accessory_brand=accessory_brand_id,
+            device_model=device_model_id,
+            series=series_id
         )
-        variations_count = variations_count.scalar_one()
-        page, total_pages = count_pages(variations_count, page_size, page)
-        
-        result = await session.execute(stmt.offset(page * page_size).limit(page_size))
-        variations = result.scalars().all()
+    variations, page, total_pages, anchors = paginate(index, "variation", items, page_size, page, anchor)
 
     builder = InlineKeyboardBuilder()
     for variation in variations:
@@ -347,7 +288,7 @@ async def variations_kb(
         params.append(device_model_id)
     if series_id:
         params.append(series_id)
-    pg_buttons = make_pagination_buttons("pg_variation", params, total_pages, page)
+    pg_buttons = make_pagination_buttons("pg_variation", params, total_pages, page, anchors)
     builder.row(*pg_buttons)
 
     builder.row(back_button())
@@ -361,52 +302,22 @@ async def colors_kb(
     series_id: int = None,
     variation_id: int = None,
     page=0,
-    page_size: int = MAX_PAGE_SIZE
+    page_size: int = MAX_PAGE_SIZE,
+    items: list = None,
+    anchor: int = None
 ):
     """Клавиатура выбора цвета"""
-    async with AsyncSessionLocal() as session:
-        stmt = (
-            select(Colors)
-            .join(Products, Products.color_id == Colors.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
+    index = await get_facet_index()
+    if items is None:
+        items = index.values(
+            "color",
+            category=category_id,
+            accessory_brand=accessory_brand_id,
+            device_model=device_model_id,
+            series=series_id,
+            variation=variation_id
         )
-        
-        if device_model_id:
-            stmt = stmt.where(Products.device_model_id == device_model_id)
-        if series_id:
-            stmt = stmt.where(Products.series_id == series_id)
-        if variation_id:
-            stmt = stmt.where(Products.variation_id == variation_id)
-        
-        stmt = stmt.distinct().order_by(Colors.name)
-        
-        colors_count_stmt = (
-            select(func.count(func.distinct(Colors.id)))
-            .select_from(Colors)
-            .join(Products, Products.color_id == Colors.id)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
-        )
-        if device_model_id:
-            colors_count_stmt = colors_count_stmt.where(Products.device_model_id == device_model_id)
-        if series_id:
-            colors_count_stmt = colors_count_stmt.where(Products.series_id == series_id)
-        if variation_id:
-            colors_count_stmt = colors_count_stmt.where(Products.variation_id == variation_id)
-        
-        colors_count = await session.execute(colors_count_stmt)
-        colors_count = colors_count.scalar_one()
-        page, total_pages = count_pages(colors_count, page_size, page)
-        
-        result = await session.execute(stmt.offset(page * page_size).limit(page_size))
-        colors = result.scalars().all()
+    colors, page, total_pages, anchors = paginate(index, "color", items, page_size, page, anchor)
 
     builder = InlineKeyboardBuilder()
     for color in colors:
@@ -420,7 +331,7 @@ async def colors_kb(
         params.append(series_id)
     if variation_id:
         params.append(variation_id)
-    pg_buttons = make_pagination_buttons("pg_color", params, total_pages, page)
+    pg_buttons = make_pagination_buttons("pg_color", params, total_pages, page, anchors)
     builder.row(*pg_buttons)
 
     builder.row(back_button())
@@ -435,53 +346,22 @@ async def products_kb(
     variation_id: int = None,
     color_id: int = None,
     page=0,
-    page_size: int = MAX_PAGE_SIZE
+    page_size: int = MAX_PAGE_SIZE,
+    items: list = None,
+    anchor: int = None
 ):
     """Клавиатура выбора конкретного продукта"""
-    async with AsyncSessionLocal() as session:
-        stmt = (
-            select(Products)
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
-        )
-        
-        if device_model_id:
-            stmt = stmt.where(Products.device_model_id == device_model_id)
-        if series_id:
-            stmt = stmt.where(Products.series_id == series_id)
-        if variation_id:
-            stmt = stmt.where(Products.variation_id == variation_id)
-        if color_id:
-            stmt = stmt.where(Products.color_id == color_id)
-        
-        products_count_stmt = (
-            select(func.count(Products.id))
-            .where(
-                Products.category_id == category_id,
-                Products.accessory_brand_id == accessory_brand_id,
-                Products.is_active == True
-            )
-        )
-        if device_model_id:
-            products_count_stmt = products_count_stmt.where(Products.device_model_id == device_model_id)
-        if series_id:
-            products_count_stmt = products_count_stmt.where(Products.series_id == series_id)
-        if variation_id:
-            products_count_stmt = products_count_stmt.where(Products.variation_id == variation_id)
-        if color_id:
-            products_count_stmt = products_count_stmt.where(Products.color_id == color_id)
-        
-        products_count = await session.execute(products_count_stmt)
-        products_count = products_count.scalar_one()
-        page, total_pages = count_pages(products_count, page_size, page)
-        
-        result = await session.execute(
-            stmt.offset(page * page_size).limit(page_size).order_by(Products.id)
+    index = await get_facet_index()
+    if items is None:
+        items = index.products(
+            category=category_id,
+            accessory_brand=accessory_brand_id,
+            device_model=device_model_id,
+            series=series_id,
+            variation=variation_id,
+            color=color_id
         )
-        products = result.scalars().all()
+    products, page, total_pages, anchors = paginate(index, None, items, page_size, page, anchor)
 
     builder = InlineKeyboardBuilder()
     for product in products:
@@ -501,7 +381,7 @@ async def products_kb(
         params.append(variation_id)
     if color_id:
         params.append(color_id)
-    pg_buttons = make_pagination_buttons("pg_product", params, total_pages, page)
+    pg_buttons = make_pagination_buttons("pg_product", params, total_pages, page, anchors)
     builder.row(*pg_buttons)
 
     builder.row(back_button())
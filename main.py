@@ -4,14 +4,36 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram import Bot, Dispatcher
 from handlers import bot_mesages, user_commands
 from callbacks import callbacks
-from data.model import init_models
+from data.model import engine, init_models
 from config_reader import config
+from states.storage import create_fsm_storage
+from middlewares.fsm import FSMCoalescingMiddleware
+from middlewares.metrics import HandlerNameMiddleware, LatencyMiddleware, TelegramTimingMiddleware
+from services import metrics
+from services.customers import load_customer_registry, registry as customer_registry
+from services.image_prewarm import ImagePrewarmer
+from services.notifications import OrderNotifier
+from services.webhook import run_webhook
 
 async def main():
     await init_models()
     logging.basicConfig(level=logging.INFO)
+    # Известные покупатели добавляют в корзину без проверки customers
+    await load_customer_registry()
     bot = Bot(token=config.bot_token.get_secret_value(), default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher()
+    storage, events_isolation = create_fsm_storage()
+    dp = Dispatcher(storage=storage, events_isolation=events_isolation)
+    if config.metrics_port:
+        # Время апдейта по обработчикам и фазам (FSM, БД, Telegram API) - первой, чтобы замер охватил остальные
+        dp.update.outer_middleware(LatencyMiddleware())
+        for event_name, observer in dp.observers.items():
+            if event_name not in ("update", "error"):
+                observer.middleware(HandlerNameMiddleware())
+        bot.session.middleware(TelegramTimingMiddleware())
+        metrics.instrument_engine(engine)
+    # Одно чтение и одна запись FSM за апдейт вместо get_data/update_data в каждом шаге
+    fsm_middleware = FSMCoalescingMiddleware()
+    dp.update.outer_middleware(fsm_middleware)
 
     dp.include_routers(
         user_commands.router,
@@ -19,8 +41,51 @@ async def main():
         bot_mesages.router,
     )
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Уведомления о заказах админам отправляются в фоне из очереди в БД, покупатель их не ждет
+    order_notifier = OrderNotifier(
+        bot,
+        config.order_notify_concurrency,
+        config.order_notify_global_rate,
+        config.order_notify_per_chat_rate
+    )
+    dp["order_notifier"] = order_notifier
+    notifier_task = asyncio.create_task(order_notifier.run())
+
+    # Гистограммы задержек и показатели воркеров для Prometheus на локальном адресе
+    if config.metrics_port:
+        metrics.register_gauges("bot_order_notifier", order_notifier.metrics)
+        metrics.register_gauges("bot_customer_registry", customer_registry.metrics)
+        metrics.register_gauges("bot_fsm", lambda: {"conflicts": fsm_middleware.conflicts})
+        await metrics.start_metrics_server(config.metrics_host, config.metrics_port)
+
+    # Фоновая загрузка фото товаров в Telegram, чтобы карточки открывались без upload
+    prewarm_task = None
+    if config.image_cache_chat_id:
+        prewarmer = ImagePrewarmer(bot, config.image_cache_chat_id, config.image_prewarm_concurrency)
+        dp["image_prewarmer"] = prewarmer
+        prewarm_task = asyncio.create_task(prewarmer.run(config.image_prewarm_interval))
+
+    try:
+        if config.bot_mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        # Прерванная загрузка фото безопасна: file_id не сохранен, фото загрузится при следующем запуске
+        if prewarm_task is not None:
+            prewarm_task.cancel()
+            try:
+                await prewarm_task
+            except asyncio.CancelledError:
+                pass
+        # Досылаем текущую пачку уведомлений и сохраняем ее результаты, иначе
+        # отправленные сообщения уйдут админам повторно после истечения аренды
+        order_notifier.stop()
+        try:
+            await asyncio.wait_for(notifier_task, config.order_notify_stop_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Пачка уведомлений не отправлена за %s с, воркер остановлен", config.order_notify_stop_timeout)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1 @@
+from . import fsm, metrics
\ No newline at end of file
@@ -0,0 +1,122 @@
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# ОДНО ЧТЕНИЕ И ОДНА ЗАПИСЬ FSM ЗА АПДЕЙТ
+# ==========================================
+
+class BufferedFSMContext(FSMContext):
+    """
+    FSMContext, работающий с локальной копией записи.
+    Состояние и данные загружаются один раз на апдейт, изменения копятся
+    в памяти и записываются одним вызовом flush() в конце обработки.
+    """
+
+    def __init__(self, storage: BaseStorage, key: StorageKey,
+                 state: Optional[str], data: Dict[str, Any], version: int) -> None:
+        super().__init__(storage, key)
+        self.loaded_state = state
+        self.version = version
+        self._state = state
+        self._data = data
+        self.state_changed = False
+        self.data_changed = False
+
+    async def set_state(self, state: StateType = None) -> None:
+        self._state = state.state if isinstance(state, State) else state
+        self.state_changed = True
+
+    async def get_state(self) -> Optional[str]:
+        return self._state
+
+    async def set_data(self, data: Dict[str, Any]) -> None:
+        self._data = copy.deepcopy(dict(data))
+        self.data_changed = True
+
+    async def get_data(self) -> Dict[str, Any]:
+        # Копия, как при чтении из внешнего хранилища: изменения без update_data не сохраняются
+        return copy.deepcopy(self._data)
+
+    async def get_value(self, key: str, default: Optional[Any] = None) -> Optional[Any]:
+        return copy.deepcopy(self._data.get(key, default))
+
+    async def update_data(self, data: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Dict[str, Any]:
+        if data:
+            kwargs.update(data)
+        self._data.update(copy.deepcopy(kwargs))
+        self.data_changed = True
+        return copy.deepcopy(self._data)
+
+    async def flush(self) -> bool:
+        """
+        Записать изменения одной операцией
+        :return: False, если запись изменил параллельный апдейт (изменения отброшены)
+        """
+        if not (self.state_changed or self.data_changed):
+            return True
+        saved = await self.storage.save_record(
+            self.key,
+            self._state,
+            self._data if self.data_changed else None,
+            self.loaded_state,
+            self.version
+        )
+        if saved:
+            self.loaded_state = self._state
+            self.version += 1
+            self.state_changed = self.data_changed = False
+        return saved
+
+
+class FSMCoalescingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware апдейтов: подменяет FSMContext на BufferedFSMContext.
+    Регистрируется после FSM-middleware диспетчера (dp.update.outer_middleware).
+
+    Конфликт - запись пользователя изменилась между чтением и записью
+    (параллельное нажатие того же пользователя). Тогда изменения этого апдейта
+    отбрасываются, а в хранилище остается результат апдейта, записавшего первым.
+    """
+
+    def __init__(self) -> None:
+        self.conflicts = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        context = data.get("state")
+        storage = data.get("fsm_storage")
+        if context is None or not hasattr(storage, "load_record"):
+            return await handler(event, data)
+
+        with metrics.phase("fsm"):
+            state, fsm_data, version = await storage.load_record(context.key)
+        buffered = BufferedFSMContext(storage, context.key, state, fsm_data, version)
+        data["state"] = buffered
+        data["raw_state"] = state
+        try:
+            return await handler(event, data)
+        finally:
+            # Сохраняем и при ошибке в обработчике - как если бы изменения писались сразу
+            with metrics.phase("fsm"):
+                saved = await buffered.flush()
+            if not saved:
+                self.conflicts += 1
+                logger.warning(
+                    "Конфликт FSM для пользователя %s: состояние изменено параллельным апдейтом, "
+                    "изменения отброшены", context.key.user_id
+                )
@@ -0,0 +1,72 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+from services import metrics
+
+# ==========================================
+# ЗАДЕРЖКИ АПДЕЙТОВ ПО ОБРАБОТЧИКАМ И ФАЗАМ
+# ==========================================
+
+class LatencyMiddleware(BaseMiddleware):
+    """
+    Outer-middleware апдейтов: засекает полное время апдейта и собирает время фаз
+    (FSM, БД, Telegram API) в services.metrics. Регистрируется первой из наших
+    outer-middleware, чтобы в замер попали чтение и запись FSM;
+    ожидание блокировки events_isolation диспетчера в замер не входит.
+    Имя обработчика записывает HandlerNameMiddleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        timing = metrics.UpdateTiming()
+        token = metrics.current_update.set(timing)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            metrics.current_update.reset(token)
+            metrics.record_update(timing, time.perf_counter() - started, failed)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """
+    Inner-middleware событий (message, callback_query и т.д.) диспетчера: срабатывает
+    для обработчиков всех вложенных роутеров и записывает имя выбранного обработчика
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        timing = metrics.current_update.get()
+        handler_object = data.get("handler")
+        if timing is not None and handler_object is not None:
+            timing.handler = handler_object.callback.__name__
+        return await handler(event, data)
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого запроса к Bot API (по методу и в фазу telegram апдейта)"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.telegram_api_seconds.observe(elapsed, method.__api_method__)
+            metrics.add_phase_time("telegram", elapsed)
@@ -0,0 +1 @@
+from . import carts, customers, image_prewarm, metrics, notifications, product_cards, webhook
\ No newline at end of file
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+
+from config_reader import config
+from data.catalog import check_catalog_version, on_catalog_change
+from data.crud import get_cart_summary, on_cart_change
+
+# ==========================================
+# ОТРИСОВАННЫЕ КОРЗИНЫ ПОКУПАТЕЛЕЙ
+# ==========================================
+
+# user_id -> (версия каталога, момент устаревания, текст), в порядке последнего использования.
+# Сбрасывается при изменении корзины в этом процессе и при смене версии каталога (цены, названия).
+# Об изменениях в других процессах кэш не знает: правки корзин в админке видны через
+# cart_cache_ttl секунд, а при нескольких процессах бота (bot_processes > 1) кэш выключен,
+# иначе покупатель увидел бы корзину, измененную в другом процессе, со старой суммой
+_carts = OrderedDict()
+
+
+def cart_cache_enabled() -> bool:
+    return config.cart_cache_ttl > 0 and config.bot_processes == 1
+
+
+def render_cart_text(summary) -> str:
+    """HTML-текст корзины по CartSummary"""
+    if not summary.items:
+        return "Ваша 🛒:\n\nВ вашей корзине пока что нет товаров"
+
+    lines = []
+    for item in summary.items:
+        parts = [
+            f"<b>{item[field]} </b>"
+            for field in ("category", "brand", "device_model", "series", "color", "variation")
+            if item[field]
+        ]
+        parts.append("- ")
+        if item.quantity:
+            parts.append(f"{item.quantity} шт. ")
+        parts.append(f"сумма: {item.sum} руб " if item.sum else "цену уточнять")
+        lines.append("".join(parts).strip())
+    return "Ваша 🛒:\n\n" + "\n\n".join(lines) + f"\n\n<b>Общая сумма: {summary.total} руб</b>"
+
+
+async def get_cart_text(user_id: int) -> str:
+    """
+    Текст корзины из кэша или из БД (один запрос).
+    Повторное открытие корзины не обращается к БД, пока она не изменилась
+    """
+    if not cart_cache_enabled():
+        return render_cart_text(await get_cart_summary(user_id))
+
+    version = await check_catalog_version()
+    entry = _carts.get(user_id)
+    if entry is not None and entry[0] == version and time.monotonic() < entry[1]:
+        _carts.move_to_end(user_id)
+        return entry[2]
+
+    text = render_cart_text(await get_cart_summary(user_id))
+    _carts[user_id] = (version, time.monotonic() + config.cart_cache_ttl, text)
+    _carts.move_to_end(user_id)
+    if len(_carts) > config.cart_cache_size:
+        _carts.popitem(last=False)
+    return text
+
+
+@on_cart_change
+def invalidate_cart(user_id: int):
+    """Сбросить корзину покупателя после ее изменения"""
+    _carts.pop(user_id, None)
+
+
+@on_catalog_change
+def invalidate_carts():
+    """Сбросить все корзины: в них цены и названия из каталога"""
+    _carts.clear()
@@ -0,0 +1,128 @@
+import logging
+import time
+from collections import OrderedDict
+
+from config_reader import config
+from data.crud import (
+    CART_ITEM_ADDED,
+    CART_ITEM_NO_CUSTOMER,
+    add_cart_item,
+    get_known_customers,
+    update_customer_username
+)
+
+# ==========================================
+# РЕЕСТР ИЗВЕСТНЫХ ПОКУПАТЕЛЕЙ (В ПАМЯТИ ПРОЦЕССА)
+# ==========================================
+
+# Результаты CustomerRegistry.lookup
+CUSTOMER_KNOWN = "known"
+CUSTOMER_RENAMED = "renamed"
+CUSTOMER_UNKNOWN = "unknown"
+
+
+class CustomerRegistry:
+    """
+    Ограниченный LRU-набор покупателей, которые точно есть в БД, с временем жизни записи.
+    Для известного покупателя запрос в customers не нужен, если не изменился его username.
+    Запись устаревает через ttl секунд, чтобы удаление или правка покупателя в админке
+    в итоге дошли до бота; при переполнении вытесняется давно не использованная.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        # telegram_id -> (username, момент устаревания), в порядке последнего использования
+        self._entries = OrderedDict()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "username_changes": 0,
+            "expired": 0,
+            "evicted": 0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, telegram_id: int, username: str) -> str:
+        """
+        CUSTOMER_KNOWN - покупатель есть в БД с этим username, CUSTOMER_RENAMED - есть,
+        но username сменился, CUSTOMER_UNKNOWN - записи нет или она устарела
+        """
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            self.stats["misses"] += 1
+            return CUSTOMER_UNKNOWN
+        known_username, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[telegram_id]
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return CUSTOMER_UNKNOWN
+        self._entries.move_to_end(telegram_id)
+        if known_username != username:
+            self.stats["username_changes"] += 1
+            self.stats["misses"] += 1
+            return CUSTOMER_RENAMED
+        self.stats["hits"] += 1
+        return CUSTOMER_KNOWN
+
+    def remember(self, telegram_id: int, username: str):
+        """Запомнить покупателя, который точно записан в БД"""
+        self._entries[telegram_id] = (username, time.monotonic() + self.ttl)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def forget(self, telegram_id: int):
+        self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def metrics(self) -> dict:
+        """Счетчики реестра, размер и доля попаданий"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+registry = CustomerRegistry(config.customer_cache_size, config.customer_cache_ttl)
+
+
+async def load_customer_registry() -> int:
+    """Заполнить реестр последними покупателями из БД одним запросом (при запуске бота)"""
+    registry.clear()
+    # Загружаем от старых к новым, чтобы новые оказались последними в порядке LRU
+    for telegram_id, username in reversed(await get_known_customers(registry.max_size)):
+        registry.remember(telegram_id, username)
+    logging.info("Реестр покупателей: загружено %s", len(registry))
+    return len(registry)
+
+
+async def add_to_cart(product_id: int, user_id: int, quantity: int, username: str) -> bool:
+    """
+    Добавить товар в корзину покупателя. Новый покупатель записывается тем же запросом,
+    известный - без обращения к customers; смена username - отдельным UPDATE
+    """
+    status = registry.lookup(user_id, username)
+    if status != CUSTOMER_UNKNOWN:
+        if status == CUSTOMER_RENAMED:
+            await update_customer_username(user_id, username)
+            registry.remember(user_id, username)
+        result = await add_cart_item(product_id, user_id, quantity)
+        if result != CART_ITEM_NO_CUSTOMER:
+            return result == CART_ITEM_ADDED
+        # Покупателя удалили из БД, пока он был в реестре - создаем заново
+        registry.forget(user_id)
+
+    if await add_cart_item(product_id, user_id, quantity, username) != CART_ITEM_ADDED:
+        return False
+    registry.remember(user_id, username)
+    return True
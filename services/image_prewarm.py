@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import FSInputFile
+
+from data.catalog import on_catalog_change
+from data.crud import get_images_without_file_id, save_image_file_id, file_content_hash
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# ЗАГРУЗКИ ФОТО В ЭТОМ ПРОЦЕССЕ
+# ==========================================
+
+class ImageUploads:
+    """
+    Загрузки фото в Telegram, идущие в этом процессе (прогрев и показ карточек).
+    Кто начинает загрузку, отмечает ее через start и сообщает результат в finish;
+    остальные ждут ее в wait и получают тот же file_id, а не загружают файл второй раз.
+    """
+
+    def __init__(self):
+        # image_id -> Future с file_id загрузки, которая идет сейчас (None - не удалась)
+        self._running = {}
+        # image_id -> file_id, загруженные после начала прохода прогрева
+        self._file_ids = {}
+
+    async def wait(self, image_id: int) -> Optional[str]:
+        """file_id уже загруженного фото или дождаться идущей загрузки; None - фото никто не загрузил"""
+        while True:
+            file_id = self._file_ids.get(image_id)
+            if file_id is not None:
+                return file_id
+            running = self._running.get(image_id)
+            if running is None:
+                return None
+            file_id = await asyncio.shield(running)
+            if file_id is not None:
+                return file_id
+
+    def start(self, image_id: int) -> asyncio.Future:
+        """Отметить начало загрузки фото; возвращенный объект передать в finish"""
+        upload = asyncio.get_running_loop().create_future()
+        self._running.setdefault(image_id, upload)
+        return upload
+
+    def finish(self, image_id: int, upload: asyncio.Future, file_id: Optional[str]):
+        """Завершить загрузку (file_id None - не удалась) и разбудить ожидающих"""
+        if file_id is not None:
+            self._file_ids[image_id] = file_id
+        if self._running.get(image_id) is upload:
+            del self._running[image_id]
+        upload.set_result(file_id)
+
+    def clear(self):
+        """Забыть загруженные file_id (они уже в БД или фото заменили в админке)"""
+        self._file_ids.clear()
+
+
+image_uploads = ImageUploads()
+
+
+@on_catalog_change
+def forget_uploaded_images():
+    image_uploads.clear()
+
+# ==========================================
+# ПРЕДВАРИТЕЛЬНАЯ ЗАГРУЗКА ФОТО В TELEGRAM
+# ==========================================
+
+class ImagePrewarmer:
+    """
+    Фоновая загрузка фото товаров, у которых еще нет file_id.
+    Фото отправляются в служебный чат, полученный file_id сохраняется в БД,
+    поэтому первый покупатель, открывший карточку, не ждет загрузки файла.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, concurrency: int = 3, max_attempts: int = 5):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.max_attempts = max_attempts
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # image_id -> путь к файлу, которого не было: пока путь тот же, фото не проверяется снова
+        self._missing = {}
+        self.progress = {
+            "pending": 0,
+            "uploaded": 0,
+            "failed": 0,
+            "missing": 0,
+            "retries": 0,
+        }
+
+    async def run_once(self):
+        """Загрузить все фото без file_id"""
+        # Фото, загруженные показом карточек до этого момента, уже записаны в БД
+        image_uploads.clear()
+        images = await get_images_without_file_id()
+        # Фото без файла пропускаем, пока админка не сменит путь (или фото не удалят)
+        self._missing = {
+            image["id"]: image["path"]
+            for image in images
+            if self._missing.get(image["id"]) == image["path"]
+        }
+        images = [image for image in images if image["id"] not in self._missing]
+        self.progress["missing"] = len(self._missing)
+        self.progress["pending"] = len(images)
+        if not images:
+            return self.progress
+
+        logger.info("Предзагрузка фото: %s без file_id", len(images))
+        await asyncio.gather(*(self._upload(image) for image in images))
+        logger.info("Предзагрузка фото завершена: %s", self.progress)
+        return self.progress
+
+    async def run(self, interval: int):
+        """Периодически догружать фото новых товаров"""
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.exception("Ошибка предзагрузки фото: %s", e)
+            await asyncio.sleep(interval)
+
+    async def _upload(self, image: dict):
+        async with self._semaphore:
+            try:
+                await self._upload_image(image)
+            finally:
+                self.progress["pending"] -= 1
+
+    async def _upload_image(self, image: dict):
+        if not os.path.exists(image["path"]):
+            logger.warning("Нет файла фото %s: %s", image["id"], image["path"])
+            self._missing[image["id"]] = image["path"]
+            self.progress["missing"] += 1
+            return
+
+        content_hash = await asyncio.to_thread(file_content_hash, image["path"])
+        delay = 1
+        for attempt in range(1, self.max_attempts + 1):
+            # Фото мог загрузить (или загружает сейчас) показ карточки - второй раз не отправляем
+            if await image_uploads.wait(image["id"]):
+                self.progress["uploaded"] += 1
+                return
+
+            upload = image_uploads.start(image["id"])
+            file_id = None
+            error = None
+            try:
+                message = await self.bot.send_photo(
+                    self.chat_id,
+                    FSInputFile(image["path"]),
+                    disable_notification=True
+                )
+                file_id = message.photo[-1].file_id
+                await save_image_file_id(image["id"], file_id, content_hash)
+            except TelegramAPIError as e:
+                error = e
+            finally:
+                # Ожидающие не ждут паузы перед повтором
+                image_uploads.finish(image["id"], upload, file_id)
+
+            if file_id is not None:
+                self.progress["uploaded"] += 1
+                return
+            if isinstance(error, TelegramRetryAfter):
+                # Telegram просит подождать - ждем ровно столько, сколько сказано
+                self.progress["retries"] += 1
+                await asyncio.sleep(error.retry_after)
+                continue
+            if attempt == self.max_attempts:
+                logger.warning("Не удалось загрузить фото %s: %s", image["id"], error)
+                break
+            self.progress["retries"] += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+        self.progress["failed"] += 1
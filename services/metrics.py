@@ -0,0 +1,223 @@
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiohttp import web
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# МЕТРИКИ ЗАДЕРЖЕК БОТА (ФОРМАТ PROMETHEUS)
+# ==========================================
+
+# Границы корзин гистограмм, секунд (как у клиентов Prometheus по умолчанию)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Фазы обработки апдейта; other - все остальное время (код обработчика, ожидание пула и т.п.)
+PHASES = ("fsm", "db", "telegram", "other")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Гистограмма в памяти процесса: счетчики по корзинам, сумма и количество для каждого набора меток"""
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счетчики по корзинам (последняя - +Inf), сумма, количество]
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = _labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Counter:
+    """Счетчик в памяти процесса для каждого набора меток"""
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+update_seconds = Histogram(
+    "bot_update_seconds", "Полное время обработки апдейта по обработчикам", ["handler"]
+)
+update_phase_seconds = Histogram(
+    "bot_update_phase_seconds", "Время апдейта по фазам: fsm, db, telegram, other", ["handler", "phase"]
+)
+update_db_queries = Histogram(
+    "bot_update_db_queries", "Число запросов к БД за апдейт", ["handler"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21)
+)
+telegram_api_seconds = Histogram(
+    "bot_telegram_api_seconds", "Время запросов к Telegram Bot API по методам", ["method"]
+)
+update_errors = Counter(
+    "bot_update_errors_total", "Апдейты, обработка которых завершилась исключением", ["handler"]
+)
+
+_metrics = [update_seconds, update_phase_seconds, update_db_queries, telegram_api_seconds, update_errors]
+
+# Дополнительные показатели (уведомления, кэши): префикс -> функция, возвращающая dict (или корутину)
+_gauges = {}
+
+
+def register_gauges(prefix: str, callback):
+    """Публиковать числовые значения словаря callback() как gauge с именами prefix_ключ"""
+    _gauges[prefix] = callback
+
+
+# ==========================================
+# ФАЗЫ ТЕКУЩЕГО АПДЕЙТА
+# ==========================================
+
+class UpdateTiming:
+    """Время фаз одного апдейта; обработчик становится известен после выбора роутером"""
+
+    __slots__ = ("handler", "phases", "db_queries")
+
+    def __init__(self):
+        self.handler = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.db_queries = 0
+
+
+current_update = ContextVar("current_update_timing", default=None)
+
+
+def add_phase_time(phase: str, seconds: float):
+    """Добавить время к фазе текущего апдейта (вне апдейта - ничего не делает)"""
+    timing = current_update.get()
+    if timing is not None:
+        timing.phases[phase] += seconds
+
+
+@contextmanager
+def phase(name: str):
+    """Засечь время блока как фазу текущего апдейта"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(name, time.perf_counter() - started)
+
+
+def record_update(timing: UpdateTiming, seconds: float, failed: bool):
+    """Записать апдейт в гистограммы"""
+    handler = timing.handler or "unhandled"
+    timing.phases["other"] = max(seconds - sum(timing.phases.values()), 0.0)
+    update_seconds.observe(seconds, handler)
+    for name, value in timing.phases.items():
+        update_phase_seconds.observe(value, handler, name)
+    update_db_queries.observe(timing.db_queries, handler)
+    if failed:
+        update_errors.inc(handler)
+
+
+def instrument_engine(engine):
+    """
+    Считать время запросов движка в фазу db текущего апдейта.
+    События выполняются в greenlet SQLAlchemy, который видит контекст задачи апдейта
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and current_update.get() is not None:
+            context.metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "metrics_started", None)
+        timing = current_update.get()
+        if started is not None and timing is not None:
+            timing.phases["db"] += time.perf_counter() - started
+            timing.db_queries += 1
+
+
+# ==========================================
+# HTTP-ЭНДПОИНТ /metrics
+# ==========================================
+
+async def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.expose())
+    for prefix, callback in _gauges.items():
+        try:
+            values = callback()
+            if inspect.isawaitable(values):
+                values = await values
+        except Exception as e:
+            logger.warning("Не удалось получить метрики %s: %s", prefix, e)
+            continue
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(
+        text=await render_metrics(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Поднять HTTP-сервер с GET /metrics (для сборщика Prometheus на той же машине)"""
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+
+from data.crud import (
+    claim_order_notifications,
+    save_order_notification_results,
+    get_order_notifications_backlog,
+    get_order_notification_statuses
+)
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# УВЕДОМЛЕНИЯ АДМИНАМ О ЗАКАЗАХ
+# ==========================================
+
+class TokenBucket:
+    """Ведро токенов: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OrderNotifier:
+    """
+    Воркер очереди уведомлений о заказах (таблица order_notifications).
+    Уведомления пишутся в БД в транзакции заказа, поэтому не теряются при
+    перезапуске бота. Воркер забирает их пачками и отправляет параллельно,
+    с общим ограничением скорости бота и ограничением на каждый чат; неудачные
+    попытки откладываются с экспоненциальной задержкой.
+    """
+
+    def __init__(self, bot: Bot, concurrency: int = 8, global_rate: float = 25,
+                 per_chat_rate: float = 1, max_attempts: int = 10, batch_size: int = 50,
+                 poll_interval: float = 5, lease_seconds: int = 120):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = {}
+        self._wakeup = asyncio.Event()
+        self._stopping = asyncio.Event()
+        # Время отправки уведомлений за последнюю минуту - для пропускной способности
+        self._recent = deque()
+        self.last_delivery_lag = 0.0
+        self.stats = {
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "batches": 0,
+        }
+
+    def wake(self):
+        """Разбудить воркер сразу после оформления заказа, не дожидаясь опроса очереди"""
+        self._wakeup.set()
+
+    def stop(self):
+        """
+        Попросить воркер остановиться: текущая пачка досылается и ее результаты
+        сохраняются, новые пачки не берутся
+        """
+        self._stopping.set()
+        self._wakeup.set()
+
+    async def run(self):
+        """Обрабатывать очередь, пока не вызван stop()"""
+        while not self._stopping.is_set():
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                logger.exception("Ошибка обработки очереди уведомлений: %s", e)
+                processed = 0
+            if not processed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def run_once(self) -> int:
+        """
+        Отправить одну пачку уведомлений
+        :return: сколько уведомлений обработано
+        """
+        notifications = await claim_order_notifications(self.batch_size, self.lease_seconds)
+        if not notifications:
+            return 0
+        self.stats["batches"] += 1
+        results = await asyncio.gather(*(self._deliver(notification) for notification in notifications))
+        await save_order_notification_results(list(results))
+        return len(notifications)
+
+    async def delivery_status(self, order_id: int) -> dict:
+        """Статусы доставки уведомлений заказа по чатам"""
+        return await get_order_notification_statuses(order_id)
+
+    async def metrics(self) -> dict:
+        """Счетчики воркера, пропускная способность за минуту и отставание очереди"""
+        self._trim_recent()
+        backlog, oldest = await get_order_notifications_backlog()
+        lag = 0.0
+        if oldest is not None:
+            if oldest.tzinfo is None:
+                oldest = oldest.replace(tzinfo=timezone.utc)
+            lag = max((datetime.now(timezone.utc) - oldest).total_seconds(), 0.0)
+        return {
+            **self.stats,
+            "sent_last_minute": len(self._recent),
+            "backlog": backlog,
+            "lag_seconds": lag,
+            "last_delivery_lag_seconds": self.last_delivery_lag,
+        }
+
+    def _trim_recent(self):
+        border = time.monotonic() - 60
+        while self._recent and self._recent[0] < border:
+            self._recent.popleft()
+
+    async def _deliver(self, notification) -> dict:
+        async with self._semaphore:
+            try:
+                status, retry_after, error = await self.send(notification.chat_id, notification.text)
+            except Exception as e:
+                logger.exception("Ошибка отправки уведомления о заказе %s: %s", notification.order_id, e)
+                status, retry_after, error = "retry", None, str(e)
+
+        now = datetime.now(timezone.utc)
+        # Ожидание по RetryAfter - не ошибка доставки, попытку не тратим
+        attempts = notification.attempts if retry_after is not None else notification.attempts + 1
+        result = {
+            "id": notification.id,
+            "status": "pending",
+            "attempts": attempts,
+            "next_attempt_at": now,
+            "sent_at": None,
+            "last_error": error[:500] if error else None,
+        }
+        if status == "sent":
+            result["status"] = "sent"
+            result["sent_at"] = now
+            self._recent.append(time.monotonic())
+            created_at = notification.created_at
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            self.last_delivery_lag = (now - created_at).total_seconds()
+            self.stats["sent"] += 1
+        elif status == "failed" or attempts >= self.max_attempts:
+            result["status"] = "failed"
+            self.stats["failed"] += 1
+            logger.warning("Уведомление о заказе %s в чат %s не доставлено: %s",
+                           notification.order_id, notification.chat_id, error)
+        else:
+            # Telegram сам говорит, когда повторить; иначе - экспоненциальная задержка
+            delay = retry_after if retry_after is not None else min(2 ** attempts, 3600)
+            result["next_attempt_at"] = now + timedelta(seconds=delay)
+            self.stats["retries"] += 1
+        return result
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Полные ведра простаивающих чатов не нужны - не даем словарю расти
+            if len(self._chat_buckets) > 1000:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+    async def send(self, chat_id: int, text: str):
+        """
+        Одна попытка отправки с учетом лимитов Telegram
+        :return: (sent | retry | failed, через сколько секунд повторить или None, текст ошибки)
+        """
+        await self._chat_bucket(chat_id).acquire()
+        await self._global_bucket.acquire()
+        try:
+            await self.bot.send_message(chat_id, text)
+        except TelegramRetryAfter as e:
+            return "retry", e.retry_after, str(e)
+        except TelegramForbiddenError as e:
+            # Админ заблокировал бота - повторять бесполезно
+            return "failed", None, str(e)
+        except TelegramAPIError as e:
+            return "retry", None, str(e)
+        return "sent", None, None
@@ -0,0 +1,91 @@
+from collections import OrderedDict, namedtuple
+
+from config_reader import config
+from data.catalog import check_catalog_version, on_catalog_change
+from data.crud import get_product_full_info, get_products_full_info
+
+# ==========================================
+# КАРТОЧКИ ТОВАРОВ
+# ==========================================
+
+# text - готовая HTML-подпись, image - запись фото (id, path, file_id, content_hash) или None
+ProductCard = namedtuple("ProductCard", ["product_id", "text", "image"])
+
+# (product_id, версия каталога) -> ProductCard, в порядке последнего использования
+_cards = OrderedDict()
+
+
+def render_card_text(product_info) -> str:
+    """HTML-текст карточки товара по ProductInfo"""
+    text_parts = ["<b>Информация о товаре:</b>\n"]
+    if product_info.category:
+        text_parts.append(f"Категория: {product_info.category}")
+    if product_info.accessory_brand:
+        text_parts.append(f"Бренд: {product_info.accessory_brand}")
+    if product_info.device_model:
+        text_parts.append(f"Совместимость: {product_info.device_model}")
+    if product_info.series:
+        text_parts.append(f"Серия: {product_info.series}")
+    if product_info.variation:
+        text_parts.append(f"Вариация: {product_info.variation}")
+    if product_info.color:
+        text_parts.append(f"Цвет: {product_info.color}")
+    if product_info.price:
+        text_parts.append(f"\n<b>Цена: {product_info.price} руб</b>")
+    else:
+        text_parts.append("\n<b>Цену уточнять</b>")
+    return "\n".join(text_parts)
+
+
+def _remember(key, product_info) -> ProductCard:
+    card = ProductCard(product_info.id, render_card_text(product_info), product_info.image)
+    _cards[key] = card
+    if len(_cards) > config.product_card_cache_size:
+        _cards.popitem(last=False)
+    return card
+
+
+async def get_product_card(product_id: int):
+    """
+    Карточка товара из кэша или из БД (один запрос).
+    Повторный показ (в том числе по кнопке "назад") не обращается к БД,
+    пока не изменилась версия каталога.
+    :return: ProductCard или None, если товар не найден
+    """
+    key = (product_id, await check_catalog_version())
+    card = _cards.get(key)
+    if card is not None:
+        _cards.move_to_end(key)
+        return card
+
+    product_info = await get_product_full_info(product_id)
+    if not product_info:
+        return None
+    return _remember(key, product_info)
+
+
+async def get_product_cards(product_ids) -> dict:
+    """
+    Пакетная версия get_product_card: недостающие в кэше карточки загружаются одним запросом
+    :return: {product_id: ProductCard}
+    """
+    version = await check_catalog_version()
+    cards = {}
+    missing = []
+    for product_id in product_ids:
+        card = _cards.get((product_id, version))
+        if card is not None:
+            _cards.move_to_end((product_id, version))
+            cards[product_id] = card
+        else:
+            missing.append(product_id)
+
+    for product_id, product_info in (await get_products_full_info(missing)).items():
+        cards[product_id] = _remember((product_id, version), product_info)
+    return cards
+
+
+@on_catalog_change
+def invalidate_product_cards():
+    """Сбросить все закэшированные карточки"""
+    _cards.clear()
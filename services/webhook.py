@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config_reader import config
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# ЗАПУСК БОТА В РЕЖИМЕ WEBHOOK
+# ==========================================
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook: сразу отвечает Telegram 200 и обрабатывает апдейт в фоне.
+    Число одновременно обрабатываемых апдейтов ограничено, а при остановке
+    сервер дожидается завершения уже принятых апдейтов.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        max_concurrent_updates: int,
+        drain_timeout: float,
+        **kwargs
+    ):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self._semaphore = asyncio.Semaphore(max_concurrent_updates)
+        self.drain_timeout = drain_timeout
+
+    async def _background_feed_update(self, bot: Bot, update: dict) -> None:
+        async with self._semaphore:
+            await super()._background_feed_update(bot, update)
+
+    async def close(self) -> None:
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logger.info("Ожидание обработки %s апдейтов перед остановкой", len(tasks))
+            done, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+        await super().close()
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot):
+    """Поднять aiohttp-сервер для webhook и работать до SIGTERM/SIGINT"""
+    if not config.webhook_base_url:
+        raise RuntimeError("Для BOT_MODE=webhook нужно задать WEBHOOK_BASE_URL")
+
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        max_concurrent_updates=config.webhook_max_concurrent_updates,
+        drain_timeout=config.webhook_drain_timeout,
+        secret_token=config.webhook_secret or None,
+    )
+    handler.register(app, path=config.webhook_path)
+    setup_application(app, dispatcher, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=config.webhook_host, port=config.webhook_port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка только по Ctrl+C через KeyboardInterrupt
+            pass
+
+    try:
+        await site.start()
+        await bot.set_webhook(
+            url=config.webhook_base_url.rstrip("/") + config.webhook_path,
+            secret_token=config.webhook_secret or None,
+            max_connections=config.webhook_max_connections,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            # По умолчанию апдейты, пришедшие во время перезапуска или выкладки, не выбрасываются
+            drop_pending_updates=config.webhook_drop_pending_updates,
+        )
+        logger.info("Webhook запущен на %s:%s%s", config.webhook_host, config.webhook_port, config.webhook_path)
+        await stop.wait()
+    finally:
+        # Сначала перестаем принимать запросы, затем дожидаемся фоновых обработчиков
+        await runner.cleanup()
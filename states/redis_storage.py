@@ -0,0 +1,108 @@
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType, StorageKey
+from aiogram.fsm.storage.redis import RedisStorage
+
+# ==========================================
+# REDIS-ХРАНИЛИЩЕ FSM С ЗАПИСЬЮ ЦЕЛИКОМ
+# ==========================================
+
+# Проверка версии и запись состояния, данных и версии одной атомарной операцией.
+# KEYS: state, data, version
+# ARGV: ожидаемое состояние, ожидаемая версия, новое состояние ('' - удалить),
+#       новые данные ('' - не менялись, '{}' - удалить), ttl состояния, ttl данных ('' - без ttl)
+SAVE_RECORD_SCRIPT = """
+local current_state = redis.call('GET', KEYS[1]) or ''
+local version = tonumber(redis.call('GET', KEYS[3]) or '0')
+if current_state ~= ARGV[1] or version ~= tonumber(ARGV[2]) then
+    return 0
+end
+
+local state_ttl = tonumber(ARGV[5])
+local data_ttl = tonumber(ARGV[6])
+
+if ARGV[3] == '' then
+    redis.call('DEL', KEYS[1])
+elseif state_ttl then
+    redis.call('SET', KEYS[1], ARGV[3], 'EX', state_ttl)
+else
+    redis.call('SET', KEYS[1], ARGV[3])
+end
+
+if ARGV[4] == '{}' then
+    redis.call('DEL', KEYS[2])
+elseif ARGV[4] ~= '' then
+    if data_ttl then
+        redis.call('SET', KEYS[2], ARGV[4], 'EX', data_ttl)
+    else
+        redis.call('SET', KEYS[2], ARGV[4])
+    end
+elseif data_ttl then
+    redis.call('EXPIRE', KEYS[2], data_ttl)
+end
+
+if data_ttl then
+    redis.call('SET', KEYS[3], version + 1, 'EX', data_ttl)
+else
+    redis.call('SET', KEYS[3], version + 1)
+end
+return 1
+"""
+
+
+def _ttl_seconds(ttl) -> str:
+    if ttl is None:
+        return ""
+    if hasattr(ttl, "total_seconds"):
+        return str(int(ttl.total_seconds()))
+    return str(int(ttl))
+
+
+class RedisRecordStorage(RedisStorage):
+    """
+    RedisStorage с поддержкой load_record/save_record:
+    чтение записи - один MGET, запись - один вызов Lua-скрипта.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._save_script = self.redis.register_script(SAVE_RECORD_SCRIPT)
+
+    def _record_keys(self, key: StorageKey):
+        return (
+            self.key_builder.build(key, "state"),
+            self.key_builder.build(key, "data"),
+            self.key_builder.build(key, "version"),
+        )
+
+    async def load_record(self, key: StorageKey):
+        state, data, version = await self.redis.mget(self._record_keys(key))
+        if isinstance(state, bytes):
+            state = state.decode("utf-8")
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return state, self.json_loads(data) if data else {}, int(version or 0)
+
+    async def save_record(self, key: StorageKey, state: StateType, data: Optional[Dict[str, Any]],
+                          expected_state: Optional[str], expected_version: int) -> bool:
+        value = state.state if isinstance(state, State) else state
+        if data is None:
+            data_value = ""
+        elif not data:
+            data_value = "{}"
+        else:
+            data_value = self.json_dumps(data)
+
+        saved = await self._save_script(
+            keys=self._record_keys(key),
+            args=[
+                expected_state or "",
+                expected_version,
+                value or "",
+                data_value,
+                _ttl_seconds(self.state_ttl),
+                _ttl_seconds(self.data_ttl),
+            ]
+        )
+        return bool(saved)
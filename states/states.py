@@ -1,18 +1,9 @@
+from collections import namedtuple
+
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 from keyboards import builders
-from sqlalchemy import select, func
-from data.model import (
-    AsyncSessionLocal,
-    Categories,
-    AccessoryBrands,
-    DeviceModels,
-    DeviceBrands,
-    Series,
-    Variations,
-    Colors,
-    Products
-)
+from data.facets import get_facet_index
 
 class ChoseProduct(StatesGroup):
     """Состояния для выбора аксессуара"""
@@ -50,251 +41,168 @@ STATE_DATA_REQUIREMENTS = {
     ChoseProduct.showing_products: ["chosen_category", "chosen_accessory_brand"],
 }
 
+# Фасет индекса и выбранные ранее фильтры, от которых зависит опциональный этап
+STATE_FACETS = {
+    ChoseProduct.showing_device_brands: ("device_brand", ["category", "accessory_brand"]),
+    ChoseProduct.showing_device_models: ("device_model", ["category", "accessory_brand", "device_brand"]),
+    ChoseProduct.showing_series: ("series", ["category", "accessory_brand", "device_model"]),
+    ChoseProduct.showing_variations: ("variation", ["category", "accessory_brand", "device_model", "series"]),
+    ChoseProduct.showing_colors: ("color", ["category", "accessory_brand", "device_model", "series", "variation"]),
+}
+
+# Фильтры списка товаров
+PRODUCT_FILTERS = ["category", "accessory_brand", "device_model", "series", "variation", "color"]
+
+# Следующий этап воронки и варианты выбора для его клавиатуры
+NextStep = namedtuple("NextStep", ["state", "items"])
+
+def chosen_filters(data: dict, facets: list) -> dict:
+    """Фильтры индекса из выбранных пользователем значений (chosen_*)"""
+    return {facet: data.get(f"chosen_{facet}") for facet in facets}
+
+def state_items(index, state, data: dict):
+    """
+    Варианты выбора для этапа по снимку индекса фасетов.
+    Возвращает None, если этап нужно пропустить.
+    
+    ВАЖНО: Категория и бренд аксессуара - обязательные этапы (показываются всегда)
+    Остальные этапы - опциональные (показываются, если есть из чего выбрать)
+    """
+    if state == ChoseProduct.showing_categories:
+        return index.all_values("category")
+    
+    category_id = data.get("chosen_category")
+    if not category_id:
+        return None
+    
+    if state == ChoseProduct.showing_accessory_brands:
+        return index.values("accessory_brand", category=category_id)
+    
+    if state == ChoseProduct.showing_products:
+        # Всегда показываем список продуктов, если дошли до этого этапа
+        return index.products(**chosen_filters(data, PRODUCT_FILTERS))
+    
+    if not data.get("chosen_accessory_brand") or state not in STATE_FACETS:
+        return None
+    
+    facet, facets = STATE_FACETS[state]
+    items = index.values(facet, **chosen_filters(data, facets))
+    return items or None
+
 async def should_show_state(state, data: dict) -> bool:
     """
     Проверяет, нужно ли показывать данное состояние пользователю.
     Возвращает True, если есть варианты для выбора, иначе False.
-    
-    ВАЖНО: Категория и бренд аксессуара - обязательные этапы (всегда True)
-    Остальные этапы - опциональные (проверяем наличие данных в БД)
     """
-    async with AsyncSessionLocal() as session:
-        if state == ChoseProduct.showing_categories:
-            # Всегда показываем категории (обязательный этап)
-            return True
-        
-        elif state == ChoseProduct.showing_accessory_brands:
-            # Всегда показываем бренды аксессуаров (обязательный этап)
-            # Это обязательное поле в модели Products
-            category_id = data.get("chosen_category")
-            if not category_id:
-                return False
-            return True
-        
-        elif state == ChoseProduct.showing_device_brands:
-            # Проверяем наличие брендов устройств
-            category_id = data.get("chosen_category")
-            accessory_brand_id = data.get("chosen_accessory_brand")
-            if not category_id or not accessory_brand_id:
-                return False
-            
-            stmt = (
-                select(func.count(func.distinct(DeviceModels.device_brand_id)))
-                .join(Products, Products.device_model_id == DeviceModels.id)
-                .where(
-                    Products.category_id == category_id,
-                    Products.accessory_brand_id == accessory_brand_id,
-                    Products.is_active == True,
-                    DeviceModels.device_brand_id.isnot(None)
-                )
-            )
-            result = await session.execute(stmt)
-            return result.scalar() > 0
-        
-        elif state == ChoseProduct.showing_device_models:
-            # Проверяем наличие моделей устройств
-            category_id = data.get("chosen_category")
-            accessory_brand_id = data.get("chosen_accessory_brand")
-            device_brand_id = data.get("chosen_device_brand")
-            if not category_id or not accessory_brand_id:
-                return False
-            
-            stmt = (
-                select(func.count(func.distinct(Products.device_model_id)))
-                .where(
-                    Products.category_id == category_id,
-                    Products.accessory_brand_id == accessory_brand_id,
-                    Products.is_active == True,
-                    Products.device_model_id.isnot(None)
-                )
-            )
-            if device_brand_id:
-                stmt = stmt.join(DeviceModels, Products.device_model_id == DeviceModels.id).where(
-                    DeviceModels.device_brand_id == device_brand_id
-                )
-            result = await session.execute(stmt)
-            return result.scalar() > 0
-        
-        elif state == ChoseProduct.showing_series:
-            # Проверяем наличие серий
-            category_id = data.get("chosen_category")
-            accessory_brand_id = data.get("chosen_accessory_brand")
-            device_model_id = data.get("chosen_device_model")
-            if not category_id or not accessory_brand_id:
-                return False
-            
-            stmt = (
-                select(func.count(func.distinct(Products.series_id)))
-                .where(
-                    Products.category_id == category_id,
-                    Products.accessory_brand_id == accessory_brand_id,
-                    Products.is_active == True,
-                    Products.series_id.isnot(None)
-                )
-            )
-            if device_model_id:
-                stmt = stmt.where(Products.device_model_id == device_model_id)
-            result = await session.execute(stmt)
-            return result.scalar() > 0
-        
-        elif state == ChoseProduct.showing_variations:
-            # Проверяем наличие вариаций
-            category_id = data.get("chosen_category")
-            accessory_brand_id = data.get("chosen_accessory_brand")
-            device_model_id = data.get("chosen_device_model")
-            series_id = data.get("chosen_series")
-            if not category_id or not accessory_brand_id:
-                return False
-            
-            stmt = (
-                select(func.count(func.distinct(Products.variation_id)))
-                .where(
-                    Products.category_id == category_id,
-                    Products.accessory_brand_id == accessory_brand_id,
-                    Products.is_active == True,
-                    Products.variation_id.isnot(None)
-                )
-            )
-            if device_model_id:
-                stmt = stmt.where(Products.device_model_id == device_model_id)
-            if series_id:
-                stmt = stmt.where(Products.series_id == series_id)
-            result = await session.execute(stmt)
-            return result.scalar() > 0
-        
-        elif state == ChoseProduct.showing_colors:
-            # Проверяем наличие цветов
-            category_id = data.get("chosen_category")
-            accessory_brand_id = data.get("chosen_accessory_brand")
-            device_model_id = data.get("chosen_device_model")
-            series_id = data.get("chosen_series")
-            variation_id = data.get("chosen_variation")
-            if not category_id or not accessory_brand_id:
-                return False
-            
-            stmt = (
-                select(func.count(func.distinct(Products.color_id)))
-                .where(
-                    Products.category_id == category_id,
-                    Products.accessory_brand_id == accessory_brand_id,
-                    Products.is_active == True,
-                    Products.color_id.isnot(None)
-                )
-            )
-            if device_model_id:
-                stmt = stmt.where(Products.device_model_id == device_model_id)
-            if series_id:
-                stmt = stmt.where(Products.series_id == series_id)
-            if variation_id:
-                stmt = stmt.where(Products.variation_id == variation_id)
-            result = await session.execute(stmt)
-            return result.scalar() > 0
-        
-        elif state == ChoseProduct.showing_products:
-            # Всегда показываем список продуктов, если дошли до этого этапа
-            return True
-        
-        return False
+    index = await get_facet_index()
+    return state_items(index, state, data) is not None
 
-async def get_next_state(current_state, data: dict):
+async def resolve_next_state(current_state, data: dict) -> NextStep:
     """
-    Определяет следующее состояние с учетом динамического пропуска этапов.
-    Возвращает следующее состояние или None, если все этапы пройдены.
+    Определяет следующий этап воронки за один проход по снимку индекса фасетов.
+    Возвращает этап и варианты выбора для его клавиатуры; обращение к БД
+    происходит только если индекс нужно перестроить.
     """
-    try:
-        # Ищем индекс текущего состояния
-        current_index = -1
-        for i, state in enumerate(STATE_SEQUENCE):
-            if state == current_state:
-                current_index = i
-                break
-        
-        if current_index == -1:
-            # Если состояние не найдено, начинаем с первого
-            current_index = -1
-    except Exception as e:
-        print(f"Ошибка определения индекса состояния: {e}")
-        current_index = -1
+    # Ищем индекс текущего состояния (если не найдено, начинаем с первого)
+    current_index = -1
+    for i, state in enumerate(STATE_SEQUENCE):
+        if state == current_state:
+            current_index = i
+            break
     
-    # Перебираем следующие состояния
-    for i in range(current_index + 1, len(STATE_SEQUENCE)):
-        next_state = STATE_SEQUENCE[i]
-        should_show = await should_show_state(next_state, data)
-        
-        if should_show:
-            return next_state
+    index = await get_facet_index()
+    for next_state in STATE_SEQUENCE[current_index + 1:]:
+        items = state_items(index, next_state, data)
+        if items is not None:
+            return NextStep(next_state, items)
     
     # Если дошли до конца, переходим к списку продуктов
-    return ChoseProduct.showing_products
+    return NextStep(
+        ChoseProduct.showing_products,
+        index.products(**chosen_filters(data, PRODUCT_FILTERS))
+    )
+
+async def get_next_state(current_state, data: dict):
+    """
+    Определяет следующее состояние с учетом динамического пропуска этапов.
+    """
+    step = await resolve_next_state(current_state, data)
+    return step.state
 
 state_handlers = {
     ChoseProduct.showing_categories: {
-        "markup": lambda data: builders.categories_kb(),
+        "markup": lambda data, items=None: builders.categories_kb(items=items),
         "text": "Выберите категорию аксессуара"
     },
     ChoseProduct.showing_accessory_brands: {
-        "markup": lambda data: builders.accessory_brands_kb(data["chosen_category"]),
+        "markup": lambda data, items=None: builders.accessory_brands_kb(data["chosen_category"], items=items),
         "text": "Выберите бренд аксессуара"
     },
     ChoseProduct.showing_device_brands: {
-        "markup": lambda data: builders.device_brands_kb(
+        "markup": lambda data, items=None: builders.device_brands_kb(
             data.get("chosen_category"),
-            data.get("chosen_accessory_brand")
+            data.get("chosen_accessory_brand"),
+            items=items
         ),
         "text": "Выберите бренд устройства"
     },
     ChoseProduct.showing_device_models: {
-        "markup": lambda data: builders.device_models_kb(
+        "markup": lambda data, items=None: builders.device_models_kb(
             data.get("chosen_category"),
             data.get("chosen_accessory_brand"),
-            data.get("chosen_device_brand")
+            data.get("chosen_device_brand"),
+            items=items
         ),
         "text": "Выберите модель устройства"
     },
     ChoseProduct.showing_series: {
-        "markup": lambda data: builders.series_kb(
+        "markup": lambda data, items=None: builders.series_kb(
             data.get("chosen_category"),
             data.get("chosen_accessory_brand"),
-            data.get("chosen_device_model")
+            data.get("chosen_device_model"),
+            items=items
         ),
         "text": "Выберите серию"
     },
     ChoseProduct.showing_variations: {
-        "markup": lambda data: builders.variations_kb(
+        "markup": lambda data, items=None: builders.variations_kb(
             data.get("chosen_category"),
             data.get("chosen_accessory_brand"),
             data.get("chosen_device_model"),
-            data.get("chosen_series")
+            data.get("chosen_series"),
+            items=items
         ),
         "text": "Выберите вариацию"
     },
     ChoseProduct.showing_colors: {
-        "markup": lambda data: builders.colors_kb(
+        "markup": lambda data, items=None: builders.colors_kb(
             data.get("chosen_category"),
             data.get("chosen_accessory_brand"),
             data.get("chosen_device_model"),
             data.get("chosen_series"),
-            data.get("chosen_variation")
+            data.get("chosen_variation"),
+            items=items
         ),
         "text": "Выберите цвет"
     },
     ChoseProduct.showing_products: {
-        "markup": lambda data: builders.products_kb(
+        "markup": lambda data, items=None: builders.products_kb(
             data.get("chosen_category"),
             data.get("chosen_accessory_brand"),
             data.get("chosen_device_model"),
             data.get("chosen_series"),
             data.get("chosen_variation"),
-            data.get("chosen_color")
+            data.get("chosen_color"),
+            items=items
         ),
         "text": "Выберите товар"
     },
     ChoseProduct.showing_product: {
-        "markup": lambda data: builders.product_kb(),
+        "markup": lambda data, items=None: builders.product_kb(),
         "text": "Выберите количество"
     },
     ChoseProduct.selecting_quantity: {
-        "markup": lambda data: builders.quantity_kb(),
+        "markup": lambda data, items=None: builders.quantity_kb(),
         "text": "Выберите количество товара"
     }
 }
@@ -0,0 +1,231 @@
+import asyncio
+import copy
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+
+from config_reader import config
+
+# ==========================================
+# ХРАНИЛИЩА FSM
+# ==========================================
+
+# Кроме стандартного интерфейса BaseStorage, хранилища ниже умеют работать
+# с записью целиком (состояние + данные + версия), чтобы за апдейт делать одно
+# чтение и одну запись (см. middlewares/fsm.py):
+#   load_record(key) -> (state, data, version)
+#   save_record(key, state, data, expected_state, expected_version) -> bool
+# data=None в save_record - данные не менялись. Запись выполняется, только если
+# в хранилище все еще expected_state и expected_version, иначе возвращается False.
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в локальном файле SQLite.
+    Переживает перезапуск бота и не требует внешних сервисов. Записи, которые
+    не обновлялись дольше ttl секунд, считаются брошенными и удаляются.
+    """
+
+    def __init__(self, path: str, ttl: Optional[int] = None, cleanup_interval: int = 1000):
+        self.path = path
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.key_builder = DefaultKeyBuilder(with_destiny=True, with_bot_id=True)
+        self._writes = 0
+        self._lock = asyncio.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data TEXT NOT NULL DEFAULT '{}',"
+            " updated_at REAL NOT NULL"
+            ")"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_fsm_updated_at ON fsm (updated_at)")
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(fsm)")}
+        if "version" not in columns:
+            self._connection.execute("ALTER TABLE fsm ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    async def _execute(self, sql: str, params: tuple = ()):
+        async with self._lock:
+            return await asyncio.to_thread(lambda: self._connection.execute(sql, params).fetchone())
+
+    async def _read(self, key: StorageKey):
+        row = await self._execute(
+            "SELECT state, data, updated_at FROM fsm WHERE key = ?",
+            (self.key_builder.build(key),)
+        )
+        if row is None or row[2] < self._expired_before():
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    async def _write(self, sql: str, params: tuple):
+        await self._execute(sql, params)
+        self._writes += 1
+        if self.ttl is not None and self._writes % self.cleanup_interval == 0:
+            await self.cleanup()
+
+    def _expired_before(self) -> float:
+        """Записи, обновленные раньше этого момента, считаются брошенными"""
+        return time.time() - self.ttl if self.ttl is not None else float("-inf")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        # Данные брошенной сессии не воскрешаем - сбрасываем их вместе с новым состоянием
+        await self._write(
+            "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at, "
+            "data = CASE WHEN fsm.updated_at < ? THEN '{}' ELSE fsm.data END",
+            (self.key_builder.build(key), value, time.time(), self._expired_before())
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._read(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._write(
+            "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at, "
+            "state = CASE WHEN fsm.updated_at < ? THEN NULL ELSE fsm.state END",
+            (
+                self.key_builder.build(key),
+                json.dumps(data, ensure_ascii=False),
+                time.time(),
+                self._expired_before()
+            )
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._read(key)
+        return data
+
+    async def load_record(self, key: StorageKey):
+        row = await self._execute(
+            "SELECT state, data, updated_at, version FROM fsm WHERE key = ?",
+            (self.key_builder.build(key),)
+        )
+        if row is None:
+            return None, {}, 0
+        if row[2] < self._expired_before():
+            return None, {}, row[3]
+        return row[0], json.loads(row[1]), row[3]
+
+    async def save_record(self, key: StorageKey, state: StateType, data: Optional[Dict[str, Any]],
+                          expected_state: Optional[str], expected_version: int) -> bool:
+        value = state.state if isinstance(state, State) else state
+        storage_key = self.key_builder.build(key)
+        expired_before = self._expired_before()
+
+        def save():
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT state, data, updated_at, version FROM fsm WHERE key = ?",
+                    (storage_key,)
+                ).fetchone()
+                if row is None:
+                    current_state, current_data, version = None, "{}", 0
+                elif row[2] < expired_before:
+                    current_state, current_data, version = None, "{}", row[3]
+                else:
+                    current_state, current_data, version = row[0], row[1], row[3]
+
+                if current_state != expected_state or version != expected_version:
+                    connection.execute("ROLLBACK")
+                    return False
+
+                connection.execute(
+                    "INSERT INTO fsm (key, state, data, updated_at, version) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at, version = excluded.version",
+                    (
+                        storage_key,
+                        value,
+                        current_data if data is None else json.dumps(data, ensure_ascii=False),
+                        time.time(),
+                        version + 1
+                    )
+                )
+                connection.execute("COMMIT")
+                return True
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+        async with self._lock:
+            saved = await asyncio.to_thread(save)
+        self._writes += 1
+        if self.ttl is not None and self._writes % self.cleanup_interval == 0:
+            await self.cleanup()
+        return saved
+
+    async def cleanup(self) -> None:
+        """Удалить брошенные сессии старше ttl"""
+        if self.ttl is not None:
+            await self._execute("DELETE FROM fsm WHERE updated_at < ?", (self._expired_before(),))
+
+    async def close(self) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._connection.close)
+
+class MemoryRecordStorage(MemoryStorage):
+    """Хранилище в памяти процесса с поддержкой load_record/save_record"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.versions: Dict[StorageKey, int] = {}
+
+    async def load_record(self, key: StorageKey):
+        record = self.storage[key]
+        return record.state, copy.deepcopy(record.data), self.versions.get(key, 0)
+
+    async def save_record(self, key: StorageKey, state: StateType, data: Optional[Dict[str, Any]],
+                          expected_state: Optional[str], expected_version: int) -> bool:
+        record = self.storage[key]
+        version = self.versions.get(key, 0)
+        if record.state != expected_state or version != expected_version:
+            return False
+        record.state = state.state if isinstance(state, State) else state
+        if data is not None:
+            record.data = copy.deepcopy(data)
+        self.versions[key] = version + 1
+        return True
+
+def create_fsm_storage():
+    """
+    FSM-хранилище по настройке FSM_STORAGE:
+    memory - в памяти процесса (по умолчанию),
+    redis - Redis (можно запускать несколько процессов бота),
+    sqlite - локальный файл FSM_SQLITE_PATH.
+    :return: (хранилище, изоляция событий)
+    Апдейты одного пользователя обрабатываются по очереди: webhook обрабатывает их
+    в фоне параллельно, и без изоляции одно из двух быстрых нажатий отбрасывалось бы
+    как конфликт записи FSM (см. middlewares/fsm.py)
+    """
+    if config.fsm_storage == "redis":
+        from states.redis_storage import RedisRecordStorage
+
+        if not config.redis_url:
+            raise RuntimeError("Для FSM_STORAGE=redis нужно задать REDIS_URL")
+        storage = RedisRecordStorage.from_url(
+            config.redis_url,
+            key_builder=DefaultKeyBuilder(with_destiny=True, with_bot_id=True),
+            state_ttl=config.fsm_ttl,
+            data_ttl=config.fsm_ttl,
+        )
+        # Блокировки в Redis, чтобы апдейты одного пользователя не обрабатывались параллельно в разных процессах
+        return storage, storage.create_isolation()
+
+    # Блокировки в памяти процесса: этим хранилищам нужен один процесс бота
+    if config.fsm_storage == "sqlite":
+        return SQLiteStorage(config.fsm_sqlite_path, ttl=config.fsm_ttl), SimpleEventIsolation()
+
+    return MemoryRecordStorage(), SimpleEventIsolation()
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# Настройки читаются при импорте config_reader, а движки БД создаются при импорте data.model,
+# поэтому временная SQLite-база задается до импорта модулей бота
+_db_path = os.path.join(tempfile.mkdtemp(prefix="shop-bot-tests-"), "test.sqlite3")
+os.environ.update(
+    BOT_TOKEN="123456:test-token",
+    SECRET_KEY="test",
+    DB_LINK=f"sqlite:///{_db_path}",
+    DB_LINK_ASYNC=f"sqlite+aiosqlite:///{_db_path}",
+    FSM_STORAGE="memory",
+    METRICS_PORT="0",
+)
+
+from data.model import (  # noqa: E402
+    AccessoryBrands,
+    Admins,
+    AsyncSessionLocal,
+    Base,
+    Categories,
+    Colors,
+    DeviceBrands,
+    DeviceModels,
+    OrderStatuses,
+    ProductImages,
+    Products,
+    engine,
+)
+
+# Небольшой каталог: 3 категории x 3 бренда, у каждого продукта главное фото его цвета,
+# каждый пятый продукт выключен, у половины фото уже есть file_id
+PRODUCTS_COUNT = 90
+
+
+async def _seed():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with AsyncSessionLocal() as session:
+        session.add_all([Categories(id=i, name=f"Категория {i}", sort_order=i) for i in range(1, 4)])
+        session.add_all([AccessoryBrands(id=i, name=f"Бренд {i}") for i in range(1, 4)])
+        session.add_all([DeviceBrands(id=1, name="Apple"), DeviceBrands(id=2, name="Samsung")])
+        session.add_all([
+            DeviceModels(id=i, name=f"Модель {i}", device_brand_id=i % 2 + 1) for i in range(1, 6)
+        ])
+        session.add_all([Colors(id=i, name=f"Цвет {i}") for i in range(1, 4)])
+        session.add(OrderStatuses(id=1, name="В работе"))
+        session.add(Admins(id=1, username="admin", chat_id=1))
+        session.add_all([
+            Products(
+                id=i,
+                category_id=i % 3 + 1,
+                accessory_brand_id=i // 3 % 3 + 1,
+                device_model_id=i % 5 + 1,
+                color_id=i // 9 % 3 + 1,
+                price=100 + i,
+                is_active=i % 5 != 0
+            )
+            for i in range(1, PRODUCTS_COUNT + 1)
+        ])
+        session.add_all([
+            ProductImages(
+                id=i,
+                path=f"product_{i}.jpg",
+                is_main=True,
+                product_id=i,
+                color_id=i // 9 % 3 + 1,
+                telegram_file_id=f"file-{i}" if i % 2 else None
+            )
+            for i in range(1, PRODUCTS_COUNT + 1)
+        ])
+        await session.commit()
+
+
+@pytest.fixture(scope="session")
+def seeded_db():
+    """Временная БД со схемой из моделей и тестовым каталогом"""
+    asyncio.run(_seed())
@@ -0,0 +1,61 @@
+"""Изменения каталога в админке: catalog_facets и версия каталога обновляются в транзакции правки"""
+
+import pytest
+from sqlalchemy import func, select
+
+from data import crud
+from data.model import CatalogFacets, CatalogVersion, ProductImages, Products
+
+
+def _version(session) -> int:
+    return session.execute(select(CatalogVersion.version).where(CatalogVersion.id == 1)).scalar() or 0
+
+
+def _facet_rows(session, product_id: int) -> int:
+    return session.execute(
+        select(func.count()).select_from(CatalogFacets).where(CatalogFacets.product_id == product_id)
+    ).scalar()
+
+
+def test_edit_refreshes_facets_in_same_commit(seeded_db):
+    with crud.SyncSessionLocal() as session:
+        version = _version(session)
+        crud.mark_catalog_change_sync(session)
+        session.add(Products(id=1001, category_id=1, accessory_brand_id=1, price=10, is_active=True))
+        session.commit()
+
+        assert _facet_rows(session, 1001) == 1
+        assert _version(session) == version + 1
+
+
+def test_failed_refresh_rolls_back_edit(seeded_db, monkeypatch):
+    def broken_refresh(session):
+        raise RuntimeError("catalog_facets недоступна")
+
+    monkeypatch.setattr(crud, "refresh_catalog_facets_sync", broken_refresh)
+    with crud.SyncSessionLocal() as session:
+        version = _version(session)
+        crud.mark_catalog_change_sync(session)
+        session.add(Products(id=1002, category_id=1, accessory_brand_id=2, price=10, is_active=True))
+        with pytest.raises(RuntimeError):
+            session.commit()
+        session.rollback()
+
+        assert session.get(Products, 1002) is None
+        assert _version(session) == version
+        # Отметка не переживает откат: следующий commit без изменений каталога ее не применит
+        session.commit()
+        assert _version(session) == version
+
+
+def test_image_edit_bumps_version_only(seeded_db, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(crud, "refresh_catalog_facets_sync", refreshed.append)
+    with crud.SyncSessionLocal() as session:
+        version = _version(session)
+        crud.mark_catalog_change_sync(session, refresh_facets=False)
+        session.get(ProductImages, 1).is_main = True
+        session.commit()
+
+        assert refreshed == []
+        assert _version(session) == version + 1
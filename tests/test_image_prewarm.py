@@ -0,0 +1,139 @@
+"""Фоновая загрузка фото: повторы по RetryAfter, пауза между ошибками, пропуск фото без файла"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter, TelegramServerError
+from aiogram.methods import SendPhoto
+
+from services import image_prewarm
+from services.image_prewarm import ImagePrewarmer, image_uploads
+
+
+class FakeBot:
+    """Замена Bot API: send_photo отвечает по очереди заданными ошибками, затем фото с file_id"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(photo.path)
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"small-{len(self.sent)}"),
+                                      SimpleNamespace(file_id=f"file-{len(self.sent)}")])
+
+
+def _retry_after(seconds: int):
+    return TelegramRetryAfter(method=SendPhoto(chat_id=1, photo="x"), message="Too Many Requests", retry_after=seconds)
+
+
+def _server_error():
+    return TelegramServerError(method=SendPhoto(chat_id=1, photo="x"), message="Bad Gateway")
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    """Фото без file_id (файлы во временной папке), сохраненные file_id и паузы вместо ожидания"""
+    rows = []
+    saved = {}
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def get_images_without_file_id():
+        return [dict(row) for row in rows if row["id"] not in saved]
+
+    async def save_image_file_id(image_id, file_id, content_hash):
+        saved[image_id] = file_id
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        await real_sleep(0)
+
+    def add(image_id, exists=True):
+        path = tmp_path / f"{image_id}.jpg"
+        if exists:
+            path.write_bytes(b"jpeg" * image_id)
+        rows.append({"id": image_id, "path": str(path)})
+        return rows[-1]
+
+    monkeypatch.setattr(image_prewarm, "get_images_without_file_id", get_images_without_file_id)
+    monkeypatch.setattr(image_prewarm, "save_image_file_id", save_image_file_id)
+    monkeypatch.setattr(image_prewarm.asyncio, "sleep", sleep)
+    image_uploads.clear()
+    return SimpleNamespace(add=add, saved=saved, sleeps=sleeps, tmp_path=tmp_path, real_sleep=real_sleep)
+
+
+def test_retry_after_and_backoff(images):
+    images.add(1)
+    bot = FakeBot(_retry_after(7), _server_error(), _server_error())
+    prewarmer = ImagePrewarmer(bot, chat_id=-100, max_attempts=5)
+
+    progress = asyncio.run(prewarmer.run_once())
+
+    # RetryAfter - ровно указанная пауза, ошибки сервера - растущая пауза
+    assert images.sleeps == [7, 1, 2]
+    assert images.saved == {1: "file-4"}
+    assert progress["uploaded"] == 1
+    assert progress["retries"] == 3
+    assert progress["failed"] == 0
+
+
+def test_gives_up_after_max_attempts(images):
+    images.add(1)
+    bot = FakeBot(*(_server_error() for _ in range(3)))
+    prewarmer = ImagePrewarmer(bot, chat_id=-100, max_attempts=3)
+
+    progress = asyncio.run(prewarmer.run_once())
+
+    assert len(bot.sent) == 3
+    assert images.sleeps == [1, 2]
+    assert images.saved == {}
+    assert progress["failed"] == 1
+
+
+def test_missing_file_skipped_until_path_changes(images):
+    image = images.add(1, exists=False)
+    bot = FakeBot()
+    prewarmer = ImagePrewarmer(bot, chat_id=-100)
+
+    async def passes():
+        first = dict(await prewarmer.run_once())
+        second = dict(await prewarmer.run_once())
+        # Админка заменила файл: новый путь проверяется и загружается
+        new_path = images.tmp_path / "1-new.jpg"
+        new_path.write_bytes(b"jpeg")
+        image["path"] = str(new_path)
+        third = dict(await prewarmer.run_once())
+        return first, second, third
+
+    first, second, third = asyncio.run(passes())
+
+    assert first["missing"] == 1
+    assert second["missing"] == 1 and second["pending"] == 0
+    assert third["missing"] == 0 and third["uploaded"] == 1
+    assert bot.sent == [image["path"]]
+    assert images.saved == {1: "file-1"}
+
+
+def test_waits_for_upload_started_by_card_view(images):
+    images.add(1)
+    bot = FakeBot()
+    prewarmer = ImagePrewarmer(bot, chat_id=-100)
+
+    async def card_view_uploading():
+        # Показ карточки начал загрузку этого фото раньше прогрева
+        upload = image_uploads.start(1)
+        prewarm = asyncio.create_task(prewarmer.run_once())
+        # Прогрев дошел до этого фото и ждет чужую загрузку
+        await images.real_sleep(0.2)
+        assert not prewarm.done()
+        image_uploads.finish(1, upload, "card-file")
+        return await prewarm
+
+    progress = asyncio.run(card_view_uploading())
+
+    assert bot.sent == []
+    assert progress["uploaded"] == 1
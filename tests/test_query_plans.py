@@ -0,0 +1,111 @@
+"""
+Планы горячих запросов бота: каждый должен идти по своему индексу.
+
+Тест вызывает настоящие функции data.crud на тестовой SQLite-базе, перехватывает
+выполненные запросы и запускает для них EXPLAIN QUERY PLAN с настройками
+планировщика по умолчанию. SQLite применяет частичный индекс, только если
+условие запроса совпадает с его условием, поэтому пропавший или переставший
+подходить индекс сразу виден по плану.
+"""
+
+import asyncio
+import re
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from data import crud
+from data.model import engine
+
+# Индекс уникального ограничения uq_cart_items_user_product: SQLite называет такие индексы сам
+CART_ITEMS_INDEX = "sqlite_autoindex_cart_items_1"
+
+USER_ID = 777
+
+# Таблицы, которые горячие запросы читают целиком намеренно
+ALLOWED_FULL_SCANS = {
+    "admins",  # все админы получают уведомление о заказе
+}
+
+# Имя теста, вызов функции crud и индексы, которые должны быть в планах ее запросов
+HOT_QUERIES = [
+    ("product_card", lambda: crud.get_product_full_info(1), ["ix_product_images_main"]),
+    ("product_cards_batch", lambda: crud.get_products_full_info([1, 2, 3]), ["ix_product_images_main"]),
+    ("product_image", lambda: crud.get_product_image_record(1, 1), ["ix_product_images_main"]),
+    ("images_without_file_id", lambda: crud.get_images_without_file_id(10), ["ix_product_images_without_file_id"]),
+    (
+        "funnel_count",
+        lambda: crud.count_products(category_id=2, accessory_brand_id=1),
+        ["ix_products_active_funnel"]
+    ),
+    (
+        "funnel_products",
+        lambda: crud.get_products_for_selection(category_id=2, accessory_brand_id=1, device_model_id=2, limit=10),
+        ["ix_products_active_funnel"]
+    ),
+    ("cart_summary", lambda: crud.get_cart_summary(USER_ID), [CART_ITEMS_INDEX]),
+    (
+        "make_order",
+        lambda: crud.make_order(USER_ID, datetime.now(), lambda order: "plan-check"),
+        [CART_ITEMS_INDEX, "ix_order_items_order_id"]
+    ),
+    ("clear_cart", lambda: crud.clear_user_cart(USER_ID), [CART_ITEMS_INDEX]),
+]
+
+# Запросы, план которых зависит от индексов (INSERT без подзапросов не проверяем)
+EXPLAINABLE = re.compile(r"^\s*(SELECT|UPDATE|DELETE|WITH|INSERT\b.*\bSELECT\b)", re.I | re.S)
+
+
+def _full_scans(plan: list) -> set:
+    """Таблицы, которые план читает целиком ("SCAN t USING INDEX ..." - обход индекса)"""
+    tables = set()
+    for line in plan:
+        match = re.match(r"\s*SCAN (?:TABLE )?(\w+)(?!.*USING (?:COVERING )?INDEX)", line)
+        if match:
+            tables.add(match.group(1))
+    return tables - ALLOWED_FULL_SCANS
+
+
+async def _explain_call(call) -> list:
+    """Выполнить вызов crud и вернуть [(запрос, строки плана)] для его запросов"""
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and EXPLAINABLE.match(statement):
+            captured.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        await call()
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+    plans = []
+    async with engine.connect() as connection:
+        for statement, parameters in captured:
+            result = await connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+            plans.append((statement, [row[-1] for row in result]))
+    return plans
+
+
+@pytest.fixture(scope="module")
+def cart(seeded_db):
+    """Корзина покупателя для запросов корзины и заказа"""
+    async def fill():
+        await crud.add_cart_item(1, USER_ID, 2, "plan-check")
+        await crud.add_cart_item(2, USER_ID, 1, "plan-check")
+
+    asyncio.run(fill())
+
+
+@pytest.mark.parametrize("call, indexes", [query[1:] for query in HOT_QUERIES], ids=[query[0] for query in HOT_QUERIES])
+def test_hot_query_uses_index(cart, call, indexes):
+    plans = asyncio.run(_explain_call(call))
+    assert plans, "функция не выполнила ни одного запроса"
+
+    plan_text = "\n".join(line for _, plan in plans for line in plan)
+    for statement, plan in plans:
+        assert not _full_scans(plan), f"полное чтение таблицы:\n{statement}\n" + "\n".join(plan)
+    for index in indexes:
+        assert f"INDEX {index}" in plan_text, f"в планах нет индекса {index}:\n{plan_text}"